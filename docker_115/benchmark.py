@@ -0,0 +1,232 @@
+# 性能基准测试脚本
+# 用法: python benchmark.py qr [--rounds 200]
+#       python benchmark.py rate_limit [--heavy 500] [--light-users 9]
+#       python benchmark.py bot_fairness [--heavy 40] [--slots 8]
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import qrcode
+
+from qr_render import QrRenderer, render_qr_png
+from rate_limiter import FairRateLimiter
+from telegram.request import BaseRequest
+
+# 与 115 authDeviceCode 返回的 qrcode 字段长度相近的示例内容
+SAMPLE_PAYLOAD = "https://115.com/scan/dg-1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b?uid=0123456789abcdef0123456789abcdef"
+
+
+def render_legacy(payload):
+    """旧实现：box_size=10, border=5，默认参数保存 PNG"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    bio = io.BytesIO()
+    img.save(bio, 'PNG')
+    return bio.getvalue()
+
+
+def time_render(func, rounds):
+    timings = []
+    size = 0
+    for i in range(rounds):
+        # 每轮使用不同内容，避免测到任何缓存
+        payload = f"{SAMPLE_PAYLOAD}&t={i}"
+        start = time.perf_counter()
+        size = len(func(payload))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(timings), statistics.median(timings), size
+
+
+def bench_qr(args):
+    print(f"QR 渲染基准（{args.rounds} 轮）")
+    print(f"{'实现':<10}{'平均(ms)':>10}{'中位(ms)':>10}{'PNG字节':>10}")
+    for name, func in (("legacy", render_legacy), ("1-bit", render_qr_png)):
+        mean, median, size = time_render(func, args.rounds)
+        print(f"{name:<10}{mean:>10.2f}{median:>10.2f}{size:>10}")
+
+    # 二维码刷新时同一内容再次发送，走缓存
+    async def cached_rounds():
+        renderer = QrRenderer()
+        await renderer.render(SAMPLE_PAYLOAD)
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            png = await renderer.render(SAMPLE_PAYLOAD)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.mean(timings), statistics.median(timings), len(png)
+
+    mean, median, size = asyncio.run(cached_rounds())
+    print(f"{'cached':<10}{mean:>10.3f}{median:>10.3f}{size:>10}")
+
+
+def bench_rate_limit(args):
+    """一个用户连续提交大量请求，同时其他用户各提交少量请求，观察放行顺序是否公平"""
+    async def run():
+        limiter = FairRateLimiter(
+            user_rate=args.user_rate, user_burst=2,
+            account_rate=args.user_rate, account_burst=2,
+            global_rate=args.global_rate, global_burst=5
+        )
+        served = []
+        start = time.perf_counter()
+
+        async def submit(user):
+            await limiter.acquire(user, account_key=user)
+            served.append((time.perf_counter() - start, user))
+
+        tasks = [submit("heavy") for _ in range(args.heavy)]
+        for i in range(args.light_users):
+            tasks.extend(submit(f"light{i}") for _ in range(args.light))
+        await asyncio.gather(*tasks)
+        return served
+
+    served = asyncio.run(run())
+    finish = {}
+    for elapsed, user in served:
+        finish[user] = elapsed
+    first_window = [user for _, user in served[:args.light_users * args.light + args.light_users]]
+    light_total = args.light_users * args.light
+
+    print(f"公平性压测：heavy 用户 {args.heavy} 次，{args.light_users} 个 light 用户各 {args.light} 次，"
+          f"全局 {args.global_rate}/s，单用户 {args.user_rate}/s")
+    print(f"总耗时 {served[-1][0]:.2f}s")
+    print(f"heavy 完成时间：{finish['heavy']:.2f}s")
+    light_finish = [finish[f"light{i}"] for i in range(args.light_users)]
+    print(f"light 完成时间：最早 {min(light_finish):.2f}s，最晚 {max(light_finish):.2f}s")
+    print(f"前 {len(first_window)} 次放行中 light 用户占 "
+          f"{sum(1 for u in first_window if u != 'heavy')}/{light_total} 次（FIFO 时为 0）")
+
+
+class FakeTelegramRequest(BaseRequest):
+    """代替 Bot API 的请求对象：getMe 返回固定用户，sendMessage 记录发送时间和内容"""
+
+    def __init__(self):
+        self.sent = []  # (时间, chat_id, text)
+        self.message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif endpoint == "sendMessage":
+            self.sent.append((time.perf_counter(), int(params["chat_id"]), params["text"]))
+            self.message_id += 1
+            result = {"message_id": self.message_id, "date": int(time.time()), "text": params["text"],
+                      "chat": {"id": int(params["chat_id"]), "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def bench_bot_fairness(args):
+    """通过 Application 分发更新：heavy 用户连续发送大量链接消息后，light 用户发送一条，
+    比较处理函数在限流队列中等待（blocking）与入队后立即返回（queued）时 light 用户收到结果的延迟"""
+    directory = tempfile.mkdtemp()
+    os.environ.update({
+        "TOKEN_DB_PATH": os.path.join(directory, "tokens.db"),
+        "TASK_DB_PATH": os.path.join(directory, "tasks.db"),
+        "RETRY_DB_PATH": os.path.join(directory, "retry_queue.db"),
+        "RATE_USER_PER_MINUTE": str(args.user_rate * 60), "RATE_USER_BURST": "1",
+        "RATE_ACCOUNT_PER_MINUTE": str(args.user_rate * 60), "RATE_ACCOUNT_BURST": "1",
+        "RATE_GLOBAL_PER_MINUTE": "60000", "RATE_GLOBAL_BURST": "100",
+        "LOG_LEVEL": "WARNING",
+    })
+    import main
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+    async def fake_add_task_urls(access_token, links):
+        await asyncio.sleep(0.01)
+        return [(link, True, "", None) for link in links]
+    main.add_task_urls = fake_add_task_urls
+
+    heavy, light = 1001, 1002
+    for user_id in (heavy, light):
+        main.token_cache.put(user_id, {"access_token": f"token{user_id}", "refresh_token": "r", "expires_in": 7200})
+
+    async def blocking_handler(update, context):
+        """旧实现：在处理函数中等待限流放行并提交，完成后再返回"""
+        user_id = update.effective_user.id
+        token_info = await main.token_cache.get_valid_token(user_id)
+        results = await main.submit_links(user_id, token_info, main.extract_links(update.message.text))
+        for text in main.format_results(results):
+            await update.message.reply_text(text)
+
+    def make_update(update_id, user_id, bot):
+        link = f"magnet:?xt=urn:btih:{update_id:040x}"
+        return Update.de_json({"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": link,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": str(user_id)}}}, bot)
+
+    async def run(handler):
+        request = FakeTelegramRequest()
+        app = (ApplicationBuilder().token("1:bench").request(request).get_updates_request(FakeTelegramRequest())
+               .concurrent_updates(args.slots).build())
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handler))
+        await app.initialize()
+        await app.start()
+        for i in range(args.heavy):
+            await app.update_queue.put(make_update(i + 1, heavy, app.bot))
+        await asyncio.sleep(0.05)
+        sent_at = time.perf_counter()
+        await app.update_queue.put(make_update(args.heavy + 1, light, app.bot))
+
+        def results_for(user_id):
+            return [at for at, chat_id, text in request.sent if chat_id == user_id and "添加" in text]
+        while len(results_for(heavy)) < args.heavy or not results_for(light):
+            await asyncio.sleep(0.01)
+        await app.stop()
+        await app.shutdown()
+        return results_for(light)[0] - sent_at, max(results_for(heavy)) - sent_at
+
+    print(f"heavy 用户 {args.heavy} 条消息（每用户 {args.user_rate}/s），concurrent_updates={args.slots}，"
+          f"之后 light 用户 1 条消息")
+    print(f"{'处理方式':<10}{'light 延迟(s)':>14}{'heavy 完成(s)':>14}")
+    for name, handler in (("blocking", blocking_handler), ("queued", main.handle_magnet)):
+        light_delay, heavy_done = asyncio.run(run(handler))
+        print(f"{name:<10}{light_delay:>14.2f}{heavy_done:>14.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="115 bot 基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    qr_parser = subparsers.add_parser("qr", help="二维码渲染耗时与图片大小")
+    qr_parser.add_argument("--rounds", type=int, default=200)
+    rate_parser = subparsers.add_parser("rate_limit", help="限流器公平性压测")
+    rate_parser.add_argument("--heavy", type=int, default=500, help="heavy 用户的请求数")
+    rate_parser.add_argument("--light-users", type=int, default=9)
+    rate_parser.add_argument("--light", type=int, default=5, help="每个 light 用户的请求数")
+    rate_parser.add_argument("--global-rate", type=float, default=200.0, help="全局每秒放行数")
+    rate_parser.add_argument("--user-rate", type=float, default=100.0, help="单用户每秒放行数")
+    bot_parser = subparsers.add_parser("bot_fairness", help="通过 Application 分发更新，检查 light 用户是否被饿死")
+    bot_parser.add_argument("--heavy", type=int, default=40, help="heavy 用户发送的消息数")
+    bot_parser.add_argument("--slots", type=int, default=8, help="concurrent_updates")
+    bot_parser.add_argument("--user-rate", type=float, default=4.0, help="单用户每秒提交次数")
+    args = parser.parse_args()
+
+    if args.command == "qr":
+        bench_qr(args)
+    elif args.command == "rate_limit":
+        bench_rate_limit(args)
+    elif args.command == "bot_fairness":
+        bench_bot_fairness(args)
@@ -0,0 +1,113 @@
+# 本地模拟的 115 离线下载接口，用于测试任务提交与状态跟踪
+# 用法: python fake_115.py [--port 8115] [--finish-after 30]
+# 然后设置 PROAPI_BASE_URL=http://127.0.0.1:8115 启动 bot
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from magnet_utils import get_btih, link_display_name
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 30
+
+
+class FakeOfflineService:
+    """按 Authorization 头区分账号，任务在 finish_after 秒后完成；链接中包含 fail 的任务会失败"""
+
+    def __init__(self, finish_after):
+        self.finish_after = finish_after
+        self.tasks = {}  # token -> [task]
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def add_tasks(self, token, urls):
+        results = []
+        with self.lock:
+            account_tasks = self.tasks.setdefault(token, [])
+            for url in urls:
+                info_hash = get_btih(url) or hashlib.sha1(url.encode()).hexdigest()
+                account_tasks.insert(0, {
+                    "info_hash": info_hash,
+                    "name": link_display_name(url),
+                    "url": url,
+                    "add_time": time.time(),
+                })
+                results.append({"state": True, "code": 0, "message": "", "info_hash": info_hash, "url": url})
+        return {"state": True, "code": 0, "message": "", "data": results}
+
+    def task_list(self, token, page):
+        now = time.time()
+        with self.lock:
+            account_tasks = list(self.tasks.get(token, []))
+        page_count = max(1, (len(account_tasks) + PAGE_SIZE - 1) // PAGE_SIZE)
+        items = []
+        for task in account_tasks[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]:
+            elapsed = now - task["add_time"]
+            if elapsed < self.finish_after:
+                status, percent = 1, int(elapsed * 100 / self.finish_after)
+            elif "fail" in task["url"]:
+                status, percent = -1, 0
+            else:
+                status, percent = 2, 100
+            items.append({"info_hash": task["info_hash"], "name": task["name"],
+                          "status": status, "percentDone": percent})
+        return {"state": True, "code": 0, "message": "",
+                "data": {"page": page, "page_count": page_count, "count": len(account_tasks), "tasks": items}}
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, body, status=200):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _token(self):
+            return self.headers.get("Authorization", "").replace("Bearer ", "", 1)
+
+        def do_POST(self):
+            service.request_count += 1
+            path = urlsplit(self.path).path
+            if path != "/open/offline/add_task_urls":
+                self._reply({"state": False, "message": "not found"}, 404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            urls = [u for u in form.get("urls", [""])[0].split("\n") if u.strip()]
+            self._reply(service.add_tasks(self._token(), urls))
+
+        def do_GET(self):
+            service.request_count += 1
+            parts = urlsplit(self.path)
+            if parts.path != "/open/offline/get_task_list":
+                self._reply({"state": False, "message": "not found"}, 404)
+                return
+            page = int(parse_qs(parts.query).get("page", ["1"])[0])
+            self._reply(service.task_list(self._token(), page))
+
+        def log_message(self, format, *args):
+            logger.info(f"[{service.request_count}] " + format % args)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模拟 115 离线下载接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8115)
+    parser.add_argument("--finish-after", type=float, default=30, help="任务完成所需秒数")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(FakeOfflineService(args.finish_after)))
+    logger.info(f"Fake 115 offline API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
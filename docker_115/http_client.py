@@ -0,0 +1,59 @@
+# 115 API 共享异步 HTTP 客户端
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHttpClient:
+    """所有 115 接口共用的异步 HTTP 客户端
+
+    - 底层使用一个 httpx.AsyncClient，保持 keep-alive 连接池复用
+    - 每个主机一个信号量，限制同时发往该主机的请求数
+    - 超时时间可配置，避免某个慢接口长期占用连接
+    """
+
+    def __init__(self, timeout=15.0, connect_timeout=5.0, max_connections=100,
+                 max_keepalive_connections=20, per_host_limit=10):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.per_host_limit = per_host_limit
+        self._client = None
+        self._host_semaphores = {}
+
+    def _get_client(self):
+        # 延迟创建，保证在事件循环中初始化
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def request(self, method, url, **kwargs):
+        """发送请求，受按主机并发上限约束"""
+        async with self._host_semaphore(url):
+            logger.debug(f"{method} {url}")
+            return await self._get_client().request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
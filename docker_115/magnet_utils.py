@@ -0,0 +1,75 @@
+# 离线下载链接提取工具
+import base64
+import re
+from urllib.parse import parse_qs, urlsplit
+
+# 支持的链接：磁力、ed2k、http(s)
+LINK_PATTERN = re.compile(
+    r'magnet:\?[^\s<>"\']+'
+    r'|ed2k://\|file\|[^\s<>"\']+?\|/'
+    r'|https?://[^\s<>"\']+',
+    re.IGNORECASE
+)
+BTIH_PATTERN = re.compile(r'urn:btih:([A-Za-z0-9]+)', re.IGNORECASE)
+
+
+def get_btih(link):
+    """返回磁力链接的 btih（统一为小写 40 位十六进制），不是磁力链接或无法解析时返回 None"""
+    if not link.lower().startswith("magnet:?"):
+        return None
+    match = BTIH_PATTERN.search(link)
+    if not match:
+        return None
+    info_hash = match.group(1)
+    if len(info_hash) == 40:
+        return info_hash.lower()
+    if len(info_hash) == 32:
+        # base32 编码的 btih
+        try:
+            return base64.b32decode(info_hash.upper()).hex()
+        except ValueError:
+            return None
+    return None
+
+
+def link_key(link):
+    """链接去重用的键：磁力链接按 btih，其余按链接本身"""
+    return get_btih(link) or link
+
+
+def extract_links(text):
+    """从文本中提取所有可离线下载的链接，按 btih / 链接去重并保持原顺序"""
+    links = []
+    seen = set()
+    for match in LINK_PATTERN.finditer(text):
+        link = match.group(0).rstrip('.,;，。；')
+        key = link_key(link)
+        if key in seen:
+            continue
+        seen.add(key)
+        links.append(link)
+    return links
+
+
+def link_display_name(link, max_length=60):
+    """生成便于在结果中展示的短名称"""
+    if link.lower().startswith("magnet:?"):
+        names = parse_qs(urlsplit(link).query).get("dn")
+        if names and names[0]:
+            name = names[0]
+        else:
+            name = get_btih(link) or link
+    elif link.lower().startswith("ed2k://"):
+        parts = link.split("|")
+        name = parts[2] if len(parts) > 2 and parts[2] else link
+    else:
+        name = link
+    if len(name) > max_length:
+        name = name[:max_length - 3] + "..."
+    return name
+
+
+def chunked(items, size):
+    """按固定大小切分列表"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
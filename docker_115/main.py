@@ -2,18 +2,28 @@
 import os
 import json
 import time
+import asyncio
 import logging
 import qrcode_terminal
 import hashlib
 import base64
 import string
 import secrets
-import requests
-import qrcode
-import io
+import httpx
+from collections import deque
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler
 from dotenv import load_dotenv
+from http_client import AsyncHttpClient
+from token_cache import TokenCache
+from token_store import create_token_store
+from token_manager import TokenRefresher
+from qr_poller import QrPoller, QR_DONE, QR_CHANGED, QR_PENDING
+from qr_render import QrRenderer
+from magnet_utils import extract_links, link_display_name, chunked, get_btih
+from task_tracker import TaskTracker, TASK_STATUS_DONE
+from retry_queue import RetryQueue
+from rate_limiter import FairRateLimiter
 
 # 尝试加载 .env 文件（如果存在）
 load_dotenv(override=True)
@@ -35,32 +45,85 @@ def get_config(key, default=None):
 # 配置
 CLIENT_ID = int(get_config("CLIENT_ID", "100195135"))  # 115 client_id
 USER_TOKEN_DIR = get_config("USER_TOKEN_DIR", "user_tokens")
+TOKEN_STORE_BACKEND = get_config("TOKEN_STORE_BACKEND", "sqlite")  # sqlite 或 json（旧版每用户一个文件）
+TOKEN_DB_PATH = get_config("TOKEN_DB_PATH", "data/tokens.db")
 ADMIN_IDS = [int(id.strip()) for id in get_config("ADMIN_IDS", "").split(",") if id.strip()]
+HTTP_TIMEOUT = float(get_config("HTTP_TIMEOUT", "15"))  # 单次请求超时（秒）
+HTTP_CONNECT_TIMEOUT = float(get_config("HTTP_CONNECT_TIMEOUT", "5"))  # 建立连接超时（秒）
+HTTP_MAX_CONNECTIONS = int(get_config("HTTP_MAX_CONNECTIONS", "100"))  # 连接池总连接数
+HTTP_PER_HOST_LIMIT = int(get_config("HTTP_PER_HOST_LIMIT", "10"))  # 每个主机的并发请求上限
+CONCURRENT_UPDATES = int(get_config("CONCURRENT_UPDATES", "32"))  # 同时处理的更新数
+MAGNET_BATCH_SIZE = int(get_config("MAGNET_BATCH_SIZE", "15"))  # 每次 add_task_urls 提交的链接数
+QR_POLL_WORKERS = int(get_config("QR_POLL_WORKERS", "8"))  # 同时查询扫码状态的请求数
+QR_MAX_SESSIONS = int(get_config("QR_MAX_SESSIONS", "200"))  # 同时进行的绑定会话上限
+QR_POLL_INTERVAL = float(get_config("QR_POLL_INTERVAL", "3"))  # 扫码状态最短轮询间隔（秒）
+QR_POLL_MAX_INTERVAL = float(get_config("QR_POLL_MAX_INTERVAL", "15"))  # 扫码状态最长轮询间隔（秒）
+QR_SESSION_TIMEOUT = int(get_config("QR_SESSION_TIMEOUT", "900"))  # 绑定会话最长持续时间（秒）
+QR_IMAGE_SIZE = int(get_config("QR_IMAGE_SIZE", "360"))  # 二维码图片边长（像素）
+PROAPI_BASE_URL = get_config("PROAPI_BASE_URL", "https://proapi.115.com")  # 可指向本地模拟服务（fake_115.py）
+TASK_DB_PATH = get_config("TASK_DB_PATH", "data/tasks.db")
+TASK_POLL_INTERVAL = int(get_config("TASK_POLL_INTERVAL", "60"))  # 每个 115 账号的任务列表查询间隔（秒）
+TASK_POLL_MAX_USERS = int(get_config("TASK_POLL_MAX_USERS", "20"))  # 每轮最多查询的 115 账号数
+TASK_POLL_MAX_PAGES = int(get_config("TASK_POLL_MAX_PAGES", "5"))  # 每个账号每次最多查询的任务列表页数
+RETRY_DB_PATH = get_config("RETRY_DB_PATH", "data/retry_queue.db")
+RETRY_BASE_DELAY = float(get_config("RETRY_BASE_DELAY", "30"))  # 首次重试等待时间（秒）
+RETRY_MAX_DELAY = float(get_config("RETRY_MAX_DELAY", "1800"))  # 重试等待时间上限（秒）
+RETRY_MAX_ATTEMPTS = int(get_config("RETRY_MAX_ATTEMPTS", "8"))  # 最多提交次数
+TOKEN_REFRESH_INTERVAL = int(get_config("TOKEN_REFRESH_INTERVAL", "300"))  # 后台扫描 token 的间隔（秒）
+TOKEN_REFRESH_AHEAD = int(get_config("TOKEN_REFRESH_AHEAD", "900"))  # 距过期不足该秒数即提前刷新
+TOKEN_REFRESH_CONCURRENCY = int(get_config("TOKEN_REFRESH_CONCURRENCY", "5"))  # 同时进行的刷新请求数
+TOKEN_REFRESH_ALERT_AFTER = int(get_config("TOKEN_REFRESH_ALERT_AFTER", "1"))  # 连续刷新失败多少次后通知管理员（每个用户只通知一次）
+RATE_USER_PER_MINUTE = float(get_config("RATE_USER_PER_MINUTE", "20"))  # 每个 Telegram 用户每分钟提交次数
+RATE_USER_BURST = int(get_config("RATE_USER_BURST", "5"))
+RATE_ACCOUNT_PER_MINUTE = float(get_config("RATE_ACCOUNT_PER_MINUTE", "30"))  # 每个 115 账号每分钟提交次数
+RATE_ACCOUNT_BURST = int(get_config("RATE_ACCOUNT_BURST", "5"))
+RATE_GLOBAL_PER_MINUTE = float(get_config("RATE_GLOBAL_PER_MINUTE", "300"))  # 全局每分钟提交次数
+RATE_GLOBAL_BURST = int(get_config("RATE_GLOBAL_BURST", "20"))
 
 # API URLs
 AUTH_DEVICE_CODE_URL = "https://passportapi.115.com/open/authDeviceCode"
 QRCODE_STATUS_URL = "https://qrcodeapi.115.com/get/status/"
 DEVICE_CODE_TO_TOKEN_URL = "https://passportapi.115.com/open/deviceCodeToToken"
 REFRESH_TOKEN_URL = "https://passportapi.115.com/open/refreshToken"
-MAGNET_API_URL = "https://proapi.115.com/open/offline/add_task_urls"
+MAGNET_API_URL = f"{PROAPI_BASE_URL}/open/offline/add_task_urls"
+TASK_LIST_API_URL = f"{PROAPI_BASE_URL}/open/offline/get_task_list"
 
 # 定义对话状态
 BINDING = 1
 
-def user_token_file(user_id):
-    os.makedirs(USER_TOKEN_DIR, exist_ok=True)
-    return os.path.join(USER_TOKEN_DIR, f"{user_id}.json")
+# 所有 115 接口共用的 HTTP 客户端
+http = AsyncHttpClient(
+    timeout=HTTP_TIMEOUT,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    max_connections=HTTP_MAX_CONNECTIONS,
+    per_host_limit=HTTP_PER_HOST_LIMIT
+)
+
+# add_task_urls 限流：按用户、115 账号和全局三级令牌桶，超额排队并在用户间轮转
+rate_limiter = FairRateLimiter(
+    user_rate=RATE_USER_PER_MINUTE / 60,
+    user_burst=RATE_USER_BURST,
+    account_rate=RATE_ACCOUNT_PER_MINUTE / 60,
+    account_burst=RATE_ACCOUNT_BURST,
+    global_rate=RATE_GLOBAL_PER_MINUTE / 60,
+    global_burst=RATE_GLOBAL_BURST
+)
+
+# 二维码渲染（线程池中执行，按内容缓存）
+qr_renderer = QrRenderer(target_size=QR_IMAGE_SIZE)
+
+# 用户 token 存储
+token_store = create_token_store(TOKEN_STORE_BACKEND, TOKEN_DB_PATH, USER_TOKEN_DIR)
+if TOKEN_STORE_BACKEND == "sqlite" and not token_store.count() and os.path.isdir(USER_TOKEN_DIR) \
+        and any(name.endswith(".json") for name in os.listdir(USER_TOKEN_DIR)):
+    logger.warning(f"Token database is empty but {USER_TOKEN_DIR} contains token files, "
+                   f"run `python token_store.py migrate` to import them")
 
 def read_token(user_id):
-    try:
-        with open(user_token_file(user_id), "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return None
+    return token_store.get(user_id)
 
 def write_token(user_id, token_data):
-    with open(user_token_file(user_id), "w", encoding="utf-8") as f:
-        json.dump(token_data, f, ensure_ascii=False, indent=2)
+    token_store.put(user_id, token_data)
 
 def generate_code_verifier(length=128):
     allowed_chars = string.ascii_letters + string.digits + "-._~"
@@ -77,78 +140,76 @@ async def bind(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # 检查是否已绑定
-    token_info = read_token(user_id)
+    token_info = token_cache.get(user_id)
     if token_info:
         await update.message.reply_text("你已经绑定过账号了。如果需要重新绑定，请先使用 /unbind 解绑。")
         return ConversationHandler.END
 
+    if user_id not in qr_poller and qr_poller.is_full():
+        await update.message.reply_text("当前正在绑定的用户过多，请稍后再试。")
+        return ConversationHandler.END
+
     # 生成新的二维码
     verifier = generate_code_verifier()
     challenge = generate_code_challenge(verifier)
 
-    resp = requests.post(AUTH_DEVICE_CODE_URL, data={
-        "client_id": CLIENT_ID,
-        "code_challenge": challenge,
-        "code_challenge_method": "sha256"
-    })
-    result = resp.json()
+    try:
+        resp = await http.post(AUTH_DEVICE_CODE_URL, data={
+            "client_id": CLIENT_ID,
+            "code_challenge": challenge,
+            "code_challenge_method": "sha256"
+        })
+        result = resp.json()
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        logger.error(f"Device code request failed: {str(e)}")
+        await update.message.reply_text("获取二维码失败。")
+        return ConversationHandler.END
     if result.get("code") != 0:
         await update.message.reply_text("获取二维码失败。")
         return ConversationHandler.END
 
     data = result["data"]
-    
-    # 生成二维码图片
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(data["qrcode"])
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # 将图片转换为字节流
-    bio = io.BytesIO()
-    img.save(bio, 'PNG')
-    bio.seek(0)
-    
-    # 发送二维码图片给用户
-    await update.message.reply_photo(bio, caption="请使用115客户端扫描二维码。\n二维码有效期为5分钟，过期后将自动刷新。\n如果想取消绑定，请发送 /cancel")
 
-    # 保存状态到上下文
     bind_data = {
         'verifier': verifier,
         'challenge': challenge,
         'data': data,
         'retry_count': 0,
+        'last_status': None,
         'last_check_time': time.time()
     }
+
+    # 先交给集中轮询器登记会话，登记成功后才发送二维码，避免发出无人轮询的二维码
+    # （上面的检查与这里之间有 await，名额可能已被其他用户占满）
+    if not qr_poller.add(user_id, bind_data):
+        await update.message.reply_text("当前正在绑定的用户过多，请稍后再试。")
+        return ConversationHandler.END
+
+    try:
+        # 生成二维码图片
+        png = await qr_renderer.render(data["qrcode"])
+
+        # 发送二维码图片给用户
+        await update.message.reply_photo(png, caption="请使用115客户端扫描二维码。\n二维码有效期为5分钟，过期后将自动刷新。\n如果想取消绑定，请发送 /cancel")
+    except Exception:
+        # 二维码没有发出去，释放名额
+        qr_poller.remove(user_id)
+        raise
+
+    # 保存状态到上下文
     context.user_data['bind_data'] = bind_data
-    
-    # 启动轮询任务
-    context.job_queue.run_repeating(
-        check_qr_status,
-        interval=5,
-        first=5,
-        data={
-            'user_id': user_id,
-            'bind_data': bind_data  # 直接传递绑定数据
-        }
-    )
-    
+
     return BINDING
 
-async def check_qr_status(context: ContextTypes.DEFAULT_TYPE):
-    """定期检查二维码状态"""
-    job = context.job
-    user_id = job.data['user_id']
-    bind_data = job.data['bind_data']  # 从job数据中获取绑定数据
-    
-    if not bind_data:
-        logger.error(f"No bind data found for user {user_id}")
-        job.schedule_removal()
-        return
+async def check_qr_status(bot, session):
+    """由 qr_poller 调用，检查一个待绑定会话的二维码状态"""
+    user_id = session.user_id
+    bind_data = session.bind_data
+    bind_data['last_check_time'] = time.time()
     
     # 检查二维码状态
     try:
-        status = requests.get(QRCODE_STATUS_URL, params={
+        status = await http.get(QRCODE_STATUS_URL, params={
             "uid": bind_data['data']["uid"],
             "time": bind_data['data']["time"],
             "sign": bind_data['data']["sign"]
@@ -156,60 +217,51 @@ async def check_qr_status(context: ContextTypes.DEFAULT_TYPE):
         
         if status.status_code != 200:
             logger.error(f"QR status check failed with status code: {status.status_code}")
-            await context.bot.send_message(chat_id=user_id, text="检查二维码状态失败，请重试。")
-            job.schedule_removal()
-            return
+            await bot.send_message(chat_id=user_id, text="检查二维码状态失败，请重试。")
+            return QR_DONE
             
         status_data = status.json()
         if not status_data or "data" not in status_data:
             logger.error(f"Invalid QR status response: {status.text}")
-            await context.bot.send_message(chat_id=user_id, text="二维码状态检查返回无效数据，请重试。")
-            job.schedule_removal()
-            return
+            await bot.send_message(chat_id=user_id, text="二维码状态检查返回无效数据，请重试。")
+            return QR_DONE
             
         qr_status = status_data["data"].get("status")
         logger.info(f"QR status for user {user_id}: {qr_status}")
+        changed = qr_status != bind_data['last_status']
+        bind_data['last_status'] = qr_status
         
-        if qr_status == 1:
-            # 等待扫描
-            return
-            
-        elif qr_status == 2:
+        if qr_status == 2:
             # 扫码成功，获取token
-            token_resp = requests.post(DEVICE_CODE_TO_TOKEN_URL, data={
+            token_resp = await http.post(DEVICE_CODE_TO_TOKEN_URL, data={
                 "uid": bind_data['data']["uid"],
                 "code_verifier": bind_data['verifier']
             })
             
             if token_resp.status_code != 200:
                 logger.error(f"Token request failed with status code: {token_resp.status_code}")
-                await context.bot.send_message(chat_id=user_id, text="获取访问令牌失败，请重试。")
-                job.schedule_removal()
-                return
+                await bot.send_message(chat_id=user_id, text="获取访问令牌失败，请重试。")
+                return QR_DONE
                 
             token_data = token_resp.json()
             if token_data.get("code") == 0:
-                write_token(user_id, token_data["data"])
-                await context.bot.send_message(chat_id=user_id, text="✅ 绑定成功！现在你可以发送磁力链接了。")
-                job.schedule_removal()
-                return
+                token_cache.put(user_id, token_data["data"])
+                await bot.send_message(chat_id=user_id, text="✅ 绑定成功！现在你可以发送磁力链接了。")
             else:
                 error_msg = token_data.get("message", "未知错误")
                 logger.error(f"Token request failed: {error_msg}")
-                await context.bot.send_message(chat_id=user_id, text=f"绑定失败：{error_msg}，请重试。")
-                job.schedule_removal()
-                return
+                await bot.send_message(chat_id=user_id, text=f"绑定失败：{error_msg}，请重试。")
+            return QR_DONE
                 
         elif qr_status == 3:
             # 二维码过期，重新获取
             bind_data['retry_count'] += 1
             if bind_data['retry_count'] >= 3:
-                await context.bot.send_message(chat_id=user_id, text="❌ 二维码已过期且达到最大重试次数，请重新使用 /bind 命令。")
-                job.schedule_removal()
-                return
+                await bot.send_message(chat_id=user_id, text="❌ 二维码已过期且达到最大重试次数，请重新使用 /bind 命令。")
+                return QR_DONE
                 
             # 重新获取二维码
-            resp = requests.post(AUTH_DEVICE_CODE_URL, data={
+            resp = await http.post(AUTH_DEVICE_CODE_URL, data={
                 "client_id": CLIENT_ID,
                 "code_challenge": bind_data['challenge'],
                 "code_challenge_method": "sha256"
@@ -217,44 +269,55 @@ async def check_qr_status(context: ContextTypes.DEFAULT_TYPE):
             
             if resp.status_code != 200:
                 logger.error(f"QR refresh failed with status code: {resp.status_code}")
-                await context.bot.send_message(chat_id=user_id, text="刷新二维码失败，请重试。")
-                job.schedule_removal()
-                return
+                await bot.send_message(chat_id=user_id, text="刷新二维码失败，请重试。")
+                return QR_DONE
                 
             result = resp.json()
             if result.get("code") != 0:
                 error_msg = result.get("message", "未知错误")
                 logger.error(f"QR refresh failed: {error_msg}")
-                await context.bot.send_message(chat_id=user_id, text=f"刷新二维码失败：{error_msg}，请重试。")
-                job.schedule_removal()
-                return
+                await bot.send_message(chat_id=user_id, text=f"刷新二维码失败：{error_msg}，请重试。")
+                return QR_DONE
                 
             bind_data['data'] = result["data"]
+            bind_data['last_status'] = None
             
             # 生成新的二维码图片
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(bind_data['data']["qrcode"])
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
+            png = await qr_renderer.render(bind_data['data']["qrcode"])
             
-            bio = io.BytesIO()
-            img.save(bio, 'PNG')
-            bio.seek(0)
-            
-            await context.bot.send_photo(
+            await bot.send_photo(
                 chat_id=user_id,
-                photo=bio,
+                photo=png,
                 caption=f"🔄 二维码已刷新，请重新扫描。\n这是第 {bind_data['retry_count'] + 1} 次尝试，还剩 {3 - bind_data['retry_count'] - 1} 次机会。\n如果想取消绑定，请发送 /cancel"
             )
+            return QR_CHANGED
+        
+        # 等待扫描或等待确认
+        return QR_CHANGED if changed else QR_PENDING
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
+        # 网络抖动时不结束绑定，由轮询器退避后重试，直到会话过期
         logger.error(f"Network error while checking QR status: {str(e)}")
-        await context.bot.send_message(chat_id=user_id, text="网络错误，请检查网络连接后重试。")
-        job.schedule_removal()
+        return QR_PENDING
     except Exception as e:
         logger.error(f"Unexpected error while checking QR status: {str(e)}")
-        await context.bot.send_message(chat_id=user_id, text="检查二维码状态时出现未知错误，请重试。")
-        job.schedule_removal()
+        await bot.send_message(chat_id=user_id, text="检查二维码状态时出现未知错误，请重试。")
+        return QR_DONE
+
+async def expire_qr_session(bot, session):
+    """绑定会话超时"""
+    await bot.send_message(chat_id=session.user_id, text="❌ 绑定已超时，请重新使用 /bind 命令。")
+
+# 扫码状态集中轮询器
+qr_poller = QrPoller(
+    check_qr_status,
+    expire_qr_session,
+    workers=QR_POLL_WORKERS,
+    max_sessions=QR_MAX_SESSIONS,
+    interval=QR_POLL_INTERVAL,
+    max_interval=QR_POLL_MAX_INTERVAL,
+    session_timeout=QR_SESSION_TIMEOUT
+)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 检查是否有正在进行的绑定过程
@@ -262,8 +325,9 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("当前没有正在进行的绑定过程。")
         return ConversationHandler.END
         
-    # 清除绑定数据
+    # 清除绑定数据并停止轮询
     context.user_data.pop('bind_data', None)
+    qr_poller.remove(update.effective_user.id)
     await update.message.reply_text("已取消绑定过程。")
     return ConversationHandler.END
 
@@ -271,28 +335,32 @@ async def handle_binding(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     bind_data = context.user_data.get('bind_data')
     
-    if not bind_data:
+    # 轮询器已结束该会话（成功、失败或超时）时，对话也随之结束
+    if not bind_data or user_id not in qr_poller:
+        context.user_data.pop('bind_data', None)
         await update.message.reply_text("绑定过程已结束，请重新使用 /bind 命令。")
         return ConversationHandler.END
 
     # 检查二维码状态
-    status = requests.get(QRCODE_STATUS_URL, params={
+    status = (await http.get(QRCODE_STATUS_URL, params={
         "uid": bind_data['data']["uid"],
         "time": bind_data['data']["time"],
         "sign": bind_data['data']["sign"]
-    }).json()
+    })).json()
     
     if status["data"].get("status") == 2:
         # 扫码成功，获取token
-        token_resp = requests.post(DEVICE_CODE_TO_TOKEN_URL, data={
+        token_resp = (await http.post(DEVICE_CODE_TO_TOKEN_URL, data={
             "uid": bind_data['data']["uid"],
             "code_verifier": bind_data['verifier']
-        }).json()
+        })).json()
         if token_resp.get("code") == 0:
-            write_token(user_id, token_resp["data"])
+            token_cache.put(user_id, token_resp["data"])
+            qr_poller.remove(user_id)
             await update.message.reply_text("绑定成功！现在你可以发送磁力链接了。")
             return ConversationHandler.END
         else:
+            qr_poller.remove(user_id)
             await update.message.reply_text("绑定失败，请重试。")
             return ConversationHandler.END
             
@@ -300,50 +368,45 @@ async def handle_binding(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 二维码过期，重新获取
         bind_data['retry_count'] += 1
         if bind_data['retry_count'] >= 3:
+            qr_poller.remove(user_id)
             await update.message.reply_text("二维码已过期且达到最大重试次数，请重新使用 /bind 命令。")
             return ConversationHandler.END
             
         # 重新获取二维码
-        resp = requests.post(AUTH_DEVICE_CODE_URL, data={
+        resp = await http.post(AUTH_DEVICE_CODE_URL, data={
             "client_id": CLIENT_ID,
             "code_challenge": bind_data['challenge'],
             "code_challenge_method": "sha256"
         })
         result = resp.json()
         if result.get("code") != 0:
+            qr_poller.remove(user_id)
             await update.message.reply_text("重新获取二维码失败。")
             return ConversationHandler.END
             
         bind_data['data'] = result["data"]
+        bind_data['last_status'] = None
         
         # 生成新的二维码图片
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(bind_data['data']["qrcode"])
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        bio = io.BytesIO()
-        img.save(bio, 'PNG')
-        bio.seek(0)
+        png = await qr_renderer.render(bind_data['data']["qrcode"])
         
-        await update.message.reply_photo(bio, caption=f"二维码已刷新，请重新扫描。\n这是第 {bind_data['retry_count'] + 1} 次尝试，还剩 {3 - bind_data['retry_count'] - 1} 次机会。\n如果想取消绑定，请发送 /cancel")
+        await update.message.reply_photo(png, caption=f"二维码已刷新，请重新扫描。\n这是第 {bind_data['retry_count'] + 1} 次尝试，还剩 {3 - bind_data['retry_count'] - 1} 次机会。\n如果想取消绑定，请发送 /cancel")
     
     return BINDING
 
 async def unbind(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    token_file = user_token_file(user_id)
     
-    if os.path.exists(token_file):
-        os.remove(token_file)
+    if token_store.delete(user_id):
+        token_cache.invalidate(user_id)
         await update.message.reply_text("已成功解绑账号。")
     else:
         await update.message.reply_text("你还没有绑定账号。")
 
-def refresh_user_token(user_id, token_info):
-    """刷新用户的 token"""
+async def refresh_user_token(user_id, token_info):
+    """刷新用户的 token，成功返回新的 token 数据，失败返回 None"""
     try:
-        refresh_resp = requests.post(REFRESH_TOKEN_URL, data={
+        refresh_resp = await http.post(REFRESH_TOKEN_URL, data={
             "client_id": CLIENT_ID,
             "refresh_token": token_info.get("refresh_token")
         })
@@ -351,14 +414,100 @@ def refresh_user_token(user_id, token_info):
         if refresh_resp.status_code == 200:
             refresh_data = refresh_resp.json()
             if refresh_data.get("code") == 0:
-                token_info["access_token"] = refresh_data["data"]["access_token"]
-                token_info["refresh_token"] = refresh_data["data"]["refresh_token"]
-                write_token(user_id, token_info)
-                return True
-        return False
+                return refresh_data["data"]
+        return None
     except Exception as e:
         print(f"Token refresh error: {str(e)}")
-        return False
+        return None
+
+# 用户 token 缓存，只在接近过期时刷新
+token_cache = TokenCache(read_token, write_token, refresh_user_token)
+
+async def alert_token_failures(bot, failures):
+    """后台刷新有失败时通知管理员"""
+    lines = [f"⚠️ {len(failures)} 个用户的 token 刷新失败："]
+    for user_id, (_, count) in list(failures.items())[:50]:
+        lines.append(f"用户 {user_id}：连续失败 {count} 次")
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(chat_id=admin_id, text="\n".join(lines))
+        except Exception as e:
+            logger.error(f"Failed to alert admin {admin_id}: {str(e)}")
+
+# 后台提前刷新即将过期的 token
+token_refresher = TokenRefresher(
+    token_store,
+    token_cache,
+    interval=TOKEN_REFRESH_INTERVAL,
+    refresh_ahead=TOKEN_REFRESH_AHEAD,
+    concurrency=TOKEN_REFRESH_CONCURRENCY,
+    on_failures=alert_token_failures,
+    alert_after=TOKEN_REFRESH_ALERT_AFTER
+)
+
+async def token_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """管理员查看 token 后台刷新指标"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("此命令仅限管理员使用。")
+        return
+    metrics = token_refresher.metrics()
+    last_cycle = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metrics['last_cycle_at'])) if metrics['last_cycle_at'] else "尚未运行"
+    ages = "\n".join(f"  {label}: {count}" for label, count in metrics['token_age'].items())
+    await update.message.reply_text(
+        f"Token 刷新统计：\n"
+        f"扫描轮数：{metrics['cycles']}（最近一次：{last_cycle}）\n"
+        f"刷新成功：{metrics['refreshes']}\n"
+        f"刷新失败：{metrics['failures']}\n"
+        f"当前失败用户数：{metrics['failing_users']}\n"
+        f"token 年龄分布：\n{ages or '  无'}"
+    )
+
+async def fetch_task_page(user_id, page):
+    """查询用户的离线任务列表，返回 (任务列表, 总页数)"""
+    token_info = await token_cache.get_valid_token(user_id)
+    if not token_info:
+        raise RuntimeError("token 无效")
+    resp = await http.get(TASK_LIST_API_URL, params={"page": page}, headers={
+        "Authorization": f"Bearer {token_info['access_token']}"
+    })
+    result = resp.json()
+    if not result.get("state"):
+        raise RuntimeError(result.get("message", "未知错误"))
+    data = result.get("data") or {}
+    return data.get("tasks") or [], int(data.get("page_count") or 1)
+
+async def notify_task(bot, user_id, name, task):
+    """推送离线任务完成 / 失败通知"""
+    if task.get("status") == TASK_STATUS_DONE:
+        text = f"✅ 离线下载完成：{name}"
+    else:
+        text = f"❌ 离线下载失败：{name}"
+    await bot.send_message(chat_id=user_id, text=text)
+
+# 离线任务状态跟踪
+task_tracker = TaskTracker(
+    TASK_DB_PATH,
+    fetch_task_page,
+    notify_task,
+    interval=TASK_POLL_INTERVAL,
+    max_accounts_per_tick=TASK_POLL_MAX_USERS,
+    max_pages=TASK_POLL_MAX_PAGES
+)
+
+async def on_startup(application):
+    """启动后台任务"""
+    qr_poller.start(application.bot)
+    task_tracker.start(application.bot)
+    retry_queue.start(application.bot)
+    token_refresher.start(application.bot)
+
+async def on_shutdown(application):
+    """停止后台任务并关闭共享的 HTTP 连接池"""
+    await qr_poller.stop()
+    await task_tracker.stop()
+    await retry_queue.stop()
+    await token_refresher.stop()
+    await http.aclose()
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理错误"""
@@ -368,68 +517,237 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "抱歉，处理您的请求时出现错误。请稍后重试。"
         )
 
+class AddTaskError(Exception):
+    """add_task_urls 整体调用失败，retryable 表示是否属于 115 暂时不可用 / 限流"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+async def add_task_urls(access_token, links):
+    """一次调用 add_task_urls 提交多条链接，返回 [(链接, 是否成功, 错误信息, info_hash)]"""
+    headers = {
+        "Authorization": f"Bearer {access_token}"
+    }
+    logger.debug(f"Request headers: {headers}")
+
+    resp = await http.post(MAGNET_API_URL, data={
+        "urls": "\n".join(links),  # 多条链接以换行分隔
+        "wp_path_id": "0"  # 默认保存到根目录
+    }, headers=headers)
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise AddTaskError(f"服务器暂时不可用（HTTP {resp.status_code}）", retryable=True)
+    if resp.status_code != 200 or not resp.headers.get("Content-Type", "").startswith("application/json"):
+        raise AddTaskError("服务器返回了非预期的响应", retryable=True)
+    try:
+        result = resp.json()
+    except json.JSONDecodeError:
+        logger.error(f"Raw Response: {resp.text}")
+        raise
+    logger.debug(f"API Response: {result}")
+
+    if not result.get("state"):
+        raise AddTaskError(result.get("message", "未知错误"))
+
+    # data 中的结果与提交的链接一一对应
+    items = result.get("data") or []
+    results = []
+    for i, link in enumerate(links):
+        item = items[i] if i < len(items) else None
+        if item and item.get("state"):
+            results.append((link, True, "", item.get("info_hash") or get_btih(link)))
+        else:
+            results.append((link, False, item.get("message", "未知错误") if item else "未知错误", None))
+    return results
+
+async def add_chunk(token_info, chunk):
+    """提交一批链接，失败时返回每条链接的错误结果而不抛出异常"""
+    try:
+        return await add_task_urls(token_info['access_token'], chunk)
+    except AddTaskError as e:
+        return [(link, None if e.retryable else False, str(e), None) for link in chunk]
+    except httpx.HTTPError as e:
+        logger.error(f"Request Error: {str(e)}")
+        return [(link, None, f"网络请求错误 - {str(e)}", None) for link in chunk]
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON Parse Error: {str(e)}")
+        return [(link, None, "服务器响应格式错误", None) for link in chunk]
+    except Exception as e:
+        logger.error(f"Unexpected Error: {str(e)}")
+        return [(link, False, f"添加任务失败：{str(e)}", None) for link in chunk]
+
+def account_key(user_id, token_info):
+    """token 所属的 115 账号 ID，缺失时（旧 token）按 Telegram 用户计"""
+    return (token_info or {}).get("user_id") or user_id
+
+def enqueue_links(user_id, token_info, links, on_done):
+    """把链接交给限流器排队后立即返回，由限流器的后台任务按 MAGNET_BATCH_SIZE 分批提交
+
+    每批占用一次限额，提交完一批后再排队下一批，因此同一用户的多条消息在队列中交替前进；
+    全部批次完成后以 [(链接, 是否成功, 错误信息, info_hash)] 调用 async on_done(results)。
+
+    结果中的“是否成功”为 None 表示网络错误、限流等暂时性失败，可以稍后重试。
+    """
+    chunks = deque(chunked(links, MAGNET_BATCH_SIZE))
+    results = []
+    account = account_key(user_id, token_info)
+
+    async def push():
+        results.extend(await add_chunk(token_info, chunks.popleft()))
+        if chunks:
+            rate_limiter.submit(user_id, account, push)
+        else:
+            await on_done(results)
+
+    rate_limiter.submit(user_id, account, push)
+
+async def submit_links(user_id, token_info, links):
+    """排队提交链接并等待全部结果，供本身在后台运行的调用方（重试队列）使用"""
+    done = asyncio.get_running_loop().create_future()
+
+    async def on_done(results):
+        done.set_result(results)
+
+    enqueue_links(user_id, token_info, links, on_done)
+    return await done
+
+def format_results(results):
+    """生成逐条链接的结果汇总，超过 Telegram 长度限制时拆分为多条消息"""
+    if len(results) == 1:
+        _, ok, error_msg, _ = results[0]
+        if ok is None:
+            return [f"添加失败：{error_msg}，已加入重试队列，稍后会自动重新提交。"]
+        return ["磁力链接已成功添加到 115 离线下载。" if ok else f"添加失败：{error_msg}"]
+
+    success = sum(1 for _, ok, _, _ in results if ok)
+    queued = sum(1 for _, ok, _, _ in results if ok is None)
+    failed = len(results) - success - queued
+    summary = f"共提交 {len(results)} 条链接，成功 {success} 条，失败 {failed} 条。"
+    if queued:
+        summary += f"\n另有 {queued} 条因 115 暂时不可用已加入重试队列，稍后会自动重新提交。"
+    lines = [summary, ""]
+    for link, ok, error_msg, _ in results:
+        name = link_display_name(link)
+        if ok:
+            lines.append(f"✅ {name}")
+        elif ok is None:
+            lines.append(f"⏳ {name}：{error_msg}")
+        else:
+            lines.append(f"❌ {name}：{error_msg}")
+
+    messages = []
+    current = ""
+    for line in lines:
+        if len(current) + len(line) + 1 > 4000:
+            messages.append(current)
+            current = ""
+        current += line + "\n"
+    if current.strip():
+        messages.append(current)
+    return messages
+
+def record_results(user_id, token_info, results):
+    """成功的任务按 115 账号交给状态跟踪，暂时失败的加入重试队列"""
+    task_tracker.track(account_key(user_id, token_info), user_id, [
+        (info_hash, link_display_name(link)) for link, ok, _, info_hash in results if ok
+    ])
+    retry_links = [link for link, ok, _, _ in results if ok is None]
+    if retry_links:
+        retry_queue.enqueue(user_id, retry_links)
+
+async def submit_and_reply(update: Update, user_id, links):
+    """把链接加入提交队列后立即返回，提交完成后由后台任务回复结果汇总
+
+    处理函数不在限流队列中等待，不会占用 concurrent_updates 的名额，其他用户的消息可以照常处理。
+    """
+    try:
+        # 获取有效 token，仅在接近过期时刷新
+        token_info = await token_cache.get_valid_token(user_id)
+        if not token_info:
+            await update.message.reply_text("token 刷新失败，请重新绑定账号")
+            return
+
+        if rate_limiter.queued(user_id):
+            await update.message.reply_text(f"⏳ 提交较频繁，已排队等待（前面还有 {rate_limiter.queued(user_id)} 批）。")
+
+        async def reply(results):
+            record_results(user_id, token_info, results)
+            for text in format_results(results):
+                await update.message.reply_text(text)
+
+        enqueue_links(user_id, token_info, links, reply)
+
+    except Exception as e:
+        logger.error(f"Unexpected Error: {str(e)}")
+        await update.message.reply_text(f"添加任务失败：{str(e)}")
+
+async def retry_submit(user_id, links):
+    """重试队列回调：重新提交某个用户排队中的链接"""
+    token_info = await token_cache.get_valid_token(user_id)
+    if not token_info:
+        return [(link, False, "token 无效，请重新绑定账号", None) for link in links]
+    return await submit_links(user_id, token_info, links)
+
+async def retry_report(bot, user_id, results):
+    """重试队列回调：通知用户排队链接的最终结果"""
+    task_tracker.track(account_key(user_id, token_cache.get(user_id)), user_id, [
+        (info_hash, link_display_name(link)) for link, ok, _, info_hash in results if ok
+    ])
+    texts = format_results(results)
+    texts[0] = "🔁 重试队列提交结果：\n" + texts[0]
+    for text in texts:
+        await bot.send_message(chat_id=user_id, text=text)
+
+# 磁力提交重试队列
+retry_queue = RetryQueue(
+    RETRY_DB_PATH,
+    retry_submit,
+    retry_report,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    max_attempts=RETRY_MAX_ATTEMPTS
+)
+
 async def handle_magnet(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """处理磁力链接"""
+    """处理消息中的磁力 / ed2k / http 链接，支持一条消息包含多个链接"""
     if not update or not update.effective_user:
         logger.warning("Received update without user information")
         return
 
     user_id = update.effective_user.id
-    token_info = read_token(user_id)
-    if not token_info:
+    if not token_cache.get(user_id):
         await update.message.reply_text("你还没有绑定账号，请先使用 /bind")
         return
 
-    magnet = update.message.text.strip()
-    if not magnet.startswith("magnet:?"):
-        await update.message.reply_text("请发送正确的磁力链接，以 magnet:? 开头")
+    links = extract_links(update.message.text)
+    if not links:
+        await update.message.reply_text("请发送正确的磁力链接，以 magnet:? 开头（也支持 ed2k:// 和 http 链接）")
         return
 
-    try:
-        # 刷新 token
-        if not refresh_user_token(user_id, token_info):
-            await update.message.reply_text("token 刷新失败，请重新绑定账号")
-            return
+    await submit_and_reply(update, user_id, links)
 
-        headers = {
-            "Authorization": f"Bearer {token_info['access_token']}"
-        }
-        logger.debug(f"Request headers: {headers}")
-        
-        resp = requests.post(MAGNET_API_URL, data={
-            "urls": magnet,
-            "wp_path_id": "0"  # 默认保存到根目录
-        }, headers=headers)
-        
-        if resp.status_code == 200 and resp.headers.get("Content-Type", "").startswith("application/json"):
-            result = resp.json()
-            logger.debug(f"API Response: {result}")
-            
-            if result.get("state"):
-                if result.get("data") and result["data"][0].get("state"):
-                    await update.message.reply_text("磁力链接已成功添加到 115 离线下载。")
-                else:
-                    error_msg = result["data"][0].get("message", "未知错误") if result.get("data") else "未知错误"
-                    await update.message.reply_text(f"添加失败：{error_msg}")
-            else:
-                error_msg = result.get("message", "未知错误")
-                await update.message.reply_text(f"添加失败：{error_msg}")
-        else:
-            await update.message.reply_text("添加任务失败：服务器返回了非预期的响应")
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request Error: {str(e)}")
-        await update.message.reply_text(f"添加任务失败：网络请求错误 - {str(e)}")
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON Parse Error: {str(e)}")
-        logger.error(f"Raw Response: {resp.text}")
-        await update.message.reply_text("添加任务失败：服务器响应格式错误")
-    except Exception as e:
-        logger.error(f"Unexpected Error: {str(e)}")
-        await update.message.reply_text(f"添加任务失败：{str(e)}")
+async def handle_link_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理上传的 .txt 链接列表文件"""
+    if not update or not update.effective_user:
+        logger.warning("Received update without user information")
+        return
+
+    user_id = update.effective_user.id
+    if not token_cache.get(user_id):
+        await update.message.reply_text("你还没有绑定账号，请先使用 /bind")
+        return
+
+    file = await update.message.document.get_file()
+    content = await file.download_as_bytearray()
+    links = extract_links(content.decode("utf-8", errors="ignore"))
+    if not links:
+        await update.message.reply_text("文件中没有找到可用的链接。")
+        return
+
+    await submit_and_reply(update, user_id, links)
 
 if __name__ == "__main__":
-    import asyncio
     import sys
 
     # 从环境变量或 .env 文件获取 Telegram Bot Token
@@ -438,7 +756,14 @@ if __name__ == "__main__":
         logger.error("BOT_TOKEN not found in environment variables or .env file")
         sys.exit("请设置 BOT_TOKEN 环境变量或在 .env 文件中配置")
 
-    app = ApplicationBuilder().token(TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # 创建对话处理器
     conv_handler = ConversationHandler(
@@ -459,7 +784,9 @@ if __name__ == "__main__":
     app.add_handler(conv_handler)
     app.add_handler(CommandHandler("unbind", unbind))
     app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("token_stats", token_stats))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_magnet))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("txt"), handle_link_file))
 
     logger.info("Starting bot...")
     app.run_polling()
\ No newline at end of file
@@ -0,0 +1,117 @@
+# 扫码绑定状态的集中轮询器
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# check 回调的返回值
+QR_DONE = "done"        # 绑定结束（成功或失败），移除会话
+QR_CHANGED = "changed"  # 状态有变化（如已扫码、二维码已刷新），恢复为最短轮询间隔
+QR_PENDING = "pending"  # 状态无变化，逐步拉长轮询间隔
+
+
+class QrSession:
+    def __init__(self, user_id, bind_data, deadline, interval):
+        self.user_id = user_id
+        self.bind_data = bind_data
+        self.deadline = deadline
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+
+
+class QrPoller:
+    """所有待绑定会话放在一个字典中，由单个后台任务统一轮询
+
+    - 同时进行的状态查询数受 workers 限制
+    - 状态无变化时按 backoff 倍数拉长间隔，直到 max_interval
+    - 超过 session_timeout 的会话自动过期，调用 on_expire 通知用户
+    - 同时存在的会话数不超过 max_sessions
+    """
+
+    def __init__(self, check, on_expire, workers=8, max_sessions=200,
+                 interval=3.0, max_interval=15.0, backoff=1.5, session_timeout=900):
+        self._check = check          # async (bot, session) -> QR_DONE / QR_CHANGED / QR_PENDING
+        self._on_expire = on_expire  # async (bot, session)
+        self.workers = workers
+        self._semaphore = None
+        self.max_sessions = max_sessions
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.session_timeout = session_timeout
+        self._sessions = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def is_full(self):
+        return len(self._sessions) >= self.max_sessions
+
+    def add(self, user_id, bind_data):
+        """登记待绑定会话，同一用户重复登记会替换旧会话；达到上限返回 False"""
+        if user_id not in self._sessions and self.is_full():
+            return False
+        deadline = time.monotonic() + self.session_timeout
+        self._sessions[user_id] = QrSession(user_id, bind_data, deadline, self.interval)
+        return True
+
+    def remove(self, user_id):
+        return self._sessions.pop(user_id, None) is not None
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, bot):
+        # 在事件循环内创建，兼容 Python 3.9
+        self._semaphore = asyncio.Semaphore(self.workers)
+        while True:
+            try:
+                await self._tick(bot)
+            except Exception as e:
+                logger.error(f"QR poller tick failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(1)
+
+    async def _tick(self, bot):
+        now = time.monotonic()
+        expired = [s for s in self._sessions.values() if s.deadline <= now]
+        for session in expired:
+            self._sessions.pop(session.user_id, None)
+            await self._on_expire(bot, session)
+
+        due = [s for s in self._sessions.values() if s.next_poll <= now]
+        if due:
+            await asyncio.gather(*(self._poll(bot, session) for session in due))
+
+    async def _poll(self, bot, session):
+        async with self._semaphore:
+            try:
+                result = await self._check(bot, session)
+            except Exception as e:
+                logger.error(f"QR status check failed for user {session.user_id}: {str(e)}")
+                result = QR_PENDING
+
+        if result == QR_DONE:
+            # 只移除本次轮询的会话，避免误删用户重新 /bind 产生的新会话
+            if self._sessions.get(session.user_id) is session:
+                del self._sessions[session.user_id]
+            return
+        if result == QR_CHANGED:
+            session.interval = self.interval
+        else:
+            session.interval = min(session.interval * self.backoff, self.max_interval)
+        session.next_poll = time.monotonic() + session.interval
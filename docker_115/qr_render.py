@@ -0,0 +1,76 @@
+# 二维码图片渲染服务
+import asyncio
+import io
+import logging
+from collections import OrderedDict
+
+import qrcode
+from PIL import Image
+from qrcode.constants import ERROR_CORRECT_M
+
+logger = logging.getLogger(__name__)
+
+
+def render_qr_png(payload, target_size=360, border=4):
+    """把 payload 渲染为 1-bit PNG，边长约为 target_size 像素"""
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECT_M, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    # 先按每个模块 1 像素绘制，再整体放大，比逐个模块画矩形快
+    size = qr.modules_count + border * 2
+    img = Image.new("1", (size, size), 1)
+    pixels = img.load()
+    for y, row in enumerate(qr.modules):
+        for x, module in enumerate(row):
+            if module:
+                pixels[x + border, y + border] = 0
+    scale = max(2, target_size // size)
+    img = img.resize((size * scale, size * scale), Image.NEAREST)
+
+    bio = io.BytesIO()
+    img.save(bio, "PNG", optimize=True)
+    return bio.getvalue()
+
+
+class QrRenderer:
+    """在线程池中渲染二维码，并按 payload 缓存结果
+
+    同一 payload 只渲染一次；并发请求同一 payload 时共享同一次渲染。
+    """
+
+    def __init__(self, target_size=360, cache_size=256, executor=None):
+        self.target_size = target_size
+        self.cache_size = cache_size
+        self.executor = executor  # None 表示使用事件循环默认线程池
+        self._cache = OrderedDict()
+        self._pending = {}
+
+    async def render(self, payload):
+        """返回 payload 对应的 PNG 字节"""
+        png = self._cache.get(payload)
+        if png is not None:
+            self._cache.move_to_end(payload)
+            return png
+
+        task = self._pending.get(payload)
+        if task is None:
+            task = asyncio.ensure_future(self._render(payload))
+            self._pending[payload] = task
+        # shield 防止某个等待者被取消（如处理超时）时连带取消共享的渲染任务
+        return await asyncio.shield(task)
+
+    async def _render(self, payload):
+        loop = asyncio.get_running_loop()
+        try:
+            png = await loop.run_in_executor(self.executor, render_qr_png, payload, self.target_size)
+        finally:
+            self._pending.pop(payload, None)
+        self._remember(payload, png)
+        return png
+
+    def _remember(self, payload, png):
+        self._cache[payload] = png
+        self._cache.move_to_end(payload)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
@@ -0,0 +1,163 @@
+# 115 API 调用限流
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """距离可以取得一个令牌还需等待的秒数，0 表示立即可用"""
+        self._fill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._fill(now)
+        return self.tokens >= self.capacity
+
+
+class FairRateLimiter:
+    """按 Telegram 用户、115 账号和全局三级令牌桶限流
+
+    超出限额的请求在各用户自己的队列中等待，不会被丢弃；
+    调度时在有等待请求的用户之间轮转，每轮每个用户最多放行一个请求，
+    因此大量提交的用户不会挤占其他用户的额度。
+
+    submit 只把任务放进队列就返回，轮到时在后台任务中执行，调用方（如 Telegram 处理函数）
+    不必在排队期间一直占着；acquire 则等待直到放行，适合本身就在后台运行的调用方。
+    """
+
+    def __init__(self, user_rate, user_burst, account_rate, account_burst, global_rate, global_burst,
+                 max_idle_buckets=10000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_idle_buckets = max_idle_buckets
+        self._user_buckets = {}
+        self._account_buckets = {}
+        self._queues = OrderedDict()  # user_key -> deque[(account_key, future 或 job)]
+        self._jobs = set()  # 正在执行的 submit 任务
+        self._wakeup = None
+        self._task = None
+
+    def queued(self, user_key=None):
+        """等待中的请求数"""
+        if user_key is not None:
+            return len(self._queues.get(user_key, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    def running(self):
+        """已放行、仍在执行的 submit 任务数"""
+        return len(self._jobs)
+
+    def submit(self, user_key, account_key, job):
+        """把 job（无参 async 函数）加入队列后立即返回，三级限额都允许时在后台任务中执行"""
+        self._enqueue(user_key, account_key, job)
+
+    async def acquire(self, user_key, account_key=None):
+        """等待直到三级限额都允许本次调用"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(user_key, account_key, future)
+        await future
+
+    def _enqueue(self, user_key, account_key, waiter):
+        self._queues.setdefault(user_key, deque()).append((account_key, waiter))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    def _release(self, waiter):
+        if isinstance(waiter, asyncio.Future):
+            waiter.set_result(None)
+            return
+        task = asyncio.ensure_future(waiter())
+        self._jobs.add(task)
+        task.add_done_callback(self._job_done)
+
+    def _job_done(self, task):
+        self._jobs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Rate-limited job failed: {task.exception()}", exc_info=task.exception())
+
+    def _buckets(self, user_key, account_key):
+        user_bucket = self._user_buckets.get(user_key)
+        if user_bucket is None:
+            user_bucket = self._user_buckets[user_key] = TokenBucket(self.user_rate, self.user_burst)
+        buckets = [self.global_bucket, user_bucket]
+        if account_key is not None:
+            account_bucket = self._account_buckets.get(account_key)
+            if account_bucket is None:
+                account_bucket = self._account_buckets[account_key] = TokenBucket(self.account_rate, self.account_burst)
+            buckets.append(account_bucket)
+        return buckets
+
+    def _prune(self, now):
+        # 只清理已经回满且没有排队请求的桶，清理后重新创建结果相同
+        for buckets in (self._user_buckets, self._account_buckets):
+            if len(buckets) > self.max_idle_buckets:
+                for key in [k for k, b in buckets.items() if k not in self._queues and b.is_full(now)]:
+                    del buckets[key]
+
+    async def _dispatch(self):
+        while self._queues:
+            now = time.monotonic()
+            min_wait = None
+            for user_key in list(self._queues):
+                queue = self._queues[user_key]
+                # 跳过已取消的等待者
+                while queue and isinstance(queue[0][1], asyncio.Future) and queue[0][1].done():
+                    queue.popleft()
+                if not queue:
+                    del self._queues[user_key]
+                    continue
+
+                account_key, waiter = queue[0]
+                buckets = self._buckets(user_key, account_key)
+                wait = max(bucket.wait_time(now) for bucket in buckets)
+                if wait > 0:
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+
+                for bucket in buckets:
+                    bucket.consume(now)
+                queue.popleft()
+                self._release(waiter)
+                # 放行后移到队尾，实现用户间轮转
+                if queue:
+                    self._queues.move_to_end(user_key)
+                else:
+                    del self._queues[user_key]
+
+            self._prune(now)
+            if self._queues and min_wait is not None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min_wait)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
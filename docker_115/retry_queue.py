@@ -0,0 +1,147 @@
+# 磁力提交重试队列
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryQueue:
+    """115 不可用或限流时提交失败的链接先写入 SQLite，后台按指数退避 + 抖动重试
+
+    - 同一用户到期的链接合并为一次批量提交
+    - 每个用户的重试在单独的后台任务中进行，某个用户在限流队列中等待时不耽误其他用户
+    - submit 回调返回 [(链接, 结果, 错误信息, info_hash)]，结果为 None 表示仍可重试
+    - 链接成功、确定失败或超过 max_attempts 后调用 report 通知用户最终结果
+    """
+
+    def __init__(self, db_path, submit, report, base_delay=30, max_delay=1800,
+                 max_attempts=8, tick=5, max_users_per_tick=10):
+        self._submit = submit  # async (user_id, links) -> results
+        self._report = report  # async (bot, user_id, results)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.tick = tick
+        self.max_users_per_tick = max_users_per_tick
+        self._task = None
+        self._retrying = {}  # user_id -> 正在进行的重试任务
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS submission_queue (
+                                user_id INTEGER NOT NULL,
+                                link TEXT NOT NULL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                next_attempt REAL NOT NULL,
+                                last_error TEXT,
+                                created_at INTEGER NOT NULL,
+                                PRIMARY KEY (user_id, link)
+                            )''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_submission_queue_next ON submission_queue (next_attempt)")
+        self.conn.commit()
+
+    def backoff(self, attempts):
+        """第 attempts 次失败后的等待时间：指数增长，上限 max_delay，带 ±50% 抖动"""
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.5)
+
+    def enqueue(self, user_id, links, error=""):
+        """加入队列；已在队列中的链接保持原有重试进度"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                '''INSERT OR IGNORE INTO submission_queue (user_id, link, attempts, next_attempt, last_error, created_at)
+                   VALUES (?, ?, 1, ?, ?, ?)''',
+                [(user_id, link, now + self.backoff(1), error, int(now)) for link in links]
+            )
+
+    def pending_count(self, user_id=None):
+        if user_id is None:
+            return self.conn.execute("SELECT COUNT(*) FROM submission_queue").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM submission_queue WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        tasks = list(self._retrying.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        # 被取消的重试保持原有进度，下次启动后重新提交
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.conn.close()
+
+    async def _run(self, bot):
+        while True:
+            try:
+                await self._retry_due(bot)
+            except Exception as e:
+                logger.error(f"Retry queue tick failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.tick)
+
+    async def _retry_due(self, bot):
+        """为到期的用户启动重试任务后立即返回，已在重试中的用户跳过"""
+        rows = self.conn.execute(
+            '''SELECT user_id FROM submission_queue WHERE next_attempt <= ?
+               GROUP BY user_id ORDER BY MIN(next_attempt) LIMIT ?''',
+            (time.time(), self.max_users_per_tick + len(self._retrying))
+        ).fetchall()
+        started = 0
+        for (user_id,) in rows:
+            if user_id in self._retrying or started >= self.max_users_per_tick:
+                continue
+            task = asyncio.create_task(self._retry_user(bot, user_id))
+            self._retrying[user_id] = task
+            task.add_done_callback(lambda t, user_id=user_id: self._retry_done(user_id, t))
+            started += 1
+
+    def _retry_done(self, user_id, task):
+        self._retrying.pop(user_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Retrying queued links for user {user_id} failed: {str(task.exception())}",
+                         exc_info=task.exception())
+
+    async def _retry_user(self, bot, user_id):
+        rows = self.conn.execute(
+            "SELECT link, attempts FROM submission_queue WHERE user_id = ? AND next_attempt <= ? ORDER BY created_at",
+            (user_id, time.time())
+        ).fetchall()
+        if not rows:
+            return
+        attempts = dict(rows)
+        logger.info(f"Retrying {len(rows)} queued links for user {user_id}")
+        results = await self._submit(user_id, list(attempts))
+
+        final = []
+        done_links = []
+        retry_rows = []
+        now = time.time()
+        for link, ok, error_msg, info_hash in results:
+            if ok is None and attempts[link] < self.max_attempts:
+                retry_rows.append((attempts[link] + 1, now + self.backoff(attempts[link] + 1), error_msg, user_id, link))
+                continue
+            if ok is None:
+                ok, error_msg = False, f"多次重试仍失败：{error_msg}"
+            final.append((link, ok, error_msg, info_hash))
+            done_links.append((user_id, link))
+
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE submission_queue SET attempts = ?, next_attempt = ?, last_error = ? WHERE user_id = ? AND link = ?",
+                retry_rows
+            )
+            self.conn.executemany("DELETE FROM submission_queue WHERE user_id = ? AND link = ?", done_links)
+
+        if final:
+            await self._report(bot, user_id, final)
@@ -0,0 +1,175 @@
+# 115 离线任务状态跟踪
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# 115 离线任务状态
+TASK_STATUS_FAILED = -1
+TASK_STATUS_DONE = 2
+
+
+class TaskTracker:
+    """记录用户提交的离线任务，后台按 115 账号批量查询任务列表并推送完成 / 失败通知
+
+    - 按 115 账号跟踪：绑定同一账号的多个 Telegram 用户共用一次任务列表请求，每个任务通知提交它的用户
+    - 只轮询有未完成任务的账号，一次任务列表请求覆盖该账号同一页上的所有任务
+    - 每轮最多查询 max_accounts_per_tick 个账号，按上次查询时间先后轮流
+    - 超过 task_ttl 仍未在任务列表中出现的任务不再跟踪
+    """
+
+    def __init__(self, db_path, fetch_page, notify, interval=60, tick=5,
+                 max_accounts_per_tick=20, max_pages=5, task_ttl=7 * 86400):
+        self._fetch_page = fetch_page  # async (user_id, page) -> (tasks, page_count)，用该用户的 token 查询，失败抛异常
+        self._notify = notify          # async (bot, user_id, name, task)
+        self.interval = interval
+        self.tick = tick
+        self.max_accounts_per_tick = max_accounts_per_tick
+        self.max_pages = max_pages
+        self.task_ttl = task_ttl
+        self._task = None
+        self._next_poll = {}
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tracked_tasks (
+                                user_id INTEGER NOT NULL,
+                                info_hash TEXT NOT NULL,
+                                name TEXT,
+                                submitted_at INTEGER NOT NULL,
+                                account TEXT,
+                                PRIMARY KEY (user_id, info_hash)
+                            )''')
+        # 旧版本的表没有 account 列，这些任务按 Telegram 用户单独查询
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tracked_tasks)")]
+        if "account" not in columns:
+            self.conn.execute("ALTER TABLE tracked_tasks ADD COLUMN account TEXT")
+        self.conn.commit()
+
+        # account -> {(user_id, info_hash): (name, submitted_at)}
+        self._tasks = {}
+        for user_id, info_hash, name, submitted_at, account in self.conn.execute(
+                "SELECT user_id, info_hash, name, submitted_at, account FROM tracked_tasks"):
+            account = account or str(user_id)
+            self._tasks.setdefault(account, {})[(user_id, info_hash)] = (name, submitted_at)
+
+    def active_count(self):
+        return sum(len(tasks) for tasks in self._tasks.values())
+
+    def track(self, account, user_id, tasks):
+        """登记用户在 115 账号 account 下新提交的任务，tasks 为 [(info_hash, name)]"""
+        account = str(account)
+        now = int(time.time())
+        rows = [(user_id, info_hash.lower(), name, now, account) for info_hash, name in tasks if info_hash]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tracked_tasks (user_id, info_hash, name, submitted_at, account) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        account_tasks = self._tasks.setdefault(account, {})
+        for _, info_hash, name, submitted_at, _ in rows:
+            account_tasks[(user_id, info_hash)] = (name, submitted_at)
+        # 新提交的任务在下一个间隔后开始查询
+        self._next_poll.setdefault(account, time.monotonic() + self.interval)
+
+    def untrack(self, account, keys):
+        """结束跟踪，keys 为 [(user_id, info_hash)]"""
+        with self.conn:
+            self.conn.executemany("DELETE FROM tracked_tasks WHERE user_id = ? AND info_hash = ?", keys)
+        account_tasks = self._tasks.get(account, {})
+        for key in keys:
+            account_tasks.pop(key, None)
+        if not account_tasks:
+            self._tasks.pop(account, None)
+            self._next_poll.pop(account, None)
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.conn.close()
+
+    async def _run(self, bot):
+        while True:
+            try:
+                await self._poll_due(bot)
+            except Exception as e:
+                logger.error(f"Task tracker tick failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.tick)
+
+    async def _poll_due(self, bot):
+        now = time.monotonic()
+        due = [account for account in self._tasks if self._next_poll.get(account, 0) <= now]
+        due.sort(key=lambda account: self._next_poll.get(account, 0))
+        due = due[:self.max_accounts_per_tick]
+        if due:
+            # 某个账号出错不影响同一轮的其他账号
+            results = await asyncio.gather(*(self._poll_account(bot, account) for account in due),
+                                           return_exceptions=True)
+            for account, result in zip(due, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Polling tasks for account {account} failed: {str(result)}", exc_info=result)
+
+    async def _fetch(self, user_ids, page):
+        """用账号下某个 Telegram 用户的 token 查询，该用户的 token 失效时换下一个"""
+        for i, user_id in enumerate(user_ids):
+            try:
+                return await self._fetch_page(user_id, page)
+            except Exception as e:
+                if i == len(user_ids) - 1:
+                    raise
+                logger.warning(f"Fetching task list page {page} with user {user_id} failed, trying next user: {str(e)}")
+
+    async def _poll_account(self, bot, account):
+        self._next_poll[account] = time.monotonic() + self.interval
+        # info_hash -> [(user_id, name, submitted_at)]，同一任务可能由绑定同一账号的多个用户提交
+        pending = {}
+        for (user_id, info_hash), (name, submitted_at) in self._tasks.get(account, {}).items():
+            pending.setdefault(info_hash, []).append((user_id, name, submitted_at))
+        user_ids = list(dict.fromkeys(user_id for entries in pending.values() for user_id, _, _ in entries))
+        finished = []
+        page, page_count = 1, 1
+        # 按页查询，直到所有跟踪的任务都找到或没有更多页
+        while pending and page <= min(page_count, self.max_pages):
+            try:
+                tasks, page_count = await self._fetch(user_ids, page)
+            except Exception as e:
+                logger.error(f"Fetching task list page {page} for account {account} failed: {str(e)}")
+                return
+            for task in tasks:
+                info_hash = str(task.get("info_hash", "")).lower()
+                entries = pending.pop(info_hash, None)
+                if not entries or task.get("status") not in (TASK_STATUS_DONE, TASK_STATUS_FAILED):
+                    continue
+                for user_id, name, _ in entries:
+                    finished.append((user_id, info_hash))
+                    try:
+                        await self._notify(bot, user_id, task.get("name") or name, task)
+                    except Exception as e:
+                        # 用户屏蔽了 bot 等情况下通知会一直失败，任务照样结束跟踪，避免每轮重复通知
+                        logger.error(f"Notifying user {user_id} about task {info_hash} failed: {str(e)}")
+            page += 1
+
+        # 长时间没有出现在任务列表里的任务（已被删除等）不再跟踪
+        deadline = time.time() - self.task_ttl
+        finished.extend((user_id, info_hash) for info_hash, entries in pending.items()
+                        for user_id, _, submitted_at in entries if submitted_at < deadline)
+        if finished:
+            self.untrack(account, finished)
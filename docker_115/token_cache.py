@@ -0,0 +1,74 @@
+# 用户 token 内存缓存
+import asyncio
+import logging
+import time
+
+from token_manager import is_token_expired
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """按用户缓存 access_token 及其获取时间
+
+    - 只有 token 接近过期时才刷新（提前量见 token_manager.is_token_expired）
+    - 同一用户的并发刷新只会真正发起一次请求，其余调用等待同一个结果
+    """
+
+    def __init__(self, read_token, write_token, refresh_token):
+        self._read_token = read_token
+        self._write_token = write_token
+        self._refresh_token = refresh_token  # async (user_id, token_info) -> 新 token 数据或 None
+        self._tokens = {}
+        self._refreshing = {}
+
+    def get(self, user_id):
+        """返回缓存的 token 信息，未缓存时从存储读取"""
+        token_info = self._tokens.get(user_id)
+        if token_info is None:
+            token_info = self._read_token(user_id)
+            if token_info:
+                self._tokens[user_id] = token_info
+        return token_info
+
+    def put(self, user_id, token_info):
+        """保存新获取的 token，并记录获取时间"""
+        token_info["timestamp"] = int(time.time())
+        self._write_token(user_id, token_info)
+        self._tokens[user_id] = token_info
+
+    def invalidate(self, user_id):
+        self._tokens.pop(user_id, None)
+
+    def is_expired(self, token_info, buffer=60):
+        # 旧版本写入的 token 没有 timestamp，视为已过期，刷新一次后补上
+        return is_token_expired(int(token_info.get("timestamp", 0)), int(token_info.get("expires_in", 7200)), buffer)
+
+    async def get_valid_token(self, user_id, buffer=60):
+        """返回距过期超过 buffer 秒的 token 信息，必要时刷新；未绑定或刷新失败返回 None"""
+        token_info = self.get(user_id)
+        if not token_info:
+            return None
+        if not self.is_expired(token_info, buffer):
+            return token_info
+
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(user_id, token_info))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        # shield 防止某个等待者被取消时连带取消共享的刷新任务
+        return await asyncio.shield(task)
+
+    async def _refresh(self, user_id, token_info):
+        logger.info(f"Refreshing token for user {user_id}")
+        new_data = await self._refresh_token(user_id, token_info)
+        if not new_data:
+            return None
+        token_info = dict(token_info)
+        token_info["access_token"] = new_data["access_token"]
+        token_info["refresh_token"] = new_data["refresh_token"]
+        if new_data.get("expires_in"):
+            token_info["expires_in"] = new_data["expires_in"]
+        self.put(user_id, token_info)
+        return token_info
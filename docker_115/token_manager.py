@@ -7,6 +7,10 @@ import string
 import qrcode_terminal # 需要安装此库：pip install qrcode-terminal
 import time
 import os
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 # 配置
 TOKEN_FILE = "token.txt"
@@ -87,14 +91,13 @@ def write_token(token_response_data: dict, api_status_code: int = 0):
     except Exception as e:
         print(f"写入新令牌到文件 '{TOKEN_FILE}' 时出错: {e}")
 
-def is_token_expired(timestamp: int, expires_in: int) -> bool:
+def is_token_expired(timestamp: int, expires_in: int, buffer: int = 60) -> bool:
     """
     检查访问令牌是否过期或接近过期。
-    包含60秒的缓冲时间以进行主动刷新。
-    （此函数在当前主逻辑中不再直接用于触发刷新，但保留以供参考）
+    默认包含60秒的缓冲时间以进行主动刷新，buffer 可调整提前量。
     """
     current_time = int(time.time())
-    return (current_time - timestamp) > (expires_in - 60)
+    return (current_time - timestamp) > (expires_in - buffer)
 
 # --- API交互函数 ---
 
@@ -300,6 +303,127 @@ def run_token_management_cycle(client_id: int):
         else:
             print("初始认证失败。无法获取令牌。")
 
+# --- 后台刷新服务（嵌入 bot 进程使用） ---
+
+class TokenRefresher:
+    """
+    定期扫描所有已保存的用户令牌，在过期前分批提前刷新，使用户请求无需等待刷新。
+    参数:
+        token_store: 提供 items() 的令牌存储（见 token_store.py）。
+        token_cache: TokenCache，实际刷新通过它完成，与用户请求共享同一次刷新。
+        interval (int): 两次扫描之间的间隔（秒）。
+        refresh_ahead (int): 距离过期不足该秒数时即刷新。
+        concurrency (int): 同时进行的刷新请求数。
+        on_failures: 可选 async (bot, failures) 回调，有用户连续失败次数达到 alert_after 时调用，用于告警；
+            同一用户在恢复之前只告警一次。
+        alert_after (int): 连续失败多少次后告警，默认首次失败即告警。
+    """
+
+    AGE_BUCKETS = ((3600, "<1h"), (6 * 3600, "1-6h"), (24 * 3600, "6-24h"), (None, ">24h"))
+
+    def __init__(self, token_store, token_cache, interval=300, refresh_ahead=900, concurrency=5, on_failures=None,
+                 alert_after=1):
+        self.token_store = token_store
+        self.token_cache = token_cache
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.concurrency = concurrency
+        self.on_failures = on_failures
+        self.alert_after = alert_after
+        self._task = None
+        # 指标
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.cycle_count = 0
+        self.last_cycle_at = None
+        self.failures = {}  # user_id -> (时间戳, 连续失败次数)
+        self.age_distribution = {}
+
+    def token_age(self, token_info, now):
+        return now - int(token_info.get("timestamp", 0))
+
+    def metrics(self):
+        """返回当前指标快照"""
+        return {
+            "cycles": self.cycle_count,
+            "last_cycle_at": self.last_cycle_at,
+            "refreshes": self.refresh_count,
+            "failures": self.failure_count,
+            "failing_users": len(self.failures),
+            "token_age": dict(self.age_distribution),
+        }
+
+    def start(self, bot=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, bot):
+        while True:
+            try:
+                await self.run_cycle(bot)
+            except Exception as e:
+                logger.error(f"Token refresh cycle failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_cycle(self, bot=None):
+        """执行一轮扫描与刷新，返回本轮失败的 user_id 列表"""
+        now = int(time.time())
+        due = []
+        ages = {label: 0 for _, label in self.AGE_BUCKETS}
+        # 存储读取是同步的 SQLite / 文件操作，放到线程中执行
+        tokens = await asyncio.to_thread(lambda: list(self.token_store.items()))
+        for user_id, token_info in tokens:
+            age = self.token_age(token_info, now)
+            for limit, label in self.AGE_BUCKETS:
+                if limit is None or age < limit:
+                    ages[label] += 1
+                    break
+            if is_token_expired(int(token_info.get("timestamp", 0)), int(token_info.get("expires_in", 7200)),
+                                buffer=self.refresh_ahead):
+                due.append(user_id)
+        self.age_distribution = ages
+        # 已解绑或重新绑定（token 不再需要刷新）的用户不再计入失败
+        due_users = set(due)
+        for user_id in [user_id for user_id in self.failures if user_id not in due_users]:
+            del self.failures[user_id]
+
+        failed = []
+        alerts = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh_one(user_id):
+            async with semaphore:
+                token_info = await self.token_cache.get_valid_token(user_id, buffer=self.refresh_ahead)
+            if token_info:
+                self.refresh_count += 1
+                self.failures.pop(user_id, None)
+            else:
+                self.failure_count += 1
+                _, count = self.failures.get(user_id, (0, 0))
+                self.failures[user_id] = (int(time.time()), count + 1)
+                failed.append(user_id)
+                if count + 1 == self.alert_after:
+                    alerts.append(user_id)
+
+        await asyncio.gather(*(refresh_one(user_id) for user_id in due))
+        self.cycle_count += 1
+        self.last_cycle_at = int(time.time())
+        if due:
+            logger.info(
+                f"Token refresh cycle: {len(due)} due, {len(due) - len(failed)} refreshed, {len(failed)} failed")
+        if alerts and self.on_failures:
+            await self.on_failures(bot, {user_id: self.failures[user_id] for user_id in alerts})
+        return failed
+
 # --- 主程序逻辑 ---
 
 def main():
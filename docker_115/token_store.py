@@ -0,0 +1,205 @@
+# 用户 token 存储后端
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore:
+    """token 存储基类，带进程内读缓存（包括“未绑定”的结果）
+
+    子类实现 _load / _save / _delete / user_ids。
+    读写缓存都持有 _lock（可重入，子类在 _load 等方法中也会使用），后台线程中的 items 与事件循环中的读写互不干扰。
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def get(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            if user_id in self._cache:
+                return self._cache[user_id]
+            token_data = self._load(user_id)
+            self._cache[user_id] = token_data
+            return token_data
+
+    def put(self, user_id, token_data):
+        user_id = int(user_id)
+        with self._lock:
+            self._save(user_id, token_data)
+            self._cache[user_id] = token_data
+
+    def delete(self, user_id):
+        """删除 token，返回之前是否存在"""
+        user_id = int(user_id)
+        with self._lock:
+            existed = self._delete(user_id)
+            self._cache[user_id] = None
+        return existed
+
+    def items(self):
+        """所有 (user_id, token_data) 的列表，按调用时的用户快照逐个读取，不会长时间占用锁"""
+        with self._lock:
+            user_ids = list(self.user_ids())
+        items = []
+        for user_id in user_ids:
+            token_data = self.get(user_id)
+            if token_data:
+                items.append((user_id, token_data))
+        return items
+
+    def _load(self, user_id):
+        raise NotImplementedError
+
+    def _save(self, user_id, token_data):
+        raise NotImplementedError
+
+    def _delete(self, user_id):
+        raise NotImplementedError
+
+    def user_ids(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonDirTokenStore(TokenStore):
+    """旧版存储：每个用户一个 JSON 文件，写入通过临时文件 + rename 保证原子性"""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.json")
+
+    def _load(self, user_id):
+        try:
+            with open(self._path(user_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read token file for user {user_id}: {e}")
+            return None
+
+    def _save(self, user_id, token_data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(token_data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(user_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _delete(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def user_ids(self):
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name.lstrip("-").isdigit():
+                yield int(name)
+
+
+class SqliteTokenStore(TokenStore):
+    """SQLite 存储（WAL 模式），以 user_id 为主键，每次写入是一个事务"""
+
+    def __init__(self, path):
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tokens (
+                                user_id INTEGER PRIMARY KEY,
+                                data TEXT NOT NULL,
+                                updated_at INTEGER NOT NULL
+                            )''')
+        self.conn.commit()
+
+    def _load(self, user_id):
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM tokens WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, user_id, token_data):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tokens (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(token_data, ensure_ascii=False), int(time.time()))
+            )
+
+    def _delete(self, user_id):
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
+        return cursor.rowcount > 0
+
+    def user_ids(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id FROM tokens").fetchall()
+        return [row[0] for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def create_token_store(backend, db_path, token_dir):
+    """根据配置创建存储后端：sqlite（默认）或 json（旧版目录结构）"""
+    if backend == "json":
+        return JsonDirTokenStore(token_dir)
+    if backend == "sqlite":
+        return SqliteTokenStore(db_path)
+    raise ValueError(f"Unknown token store backend: {backend}")
+
+
+def migrate_json_dir(token_dir, store):
+    """把旧版目录中的 *.json token 导入到 store，返回导入数量"""
+    source = JsonDirTokenStore(token_dir)
+    count = 0
+    for user_id, token_data in source.items():
+        store.put(user_id, token_data)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    # 一次性迁移：python token_store.py migrate --from user_tokens --to data/tokens.db
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="115 bot token 存储工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="将 JSON 目录中的 token 导入 SQLite")
+    migrate_parser.add_argument("--from", dest="token_dir", default=os.getenv("USER_TOKEN_DIR", "user_tokens"))
+    migrate_parser.add_argument("--to", dest="db_path", default=os.getenv("TOKEN_DB_PATH", "data/tokens.db"))
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = SqliteTokenStore(args.db_path)
+        migrated = migrate_json_dir(args.token_dir, store)
+        logger.info(f"Migrated {migrated} tokens from {args.token_dir} to {args.db_path}")
+        store.close()
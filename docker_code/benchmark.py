@@ -0,0 +1,606 @@
+# 性能基准测试脚本
+# 用法: python benchmark.py inserts [--codes 300] [--users 20]
+#       python benchmark.py classify [--messages 20000]
+#       python benchmark.py cursor [--rows 1000000] [--users 100]
+#       python benchmark.py export [--rows 1000000]
+#       python benchmark.py find [--rows 2000000] [--users 200]
+#       python benchmark.py storage [--users 1000] [--codes 500]
+#       python benchmark.py documents [--lines 100000]
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+from telegram.request import BaseRequest
+
+import code_patterns
+from code_patterns import PatternRegistry, classify_messages
+from db import init_fts, init_schema, insert_message_batches
+from exporter import export_messages
+from search import search_messages
+
+# 旧版按用户各存一份的 messages 表，只用于 storage 的对比
+LEGACY_SCHEMA = '''CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                content TEXT,
+                type TEXT,
+                created_at TEXT,
+                UNIQUE(user_id, content)
+            )'''
+
+
+def new_db(directory, name):
+    """与 bot 相同的表结构：codes + user_codes，messages 为视图"""
+    conn = sqlite3.connect(os.path.join(directory, name))
+    # 建表时的提示信息会打断结果表格
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_schema(conn)
+    return conn
+
+
+def fill(conn, rows, chunk_size=100000):
+    """按块写入 (user_id, content, type, created_at)，每块一个事务"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            insert_message_batches(conn, [chunk])
+            conn.commit()
+            chunk = []
+    if chunk:
+        insert_message_batches(conn, [chunk])
+        conn.commit()
+
+
+def make_rows(user_id, count):
+    now = datetime.now().isoformat(sep=' ', timespec='seconds')
+    return [(user_id, f"v_FilesPan1Bot_{user_id}_{i:06d}", 'filespan1bot_v', now) for i in range(count)]
+
+
+def insert_per_row(conn, batches):
+    """旧做法：每条一个事务"""
+    for rows in batches:
+        for row in rows:
+            insert_message_batches(conn, [[row]])
+            conn.commit()
+
+
+def insert_per_message(conn, batches):
+    """每条消息一个事务"""
+    for rows in batches:
+        insert_message_batches(conn, [rows])
+        conn.commit()
+
+
+def insert_group_commit(conn, batches):
+    """合并写入：多个用户的消息在同一个事务中提交（MessageWriter 的做法）"""
+    insert_message_batches(conn, batches)
+    conn.commit()
+
+
+def bench_inserts(args):
+    batches = [make_rows(user_id, args.codes) for user_id in range(args.users)]
+    total = args.codes * args.users
+    print(f"插入基准：{args.users} 个用户各粘贴 {args.codes} 条代码，共 {total} 条")
+    print(f"{'实现':<16}{'耗时(s)':>10}{'条/秒':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, func in (("per-row commit", insert_per_row),
+                           ("per-message", insert_per_message),
+                           ("group commit", insert_group_commit)):
+            conn = new_db(directory, f"{name.replace(' ', '_')}.db")
+            start = time.perf_counter()
+            func(conn, batches)
+            elapsed = time.perf_counter() - start
+            saved = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            assert saved == total, (name, saved)
+            conn.close()
+            print(f"{name:<16}{elapsed:>10.3f}{total / elapsed:>12.0f}")
+
+
+# 旧实现：正则提取后逐条用子串判断类型，作为正确性对照
+LEGACY_PATTERN = re.compile(r'(?:'
+    r'@(?:FilesPan1Bot|MediaBK5Bot|FilesDrive_BLGA_bot)\s+[^\s]+.*'
+    r'|showfilesbot_\d+[PpvVdD]_[A-Za-z0-9_\-\+]+'
+    r'|(?:vi|pk|[dvp])_(?:FilesPan1Bot_)?[A-Za-z0-9_\-\+]+'
+    r'|[A-Za-z0-9_\-\+]+=[^=\s]*?(?:_grp|_mda)(?=[\s\u4e00-\u9fa5]|$)'
+    r'|@filepan_bot:([A-Za-z0-9_\-\+]+)'
+    r')', re.IGNORECASE)
+
+
+def legacy_classify(text):
+    results = []
+    for m in LEGACY_PATTERN.finditer(text):
+        message = m.group(0)
+        if message.endswith('_grp') or message.endswith('_mda'):
+            end_pos = message.find('_grp')
+            if end_pos == -1:
+                end_pos = message.find('_mda')
+            if end_pos != -1:
+                message = message[:end_pos + 4]
+        bots = ('@FilesDrive_BLGA_bot', '@FilesPan1Bot', '@MediaBK5Bot', '@filepan_bot:')
+        if sum(1 for bot in bots if bot in message) > 1:
+            continue
+        if '@FilesDrive_BLGA_bot' in message:
+            message_type = 'filesdrive'
+        elif '@FilesPan1Bot' in message:
+            message_type = 'filespan1'
+        elif '@MediaBK5Bot' in message:
+            message_type = 'mediabk5'
+        elif '@filepan_bot:' in message:
+            message_type = 'filepan_bot'
+        elif message.startswith('showfilesbot_'):
+            message_type = 'showfilesbot-code'
+        elif message.startswith(('vi_', 'pk_')):
+            message_type = message[:2] + '_old'
+        elif message.startswith(('d_', 'v_', 'p_')):
+            if 'FilesPan1Bot_' in message:
+                message_type = 'filespan1bot_' + message[0]
+            else:
+                message_type = message[0] + '_new'
+        elif message.endswith(('_grp', '_mda')):
+            message_type = 'mediabk5bot'
+        else:
+            continue
+        results.append((message, message_type))
+    return results
+
+
+def random_token(rng, length):
+    return ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnpqrstuvwxyz0123456789') for _ in range(length))
+
+
+# 每种类型的样例生成器，覆盖所有 message_type
+SAMPLE_CODES = {
+    'filespan1': lambda rng: f"@FilesPan1Bot {random_token(rng, 24)}",
+    'mediabk5': lambda rng: f"@MediaBK5Bot {random_token(rng, 24)}",
+    'filesdrive': lambda rng: f"@FilesDrive_BLGA_bot {random_token(rng, 24)}",
+    'showfilesbot-code': lambda rng: f"showfilesbot_{rng.randint(1, 99)}{rng.choice('PVD')}_{random_token(rng, 20)}",
+    'vi_old': lambda rng: f"vi_{random_token(rng, 20)}",
+    'pk_old': lambda rng: f"pk_{random_token(rng, 20)}",
+    'filespan1bot_d': lambda rng: f"d_FilesPan1Bot_{random_token(rng, 20)}",
+    'filespan1bot_v': lambda rng: f"v_FilesPan1Bot_{random_token(rng, 20)}",
+    'filespan1bot_p': lambda rng: f"p_FilesPan1Bot_{random_token(rng, 20)}",
+    # 以 _grp / _mda 结尾的代码按旧规则截断到第一个 _grp（没有时 _mda）
+    'd_new': lambda rng: f"d_{random_token(rng, 20)}{rng.choice(['', '', f'_grp{random_token(rng, 4)}_mda'])}",
+    'v_new': lambda rng: f"v_{random_token(rng, 20)}",
+    'p_new': lambda rng: f"p_{random_token(rng, 20)}",
+    'mediabk5bot': lambda rng: f"{random_token(rng, 12)}={random_token(rng, 16)}{rng.choice(['_grp', '_mda', '_grp_mda', '_mda_grp'])}",
+    'filepan_bot': lambda rng: f"@filepan_bot:{random_token(rng, 20)}",
+}
+
+NOISE = ["今天的资源", "分享一下", "合集更新", "点击获取", "hello world", "老司机带路", "求资源 谢谢"]
+
+
+def make_corpus(count, seed=1):
+    """生成类似群聊转发内容的语料：代码与普通文字混排，另有一部分不含代码的消息"""
+    rng = random.Random(seed)
+    types = list(SAMPLE_CODES)
+    corpus = []
+    for _ in range(count):
+        lines = []
+        if rng.random() < 0.3:
+            lines = [rng.choice(NOISE) for _ in range(rng.randint(1, 5))]
+        else:
+            for _ in range(rng.randint(1, 12)):
+                code = SAMPLE_CODES[rng.choice(types)](rng)
+                lines.append(f"{rng.choice(NOISE)} {code}" if code[0] != '@' and rng.random() < 0.3 else code)
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+class UnfilteredRegistry(PatternRegistry):
+    """不做子串预筛，每条消息都用完整的合并正则扫描，作为预筛的对照"""
+
+    def may_contain(self, text):
+        return True
+
+
+def check_same(name, texts, func, expected_func=legacy_classify):
+    """func 与 expected_func 的结果逐条比较，有不一致时列出前几条并退出（不依赖 assert，-O 下同样生效）"""
+    mismatches = [(text, expected, actual) for text in texts
+                  if (actual := func(text)) != (expected := expected_func(text))]
+    if mismatches:
+        for text, expected, actual in mismatches[:5]:
+            print(f"{name} 不一致：{text!r}\n  期望 {expected}\n  实际 {actual}")
+        raise SystemExit(f"{name}：{len(mismatches)}/{len(texts)} 条消息结果不一致")
+
+
+def bench_classify(args):
+    corpus = make_corpus(args.messages)
+    unfiltered = UnfilteredRegistry(code_patterns.registry.families)
+
+    # 正确性：与旧实现、不预筛的结果一致，且覆盖全部类型
+    check_same("prefilter", corpus, classify_messages)
+    check_same("unfiltered", corpus, unfiltered.classify)
+    seen_types = set()
+    for text in corpus:
+        seen_types.update(message_type for _, message_type in classify_messages(text))
+    all_types = set(code_patterns.registry.types)
+    missing = all_types - seen_types
+    if missing:
+        raise SystemExit(f"语料未覆盖类型: {missing}")
+    print(f"正确性：{len(corpus)} 条消息结果与旧实现一致，覆盖全部 {len(all_types)} 种类型")
+
+    # 不含代码的普通聊天消息，预筛后不需要跑正则
+    rng = random.Random(2)
+    chatter = [" ".join(rng.choice(NOISE) for _ in range(rng.randint(1, 20))) for _ in range(args.messages)]
+    assert not any(code_patterns.registry.may_contain(text) for text in chatter)
+
+    # 配置中有类型没有填 literals 时，该类型用自己的正则预筛
+    families = [dict(family, literals=()) if family['type'] == 'mediabk5bot' else family
+                for family in code_patterns.registry.families]
+    partial = PatternRegistry(families)
+    check_same("partial", corpus, partial.classify)
+
+    print(f"{'语料':<10}{'实现':<12}{'耗时(s)':>10}{'消息/秒':>12}")
+    for corpus_name, texts in (("混合", corpus), ("无代码", chatter)):
+        for name, func in (("legacy", legacy_classify), ("unfiltered", unfiltered.classify),
+                           ("prefilter", classify_messages), ("partial", partial.classify)):
+            start = time.perf_counter()
+            for text in texts:
+                func(text)
+            elapsed = time.perf_counter() - start
+            print(f"{corpus_name:<10}{name:<12}{elapsed:>10.3f}{len(texts) / elapsed:>12.0f}")
+
+
+def bench_cursor(args):
+    """/send 增量查询：旧的 created_at 比较 vs (user_id, id) 索引上的 id 游标，表增长到 --rows 行"""
+    steps = [args.rows // 100, args.rows // 10, args.rows]
+    new_per_send = 50
+    start_time = datetime(2024, 1, 1)
+    print(f"增量查询基准：{args.users} 个用户，每次 /send 取 {new_per_send} 条新内容")
+    print(f"{'总行数':>10}{'时间戳(ms)':>14}{'id 游标(ms)':>14}")
+    with tempfile.TemporaryDirectory() as directory:
+        conn = new_db(directory, "cursor.db")
+        total = 0
+        for step in steps:
+            # 按时间顺序批量灌入，所有用户交替写入
+            fill(conn, ((i % args.users, f"d_{i:09d}", 'd_new',
+                         (start_time + timedelta(seconds=i // 10)).isoformat(sep=' '))
+                        for i in range(total, step)))
+            total = step
+
+            # 用户 0 上次发送后又保存了 new_per_send 条
+            last_id, last_time = conn.execute(
+                'SELECT MAX(id), MAX(created_at) FROM messages WHERE user_id = 0').fetchone()
+            later = (start_time + timedelta(seconds=total)).isoformat(sep=' ')
+            fill(conn, [(0, f"new_{total}_{i}", 'd_new', later) for i in range(new_per_send)])
+
+            timings = []
+            for sql, params in (
+                ('SELECT id, content, type, created_at FROM messages WHERE user_id = ? AND created_at > ? ORDER BY created_at', (0, last_time)),
+                ('SELECT id, content, type, created_at FROM messages WHERE user_id = ? AND id > ? ORDER BY id', (0, last_id)),
+            ):
+                best = None
+                for _ in range(args.repeat):
+                    begin = time.perf_counter()
+                    result = conn.execute(sql, params).fetchall()
+                    elapsed = time.perf_counter() - begin
+                    best = elapsed if best is None else min(best, elapsed)
+                assert len(result) == new_per_send, (sql, len(result))
+                timings.append(best * 1000)
+            total += new_per_send
+            print(f"{total:>10}{timings[0]:>14.3f}{timings[1]:>14.3f}")
+
+        plan = conn.execute('EXPLAIN QUERY PLAN SELECT id FROM messages WHERE user_id = ? AND id > ? ORDER BY id', (0, 0)).fetchall()
+        print(f"id 游标查询计划：{'; '.join(row[-1] for row in plan)}")
+        conn.close()
+
+
+def export_fetchall(db_path, user_id, path):
+    """旧实现：fetchall 后在内存中分组再写文件"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT content, type, created_at FROM messages WHERE user_id = ? ORDER BY created_at', (user_id,)).fetchall()
+    conn.close()
+    grouped_messages = {}
+    for content, msg_type, created_at in rows:
+        grouped_messages.setdefault(msg_type, []).append((content, created_at))
+    with open(path, 'w', encoding='utf-8') as tmp:
+        for msg_type, messages in grouped_messages.items():
+            tmp.write(f"\n=== {msg_type} (共 {len(messages)} 条) ===\n")
+            for content, created_at in messages:
+                tmp.write(f"{created_at}: {content}\n")
+
+
+def bench_export(args):
+    """/all 导出的峰值内存随历史条数的变化"""
+    types = list(SAMPLE_CODES)
+    rng = random.Random(1)
+    print(f"{'条数':>10}{'fetchall 峰值(MB)':>20}{'流式峰值(MB)':>16}{'流式耗时(s)':>14}{'gzip(s)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "export.db")
+        conn = new_db(directory, "export.db")
+        total = 0
+        for step in (args.rows // 100, args.rows // 10, args.rows):
+            now = datetime.now().isoformat(sep=' ', timespec='seconds')
+            fill(conn, ((1, f"{i:09d}_{random_token(rng, 24)}", rng.choice(types), now) for i in range(total, step)))
+            total = step
+
+            tracemalloc.start()
+            export_fetchall(db_path, 1, os.path.join(directory, "old.txt"))
+            old_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            tracemalloc.start()
+            export = export_messages(conn, 1, 'messages')
+            new_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert export['total'] == total
+            os.unlink(export['path'])
+
+            start = time.perf_counter()
+            export = export_messages(conn, 1, 'messages')
+            elapsed = time.perf_counter() - start
+            os.unlink(export['path'])
+
+            start = time.perf_counter()
+            export = export_messages(conn, 1, 'messages', compress='gzip')
+            gzip_elapsed = time.perf_counter() - start
+            os.unlink(export['path'])
+            print(f"{total:>10}{old_peak / 2**20:>20.1f}{new_peak / 2**20:>16.1f}{elapsed:>14.2f}{gzip_elapsed:>10.2f}")
+        conn.close()
+
+
+def bench_find(args):
+    """/find 在大表上的查询耗时：trigram 全文索引 vs LIKE 全表扫描"""
+    types = list(SAMPLE_CODES)
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, "find.db"))
+        init_schema(conn)
+        base = datetime(2024, 1, 1)
+
+        def generate(first, count):
+            for i in range(first, first + count):
+                msg_type = rng.choice(types)
+                yield (i % args.users, SAMPLE_CODES[msg_type](rng), msg_type,
+                       (base + timedelta(seconds=i * 10)).isoformat(sep=' '))
+
+        for offset in range(0, args.rows, 100000):
+            insert_message_batches(conn, [list(generate(offset, min(100000, args.rows - offset)))])
+            conn.commit()
+
+        # 已有数据库首次启动：一次性重建索引
+        start = time.perf_counter()
+        assert init_fts(conn), "当前 SQLite 不支持 trigram 分词器"
+        print(f"为 {args.rows} 行建立全文索引：{time.perf_counter() - start:.1f}s")
+
+        # 之后的写入由触发器增量更新索引，按 bot 的方式每批一个事务
+        extra = 20000
+        start = time.perf_counter()
+        for offset in range(args.rows, args.rows + extra, 500):
+            insert_message_batches(conn, [list(generate(offset, 500))])
+            conn.commit()
+        elapsed = time.perf_counter() - start
+        print(f"增量写入 {extra} 行（含索引更新）：{elapsed:.2f}s，{extra / elapsed:.0f} 行/秒")
+
+        user_id = 7
+        sample = conn.execute('SELECT content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET 100', (user_id,)).fetchone()[0]
+        cases = [
+            ("精确片段", {'term': sample[-10:]}),
+            ("常见词", {'term': 'FilesPan1Bot'}),
+            ("常见词+类型", {'term': 'FilesPan1Bot', 'type': 'filespan1bot_v'}),
+            ("常见词+日期", {'term': 'FilesPan1Bot', 'since': '2024-03-01', 'until': '2024-03-08'}),
+            ("无结果", {'term': 'zzzzzz'}),
+        ]
+        print(f"{'查询':<14}{'FTS 首页(ms)':>14}{'FTS 翻页(ms)':>14}{'LIKE 首页(ms)':>15}{'条数':>6}")
+        for name, query in cases:
+            timings = []
+            for fts in (True, False):
+                begin = time.perf_counter()
+                rows, has_older, _ = search_messages(conn, query, user_id, fts)
+                timings.append((time.perf_counter() - begin) * 1000)
+                if fts:
+                    fts_rows = rows
+                    # 连续向后翻 5 页，记录最后一页的耗时
+                    page_rows, page_has_older = rows, has_older
+                    page_time = 0
+                    for _ in range(5):
+                        if not page_has_older:
+                            break
+                        begin = time.perf_counter()
+                        page_rows, page_has_older, _ = search_messages(conn, query, user_id, fts, before_id=page_rows[-1][0])
+                        page_time = (time.perf_counter() - begin) * 1000
+                    timings.append(page_time)
+                else:
+                    assert rows == fts_rows, name
+            print(f"{name:<14}{timings[0]:>14.2f}{timings[1]:>14.2f}{timings[2]:>15.2f}{len(fts_rows):>6}")
+        conn.close()
+
+
+def bench_storage(args):
+    """多个用户保存同一批热门代码时的数据库大小：旧的按用户存储 vs codes + user_codes"""
+    rng = random.Random(1)
+    types = list(SAMPLE_CODES)
+    pool = [(SAMPLE_CODES[t](rng), t) for t in (rng.choice(types) for _ in range(args.codes * 10))]
+    now = datetime.now().isoformat(sep=' ', timespec='seconds')
+    # 每个用户从共享池中保存 --codes 个代码，热门代码被大多数人保存
+    batches = [[(user_id, content, msg_type, now)
+                for content, msg_type in rng.sample(pool[:args.codes * 2], args.codes)]
+               for user_id in range(args.users)]
+    total = args.users * args.codes
+    print(f"{args.users} 个用户各保存 {args.codes} 个代码（共 {total} 条，来自 {args.codes * 2} 个不重复代码）")
+    with tempfile.TemporaryDirectory() as directory:
+        old_path = os.path.join(directory, "old.db")
+        conn = sqlite3.connect(old_path)
+        conn.execute(LEGACY_SCHEMA)
+        conn.execute('CREATE INDEX idx_messages_user_id ON messages (user_id, id)')
+        conn.execute('CREATE INDEX idx_messages_user_type ON messages (user_id, type, id)')
+        start = time.perf_counter()
+        for rows in batches:
+            conn.executemany('INSERT OR IGNORE INTO messages (user_id, content, type, created_at) VALUES (?, ?, ?, ?)', rows)
+            conn.commit()
+        old_time = time.perf_counter() - start
+        conn.execute('VACUUM')
+        conn.close()
+
+        new_path = os.path.join(directory, "new.db")
+        conn = sqlite3.connect(new_path)
+        init_schema(conn)
+        start = time.perf_counter()
+        for rows in batches:
+            insert_message_batches(conn, [rows])
+            conn.commit()
+        new_time = time.perf_counter() - start
+        assert conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0] == total
+        top = conn.execute('SELECT user_count FROM codes ORDER BY user_count DESC LIMIT 1').fetchone()[0]
+        conn.execute('VACUUM')
+        conn.close()
+
+        print(f"{'存储方式':<16}{'大小(MB)':>10}{'写入(s)':>10}")
+        print(f"{'per-user rows':<16}{os.path.getsize(old_path) / 2**20:>10.1f}{old_time:>10.2f}")
+        print(f"{'codes+user_codes':<16}{os.path.getsize(new_path) / 2**20:>10.1f}{new_time:>10.2f}")
+        print(f"最热门的代码被 {top} 个用户保存")
+
+
+class FakeTelegramRequest(BaseRequest):
+    """代替 Bot API 的请求对象：记录 sendMessage / editMessageText 的时间和内容，下载文件时返回 file_data"""
+
+    def __init__(self, file_data=b''):
+        self.file_data = file_data
+        self.sent = []  # (时间, chat_id, text)
+        self.message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if '/file/' in url:
+            return 200, self.file_data
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif endpoint == "getFile":
+            result = {"file_id": params["file_id"], "file_unique_id": "u1", "file_size": len(self.file_data),
+                      "file_path": "documents/codes.txt"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            self.sent.append((time.perf_counter(), int(params["chat_id"]), params["text"]))
+            self.message_id += 1
+            result = {"message_id": self.message_id, "date": int(time.time()), "text": params["text"],
+                      "chat": {"id": int(params["chat_id"]), "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_update(update_id, user_id, bot, text=None, document=None):
+    message = {"message_id": update_id, "date": int(time.time()),
+               "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+    if document:
+        message["document"] = document
+    else:
+        message["text"] = text
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def bench_documents(args):
+    """导入大文件期间另一个用户发送一条代码消息：比较在处理函数中等待导入（inline）
+    与交给后台任务（background）时，第二个用户收到回复的时间；两种方式都按 PTB 默认逐个处理更新"""
+    directory = tempfile.mkdtemp()
+    # tg_bot 在导入时打开 ./data/messages.db，切换到临时目录避免写入真实数据库
+    os.chdir(directory)
+    import tg_bot
+
+    rng = random.Random(1)
+    types = list(SAMPLE_CODES)
+    file_data = "\n".join(SAMPLE_CODES[rng.choice(types)](rng) for _ in range(args.lines)).encode()
+    document = {"file_id": "doc1", "file_unique_id": "u1", "file_name": "codes.txt",
+                "mime_type": "text/plain", "file_size": len(file_data)}
+
+    async def inline_document(update, context):
+        """旧实现：在处理函数中下载并导入，期间不处理其他更新"""
+        status = await update.message.reply_text("正在处理文件…")
+        await tg_bot.process_document(update, context, status)
+
+    async def run(document_handler, uploader):
+        request = FakeTelegramRequest(file_data)
+        app = ApplicationBuilder().token("1:bench").request(request).get_updates_request(FakeTelegramRequest()).build()
+        app.add_handler(MessageHandler(filters.Document.ALL, document_handler))
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, tg_bot.handle_message))
+        await app.initialize()
+        await app.start()
+        start = time.perf_counter()
+        await app.update_queue.put(make_update(1, uploader, app.bot, document=document))
+        await asyncio.sleep(0.05)
+        await app.update_queue.put(make_update(2, 2, app.bot, text=SAMPLE_CODES['d_new'](rng)))
+
+        def sent_to(chat_id, marker):
+            return [at for at, chat, text in request.sent if chat == chat_id and marker in text]
+        while not sent_to(uploader, "处理完成") or not sent_to(2, "提取到"):
+            await asyncio.sleep(0.01)
+        await app.stop()
+        await app.shutdown()
+        return sent_to(2, "提取到")[0] - start, sent_to(uploader, "处理完成")[0] - start
+
+    print(f"导入 {args.lines} 行（{len(file_data) / 2**20:.1f} MB）的文件期间，另一个用户发送一条代码消息")
+    print(f"{'处理方式':<12}{'第二个用户回复(s)':>18}{'导入完成(s)':>14}")
+    # 每次使用不同的上传用户，文件中的代码对该用户都是新的
+    for uploader, (name, handler) in enumerate((("inline", inline_document),
+                                                ("background", tg_bot.handle_document)), start=100):
+        reply_at, ingest_done = asyncio.run(run(handler, uploader))
+        print(f"{name:<12}{reply_at:>18.2f}{ingest_done:>14.2f}")
+        if name == "background":
+            assert reply_at < ingest_done, "导入期间第二个用户的消息没有被处理"
+    tg_bot.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="代码收集 bot 基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    inserts_parser = subparsers.add_parser("inserts", help="提取结果写入速度")
+    inserts_parser.add_argument("--codes", type=int, default=300, help="每条消息的代码数")
+    inserts_parser.add_argument("--users", type=int, default=20, help="同时粘贴的用户数")
+    classify_parser = subparsers.add_parser("classify", help="代码提取分类速度与正确性")
+    classify_parser.add_argument("--messages", type=int, default=20000, help="语料消息数")
+    cursor_parser = subparsers.add_parser("cursor", help="/send 增量查询随表大小的耗时")
+    cursor_parser.add_argument("--rows", type=int, default=1000000, help="最终总行数")
+    cursor_parser.add_argument("--users", type=int, default=100, help="用户数")
+    cursor_parser.add_argument("--repeat", type=int, default=5, help="每个查询重复次数，取最快一次")
+    export_parser = subparsers.add_parser("export", help="/all 导出的内存占用")
+    export_parser.add_argument("--rows", type=int, default=1000000, help="最终历史条数")
+    find_parser = subparsers.add_parser("find", help="/find 全文搜索耗时")
+    find_parser.add_argument("--rows", type=int, default=2000000, help="总行数")
+    find_parser.add_argument("--users", type=int, default=200, help="用户数")
+    storage_parser = subparsers.add_parser("storage", help="跨用户去重后的数据库大小")
+    storage_parser.add_argument("--users", type=int, default=1000, help="用户数")
+    storage_parser.add_argument("--codes", type=int, default=500, help="每个用户保存的代码数")
+    documents_parser = subparsers.add_parser("documents", help="导入文件期间其他用户的消息是否被处理")
+    documents_parser.add_argument("--lines", type=int, default=100000, help="文件行数")
+    args = parser.parse_args()
+
+    if args.command == "inserts":
+        bench_inserts(args)
+    elif args.command == "classify":
+        bench_classify(args)
+    elif args.command == "cursor":
+        bench_cursor(args)
+    elif args.command == "export":
+        bench_export(args)
+    elif args.command == "find":
+        bench_find(args)
+    elif args.command == "storage":
+        bench_storage(args)
+    elif args.command == "documents":
+        bench_documents(args)
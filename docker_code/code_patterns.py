@@ -0,0 +1,131 @@
+# 代码提取与分类
+import json
+import os
+import re
+
+# 代码类型表的配置文件，默认使用与本模块同目录的 code_patterns.json
+PATTERNS_FILE = os.environ.get('CODE_PATTERNS_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code_patterns.json')
+
+
+def load_families(path):
+    """读取代码类型表，返回 [{'type', 'regex', 'literals', 'trim'}]
+
+    配置文件格式为 {"families": [...]}，按顺序尝试，靠前的优先；每一项：
+      type: 类型名
+      regex: 匹配代码的正则
+      literals: 匹配结果中必然出现的子串；消息中所有类型的 literals 都没有出现时跳过正则。
+                不填时该类型用自己的正则单独预筛，比合并正则慢，但只对这一种类型扫描
+      trim: 可选，"whitespace" 去掉结尾空白；或子串列表，匹配以其中某个子串结尾时，
+            截断到按列表顺序第一个在匹配中出现的子串为止（旧版的 _grp / _mda 规则）
+    """
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    families = []
+    for item in config['families']:
+        trim = item.get('trim')
+        if trim is not None and trim != 'whitespace' and not (isinstance(trim, list) and all(trim)):
+            raise ValueError(f"类型 {item['type']} 的 trim 无效: {trim!r}")
+        families.append({
+            'type': item['type'],
+            'regex': item['regex'],
+            'literals': tuple(item.get('literals') or ()),
+            'trim': trim,
+        })
+    if not families:
+        raise ValueError("代码类型表为空")
+    return families
+
+
+def compile_code_pattern(families):
+    """把类型表编译为一个正则，返回 (正则, 分组名 -> 类型下标)
+
+    区分大小写：旧版的合并正则带 IGNORECASE，但按类型保存时用区分大小写的子串判断，
+    大小写不符的匹配（如 D_xxx、@filespan1bot）只出现在回复的提取列表中、从未保存；
+    现在这类内容不再匹配，保存的结果不变，回复中也不再列出。
+    """
+    group_families = {f'f{i}': i for i in range(len(families))}
+    pattern = re.compile('|'.join(f'(?P<f{i}>{family["regex"]})' for i, family in enumerate(families)))
+    return pattern, group_families
+
+
+def _trim(match, trim):
+    if trim == 'whitespace':
+        return match.rstrip()
+    if match.endswith(tuple(trim)):
+        for end in trim:
+            pos = match.find(end)
+            if pos != -1:
+                return match[:pos + len(end)]
+    return match
+
+
+class PatternRegistry:
+    """编译后的代码类型表
+
+    先预筛：消息中不含任何类型的 literals 时直接跳过合并正则，普通聊天消息只需几次子串查找；
+    未配置 literals 的类型用各自的正则预筛，仍比对每条消息跑完整的合并正则快。
+    """
+
+    def __init__(self, families):
+        self.families = families
+        self.types = [family['type'] for family in families]
+        self.pattern, self.group_families = compile_code_pattern(families)
+        literals = {}  # 去重并保持顺序
+        for family in families:
+            for literal in family['literals']:
+                literals[literal] = None
+        self.literals = tuple(literals)
+        self.gates = [re.compile(family['regex']) for family in families if not family['literals']]
+        # 一行中同时提到多个 bot 时无法判断归属，跳过
+        self.mentions = tuple(literal for literal in literals if literal.startswith('@'))
+
+    def may_contain(self, text):
+        """消息中是否可能有代码"""
+        return (any(literal in text for literal in self.literals)
+                or any(gate.search(text) for gate in self.gates))
+
+    def classify(self, text):
+        if not self.may_contain(text):
+            return []
+        results = []
+        for m in self.pattern.finditer(text):
+            match = m.group(0)
+            if match.startswith('@') and sum(1 for mention in self.mentions if mention in match) > 1:
+                continue
+            family = self.families[self.group_families[m.lastgroup]]
+            if family['trim']:
+                match = _trim(match, family['trim'])
+            results.append((match, family['type']))
+        return results
+
+
+registry = PatternRegistry(load_families(PATTERNS_FILE))
+
+
+def reload_patterns(path=None):
+    """重新读取类型表，成功后整体替换；配置有误时抛出异常，继续使用原来的类型表"""
+    global registry
+    registry = PatternRegistry(load_families(path or PATTERNS_FILE))
+    return registry
+
+
+# 提取并分类：单次扫描，返回 [(内容, 类型)]
+def classify_messages(text):
+    return registry.classify(text)
+
+# 提取消息内容
+def extract_messages(text):
+    return [match for match, _ in classify_messages(text)]
+
+# 单行最多读取的字节数，超长的行会被截断为多段处理
+MAX_LINE_BYTES = 64 * 1024
+
+# 从二进制文本流中逐行提取：读取至多 max_lines 行，返回 ([(内容, 类型)], 是否已读完)
+def classify_lines(stream, max_lines):
+    results = []
+    for _ in range(max_lines):
+        line = stream.readline(MAX_LINE_BYTES)
+        if not line:
+            return results, True
+        results.extend(classify_messages(line.decode('utf-8', errors='replace')))
+    return results, False
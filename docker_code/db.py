@@ -0,0 +1,346 @@
+# 数据访问层：WAL 模式，写操作由单个线程串行执行，读操作由只读连接池并发执行
+# 所有数据库调用都在线程中完成，不会阻塞事件循环
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DB_PATH = './data/messages.db'
+
+
+def content_hash(content):
+    # 旧数据库中可能有 content 为 NULL 的行，在 SQL 中调用时返回 NULL 而不是抛出异常
+    if content is None:
+        return None
+    return hashlib.sha1(content.encode('utf-8')).digest()
+
+
+def init_schema(conn):
+    """建表、建索引并迁移旧数据库
+
+    codes 中每个代码只存一份，user_codes 记录哪个用户在什么时候保存了哪个代码；
+    messages 视图把两者拼回原来的 (id, user_id, content, type, created_at)，供导出和查询使用。
+    """
+    conn.create_function('content_hash', 1, content_hash, deterministic=True)
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+    conn.execute('''CREATE TABLE IF NOT EXISTS codes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        content_hash BLOB NOT NULL UNIQUE,
+                        content TEXT NOT NULL,
+                        type TEXT,
+                        first_seen TEXT,
+                        user_count INTEGER NOT NULL DEFAULT 0
+                    )''')
+    # type 与 codes 中的相同（由内容决定），冗余一份以便按用户、类型走索引
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_codes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        code_id INTEGER NOT NULL REFERENCES codes (id),
+                        type TEXT,
+                        created_at TEXT,
+                        UNIQUE (code_id, user_id)
+                    )''')
+    if legacy:
+        migrate_messages_table(conn)
+    conn.execute('''CREATE VIEW IF NOT EXISTS messages AS
+                        SELECT uc.id AS id, uc.user_id AS user_id, c.content AS content,
+                               uc.type AS type, uc.created_at AS created_at
+                        FROM user_codes uc JOIN codes c ON c.id = uc.code_id''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_status (
+                        user_id INTEGER PRIMARY KEY,
+                        last_send_time TEXT,
+                        last_sent_id INTEGER
+                    )''')
+    # /send 按 id 增量读取，(user_id, id) 索引让查询变成范围扫描
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_codes_user_id ON user_codes (user_id, id)')
+    # 导出按类型分组，逐类型按 id 分块读取
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_codes_user_type ON user_codes (user_id, type, id)')
+    # 热门代码排行
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_codes_user_count ON codes (user_count)')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS codes_user_count_insert AFTER INSERT ON user_codes BEGIN
+                        UPDATE codes SET user_count = user_count + 1 WHERE id = new.code_id;
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS codes_user_count_delete AFTER DELETE ON user_codes BEGIN
+                        UPDATE codes SET user_count = user_count - 1 WHERE id = old.code_id;
+                    END''')
+    conn.commit()
+    migrate_user_status(conn)
+    init_user_counters(conn)
+
+
+def migrate_messages_table(conn):
+    """把旧的 messages 表（每个用户一份内容）拆分为 codes + user_codes
+
+    user_codes 沿用原来的 id，user_status.last_sent_id 无需改动；旧表上的全文索引和触发器一并删除。
+    """
+    print("迁移 messages 表到 codes / user_codes...")
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO codes (content_hash, content, type, first_seen)
+                        SELECT content_hash(content), content, type, MIN(created_at) FROM messages
+                        WHERE content IS NOT NULL
+                        GROUP BY content ORDER BY MIN(id)''')
+        conn.execute('''INSERT OR IGNORE INTO user_codes (id, user_id, code_id, type, created_at)
+                        SELECT m.id, m.user_id, c.id, c.type, m.created_at
+                        FROM messages m JOIN codes c ON c.content_hash = content_hash(m.content)
+                        WHERE m.content IS NOT NULL
+                        ORDER BY m.id''')
+        conn.execute('UPDATE codes SET user_count = (SELECT COUNT(*) FROM user_codes WHERE code_id = codes.id)')
+        conn.execute('DROP TABLE IF EXISTS messages_fts')
+        conn.execute('DROP TABLE messages')
+    print(f"迁移完成：{conn.execute('SELECT COUNT(*) FROM codes').fetchone()[0]} 个不重复代码，"
+          f"{conn.execute('SELECT COUNT(*) FROM user_codes').fetchone()[0]} 条用户记录")
+
+
+def init_user_counters(conn):
+    """按用户、类型统计条数和最近保存时间，由触发器在同一事务中更新；首次创建时从已有数据统计一次"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_counters'").fetchone()
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_counters (
+                        user_id INTEGER NOT NULL,
+                        type TEXT NOT NULL,
+                        message_count INTEGER NOT NULL,
+                        last_active_at TEXT,
+                        PRIMARY KEY (user_id, type)
+                    )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS user_counters_insert AFTER INSERT ON user_codes BEGIN
+                        INSERT INTO user_counters (user_id, type, message_count, last_active_at)
+                        VALUES (new.user_id, new.type, 1, new.created_at)
+                        ON CONFLICT (user_id, type) DO UPDATE SET
+                            message_count = message_count + 1,
+                            last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS user_counters_delete AFTER DELETE ON user_codes BEGIN
+                        UPDATE user_counters SET message_count = message_count - 1
+                        WHERE user_id = old.user_id AND type = old.type;
+                    END''')
+    if not exists:
+        print("统计已有用户数据...")
+        conn.execute('''INSERT INTO user_counters (user_id, type, message_count, last_active_at)
+                        SELECT user_id, type, COUNT(*), MAX(created_at) FROM user_codes
+                        WHERE type IS NOT NULL GROUP BY user_id, type''')
+    conn.commit()
+
+
+def user_stats_page(conn, order, offset, limit):
+    """从 user_counters 读取一页用户统计，order 为 top（条数最多）或 recent（最近活跃）
+
+    返回 (用户总数, [(user_id, 总条数, 最近保存时间, [(type, 条数)])])
+    """
+    order_by = 'last_active DESC' if order == 'recent' else 'total DESC'
+    user_count = conn.execute('SELECT COUNT(DISTINCT user_id) FROM user_counters WHERE message_count > 0').fetchone()[0]
+    users = conn.execute(f'''SELECT user_id, SUM(message_count) AS total, MAX(last_active_at) AS last_active
+                             FROM user_counters WHERE message_count > 0
+                             GROUP BY user_id ORDER BY {order_by}, user_id LIMIT ? OFFSET ?''',
+                         (limit, offset)).fetchall()
+    if not users:
+        return user_count, []
+    types = {}
+    placeholders = ','.join('?' * len(users))
+    for user_id, msg_type, count in conn.execute(f'''SELECT user_id, type, message_count FROM user_counters
+                                                     WHERE user_id IN ({placeholders}) AND message_count > 0
+                                                     ORDER BY message_count DESC, type''',
+                                                 [user_id for user_id, _, _ in users]):
+        types.setdefault(user_id, []).append((msg_type, count))
+    return user_count, [(user_id, total, last_active, types.get(user_id, [])) for user_id, total, last_active in users]
+
+
+def popular_codes(conn, limit, msg_type=None):
+    """保存人数最多的代码 [(content, type, user_count, first_seen)]"""
+    sql = 'SELECT content, type, user_count, first_seen FROM codes WHERE user_count > 0'
+    params = []
+    if msg_type:
+        sql += ' AND type = ?'
+        params.append(msg_type)
+    sql += ' ORDER BY user_count DESC LIMIT ?'
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def code_stats(conn, content):
+    """单个代码的 (type, user_count, first_seen)，不存在时返回 None"""
+    return conn.execute('SELECT type, user_count, first_seen FROM codes WHERE content_hash = ?',
+                        (content_hash(content),)).fetchone()
+
+
+def init_fts(conn):
+    """为 codes.content 建立 trigram 全文索引，新代码插入时由触发器增量更新
+
+    每个不重复的代码只索引一次；首次创建时对已有数据重建一次索引；
+    SQLite 低于 3.34 不支持 trigram，返回 False
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'codes_fts'").fetchone()
+    if not exists:
+        try:
+            conn.execute('''CREATE VIRTUAL TABLE codes_fts USING fts5(
+                                content, content='codes', content_rowid='id', tokenize='trigram'
+                            )''')
+        except sqlite3.OperationalError as e:
+            print(f"无法创建全文索引，/find 将使用 LIKE 查询：{e}")
+            return False
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS codes_fts_insert AFTER INSERT ON codes BEGIN
+                        INSERT INTO codes_fts (rowid, content) VALUES (new.id, new.content);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS codes_fts_delete AFTER DELETE ON codes BEGIN
+                        INSERT INTO codes_fts (codes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END''')
+    if not exists:
+        print("为已有内容建立全文索引...")
+        conn.execute("INSERT INTO codes_fts (codes_fts) VALUES ('rebuild')")
+    conn.commit()
+    return True
+
+
+def migrate_user_status(conn):
+    """旧数据库的 user_status 只记录 last_send_time，补上 last_sent_id 列并换算成已发送的最大 id"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(user_status)')]
+    if 'last_sent_id' in columns:
+        return
+    print("迁移 user_status：按 last_send_time 计算 last_sent_id...")
+    with conn:
+        conn.execute('ALTER TABLE user_status ADD COLUMN last_sent_id INTEGER')
+        # 旧逻辑下 created_at <= last_send_time 的内容都已发送过
+        conn.execute('''UPDATE user_status SET last_sent_id = COALESCE(
+                            (SELECT MAX(id) FROM messages
+                             WHERE messages.user_id = user_status.user_id
+                               AND messages.created_at <= user_status.last_send_time), 0)
+                        WHERE last_send_time IS NOT NULL''')
+
+
+class Database:
+    """写连接只在写线程中使用，每个读线程各持有一个只读连接
+
+    WAL 模式下读写互不阻塞，长时间的导出只占用一个读线程，
+    其他用户的 /send 和写入照常进行。
+    """
+
+    def __init__(self, path=DB_PATH, readers=4):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._local = threading.local()
+        self._read_conns = []
+        self._read_conns_lock = threading.Lock()
+        self.fts = False
+        self._write_conn = self._writer.submit(self._open_writer).result()
+
+    def _open_writer(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL 下 NORMAL 只在检查点时 fsync，断电最多丢失最后几个事务
+        conn.execute('PRAGMA synchronous=NORMAL')
+        init_schema(conn)
+        self.fts = init_fts(conn)
+        return conn
+
+    def _read_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA query_only=ON')
+            self._local.conn = conn
+            with self._read_conns_lock:
+                self._read_conns.append(conn)
+        return conn
+
+    def _call_read(self, func, args, kwargs):
+        return func(self._read_conn(), *args, **kwargs)
+
+    def _call_write(self, func, args, kwargs):
+        try:
+            result = func(self._write_conn, *args, **kwargs)
+            self._write_conn.commit()
+            return result
+        except Exception:
+            self._write_conn.rollback()
+            raise
+
+    async def read(self, func, *args, **kwargs):
+        """在读线程中执行 func(conn, *args, **kwargs)"""
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._call_read, func, args, kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """在写线程中执行 func(conn, *args, **kwargs) 并提交，出错时回滚后抛出"""
+        return await asyncio.get_running_loop().run_in_executor(self._writer, self._call_write, func, args, kwargs)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """执行一条写语句，返回影响的行数"""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        self._writer.submit(self._write_conn.close).result()
+        self._writer.shutdown(wait=True)
+        with self._read_conns_lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns.clear()
+
+
+def insert_message_batches(conn, batches):
+    """每批 (user_id, content, type, created_at) 分别写入，返回各批新增条数
+
+    新代码写入 codes，已存在的只在 user_codes 中加一条关联；同一用户重复保存的被忽略
+    """
+    cursor = conn.cursor()
+    counts = []
+    for rows in batches:
+        hashed = [(content_hash(content), user_id, content, msg_type, created_at)
+                  for user_id, content, msg_type, created_at in rows]
+        cursor.executemany('INSERT OR IGNORE INTO codes (content_hash, content, type, first_seen) VALUES (?, ?, ?, ?)',
+                           [(digest, content, msg_type, created_at) for digest, _, content, msg_type, created_at in hashed])
+        cursor.executemany('''INSERT OR IGNORE INTO user_codes (user_id, code_id, type, created_at)
+                              SELECT ?, id, type, ? FROM codes WHERE content_hash = ?''',
+                           [(user_id, created_at, digest) for digest, user_id, _, _, created_at in hashed])
+        counts.append(cursor.rowcount)
+    return counts
+
+
+# 合并写入：多个用户同时提交时，把他们的插入合并到同一个事务中提交
+class MessageWriter:
+    def __init__(self, db, max_rows=5000, delay=0.02):
+        self.db = db
+        self.max_rows = max_rows  # 单次事务最多写入的行数
+        self.delay = delay  # 收到第一批后等待其他批次加入的时间（秒）
+        self.queue = None
+        self.task = None
+
+    async def insert(self, rows):
+        """写入 (user_id, content, type, created_at) 列表，返回新增条数（重复的被忽略）"""
+        if not rows:
+            return 0
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((rows, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batches = [await self.queue.get()]
+            await asyncio.sleep(self.delay)
+            total = len(batches[0][0])
+            while total < self.max_rows and not self.queue.empty():
+                batch = self.queue.get_nowait()
+                batches.append(batch)
+                total += len(batch[0])
+            try:
+                counts = await self.db.write(insert_message_batches, [rows for rows, _ in batches])
+            except Exception as e:
+                for _, future in batches:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), count in zip(batches, counts):
+                if not future.done():
+                    future.set_result(count)
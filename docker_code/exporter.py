@@ -0,0 +1,95 @@
+# 消息导出：分块读取数据库，边读边写文件，内存占用与历史记录条数无关
+import gzip
+import io
+import os
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+CHUNK_SIZE = 2000  # 每次从数据库读取的行数
+
+
+def summarize(conn, user_id, after_id, max_id):
+    """按类型统计 after_id < id <= max_id 的内容，返回 [(type, 条数, 字符数)]"""
+    return conn.execute('''SELECT type, COUNT(*), SUM(LENGTH(content) + 1)
+                           FROM messages
+                           WHERE user_id = ? AND id > ? AND id <= ?
+                           GROUP BY type ORDER BY type''', (user_id, after_id, max_id)).fetchall()
+
+
+def iter_type_rows(conn, user_id, msg_type, after_id, max_id, chunk_size=CHUNK_SIZE):
+    """按 id 顺序分块读取某一类型的 (content, created_at)
+
+    每块是一次独立的查询，读完即释放锁，不会在整个导出期间阻塞写入；
+    保存时 created_at 取当前时间，所以 id 顺序就是保存时间顺序。
+    """
+    while True:
+        rows = conn.execute('''SELECT id, content, created_at FROM messages
+                               WHERE user_id = ? AND type = ? AND id > ? AND id <= ?
+                               ORDER BY id LIMIT ?''', (user_id, msg_type, after_id, max_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        for _, content, created_at in rows:
+            yield content, created_at
+        after_id = rows[-1][0]
+
+
+@contextmanager
+def open_export_file(path, compress, inner_name):
+    """打开导出文件的文本流，compress 为 gzip / zip 时边写边压缩"""
+    if compress == 'gzip':
+        with gzip.open(path, 'wt', encoding='utf-8') as stream:
+            yield stream
+    elif compress == 'zip':
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive, \
+                io.TextIOWrapper(archive.open(inner_name, 'w', force_zip64=True), encoding='utf-8') as stream:
+            yield stream
+    else:
+        with open(path, 'w', encoding='utf-8') as stream:
+            yield stream
+
+
+def export_messages(conn, user_id, prefix, after_id=0, inline_limit=0, compress='', compress_min_rows=0):
+    """导出用户在 after_id 之后保存的内容，阻塞操作，应通过 Database.read 在读线程中调用
+
+    返回 None 表示没有内容，否则返回 dict：
+      max_id: 本次导出包含的最大 id，导出期间新保存的内容不包含在内
+      total: 导出条数
+      inline: 总长度不超过 inline_limit 时为 [(type, [(content, created_at)])]，不生成文件
+      path / filename: 生成的文件路径和发送时使用的文件名
+    """
+    max_id = conn.execute('SELECT MAX(id) FROM messages WHERE user_id = ?', (user_id,)).fetchone()[0]
+    if max_id is None or max_id <= after_id:
+        return None
+    summary = summarize(conn, user_id, after_id, max_id)
+    total = sum(count for _, count, _ in summary)
+    result = {'max_id': max_id, 'total': total}
+
+    if sum(chars for _, _, chars in summary) <= inline_limit:
+        result['inline'] = [(msg_type, list(iter_type_rows(conn, user_id, msg_type, after_id, max_id)))
+                            for msg_type, _, _ in summary]
+        return result
+
+    now = datetime.now()
+    name = f"{prefix}_{now.strftime('%Y%m%d_%H%M%S')}.txt"
+    if compress not in ('gzip', 'zip') or total < compress_min_rows:
+        compress = ''
+    suffix = {'gzip': '.txt.gz', 'zip': '.zip'}.get(compress, '.txt')
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        with open_export_file(path, compress, name) as tmp:
+            tmp.write(f"导出时间：{now.strftime('%Y-%m-%d %H:%M:%S')}\n")
+            tmp.write(f"总消息数：{total}\n\n")
+            for msg_type, count, _ in summary:
+                tmp.write(f"\n=== {msg_type} (共 {count} 条) ===\n")
+                for content, created_at in iter_type_rows(conn, user_id, msg_type, after_id, max_id):
+                    tmp.write(f"{created_at}: {content}\n")
+                tmp.write("\n")
+    except BaseException:
+        os.unlink(path)
+        raise
+    result['path'] = path
+    result['filename'] = name[:-len('.txt')] + suffix
+    return result
@@ -0,0 +1,101 @@
+# /find 搜索：参数解析与按 id 翻页的全文检索
+from datetime import datetime, timedelta
+
+PAGE_SIZE = 20
+MIN_TERM_LENGTH = 3  # trigram 索引至少需要 3 个字符才能命中
+FTS_SCAN_LIMIT = 1000  # 匹配的不重复代码超过该数量时不再走全文索引
+FILTER_KEYS = ('type', 'from', 'to', 'user')
+
+
+def parse_find_args(args):
+    """解析 /find 参数：关键词 [type:类型] [from:YYYY-MM-DD] [to:YYYY-MM-DD] [user:用户ID]
+
+    返回 (query, 错误信息)，query 为 dict，出错时为 None
+    """
+    query = {}
+    terms = []
+    for arg in args:
+        key, sep, value = arg.partition(':')
+        if not sep or key not in FILTER_KEYS or not value:
+            # 其余内容（包括 @filepan_bot:xxx 这类带冒号的代码）都作为关键词
+            terms.append(arg)
+            continue
+        if key in ('from', 'to'):
+            try:
+                day = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return None, "日期格式无效。请使用 YYYY-MM-DD 格式。"
+            # created_at 为 'YYYY-MM-DD HH:MM:SS'，按字符串比较即可
+            if key == 'from':
+                query['since'] = day.strftime("%Y-%m-%d")
+            else:
+                query['until'] = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+        elif key == 'user':
+            if not value.isdigit():
+                return None, "无效的用户ID。请提供一个数字ID。"
+            query['user_id'] = int(value)
+        else:
+            query['type'] = value
+    term = ' '.join(terms)
+    if len(term) < MIN_TERM_LENGTH:
+        return None, f"关键词至少需要 {MIN_TERM_LENGTH} 个字符。"
+    query['term'] = term
+    return query, None
+
+
+def _filters(query):
+    sql = ''
+    params = []
+    if 'type' in query:
+        sql += ' AND m.type = ?'
+        params.append(query['type'])
+    if 'since' in query:
+        sql += ' AND m.created_at >= ?'
+        params.append(query['since'])
+    if 'until' in query:
+        sql += ' AND m.created_at < ?'
+        params.append(query['until'])
+    return sql, params
+
+
+def _scan(conn, query, user_id, fts, cursor, descending, limit):
+    """沿 id 方向（descending 为从新到旧）取 cursor 之后最多 limit 条匹配"""
+    op, order = ('<', 'DESC') if descending else ('>', 'ASC')
+    filters, filter_params = _filters(query)
+    cursor_sql, cursor_params = ('', []) if cursor is None else (f' AND m.id {op} ?', [cursor])
+
+    if fts:
+        # 全文索引建在不重复的代码上；匹配的代码不超过 FTS_SCAN_LIMIT 个时，
+        # 只需在这些代码的保存记录里按用户过滤，否则关键词太常见，改为沿用户索引逐行匹配
+        # 整个关键词作为一个短语，trigram 分词下即为子串匹配
+        match = '"' + query['term'].replace('"', '""') + '"'
+        matched = conn.execute('SELECT COUNT(*) FROM (SELECT rowid FROM codes_fts WHERE codes_fts MATCH ? LIMIT ?)',
+                               (match, FTS_SCAN_LIMIT + 1)).fetchone()[0]
+        if matched <= FTS_SCAN_LIMIT:
+            # CROSS JOIN 固定以全文索引的匹配为外层，再按 (code_id, user_id) 唯一索引查该用户的保存记录
+            # user_codes 同样以 m 为别名，过滤条件与下面的 LIKE 查询共用
+            return conn.execute(f'''SELECT m.id, c.content, m.type, m.created_at
+                                    FROM (SELECT rowid AS code_id FROM codes_fts WHERE codes_fts MATCH ?) f
+                                    CROSS JOIN user_codes m ON m.code_id = f.code_id AND m.user_id = ?{filters}{cursor_sql}
+                                    JOIN codes c ON c.id = m.code_id
+                                    ORDER BY m.id {order} LIMIT ?''',
+                                [match, user_id] + filter_params + cursor_params + [limit]).fetchall()
+
+    escaped = query['term'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    sql = f"SELECT m.id, m.content, m.type, m.created_at FROM messages m WHERE m.user_id = ? AND m.content LIKE ? ESCAPE '\\'{filters}{cursor_sql}"
+    sql += f" ORDER BY m.id {order} LIMIT ?"
+    return conn.execute(sql, [user_id, f"%{escaped}%"] + filter_params + cursor_params + [limit]).fetchall()
+
+
+def search_messages(conn, query, user_id, fts=True, before_id=None, after_id=None, limit=PAGE_SIZE):
+    """按 id 从新到旧返回一页结果 (rows, has_older, has_newer)
+
+    rows 为 [(id, content, type, created_at)]；before_id 取更旧的一页，after_id 取更新的一页。
+    fts 为 False（SQLite 不支持 trigram）时只按用户索引做 LIKE 匹配。
+    """
+    if after_id is not None:
+        # 往新的方向翻页：升序取一页再反转
+        rows = _scan(conn, query, user_id, fts, after_id, False, limit + 1)
+        return rows[:limit][::-1], True, len(rows) > limit
+    rows = _scan(conn, query, user_id, fts, before_id, True, limit + 1)
+    return rows[:limit], len(rows) > limit, before_id is not None
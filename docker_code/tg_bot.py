@@ -1,12 +1,21 @@
-import re
-import sqlite3
 import os
-from datetime import datetime
+import asyncio
+import signal
+import io
 import tempfile
+import time
+from datetime import datetime
 from pathlib import Path
 from functools import wraps
-from telegram import Update
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, filters, CallbackContext
+
+import code_patterns
+from code_patterns import classify_lines, classify_messages
+from db import Database, MessageWriter, code_stats, popular_codes, user_stats_page
+from exporter import export_messages
+from search import parse_find_args, search_messages
 
 # 加载.env文件（如果存在）
 env_path = Path('.env')
@@ -32,250 +41,287 @@ def admin_only(func):
         return await func(update, context, *args, **kwargs)
     return wrapped
 
-# 初始化 SQLite 数据库
-conn = sqlite3.connect('./data/messages.db', check_same_thread=False)
-c = conn.cursor()
-c.execute('''CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                content TEXT,
-                type TEXT,
-                created_at TEXT,
-                UNIQUE(user_id, content)
-            )''')
-c.execute('''CREATE TABLE IF NOT EXISTS user_status (
-                user_id INTEGER PRIMARY KEY,
-                last_send_time TEXT
-            )''')
-conn.commit()
-
-# 提取消息的正则表达式
-PATTERN = re.compile(r'(?:'
-    r'@(?:FilesPan1Bot|MediaBK5Bot|FilesDrive_BLGA_bot)\s+[^\s]+.*'
-    r'|showfilesbot_\d+[PpvVdD]_[A-Za-z0-9_\-\+]+'
-    r'|(?:vi|pk|[dvp])_(?:FilesPan1Bot_)?[A-Za-z0-9_\-\+]+'
-    r'|[A-Za-z0-9_\-\+]+=[^=\s]*?(?:_grp|_mda)(?=[\s\u4e00-\u9fa5]|$)'
-    r'|@filepan_bot:([A-Za-z0-9_\-\+]+)'
-    r')', re.IGNORECASE)
-
-# 提取消息内容
-def extract_messages(text):
-    matches = []
-    for m in PATTERN.finditer(text):
-        match = m.group(0)
-        if match.endswith('_grp') or match.endswith('_mda'):
-            # 对于 grp/mda 结尾的，只保留到 _grp/_mda
-            end_pos = match.find('_grp')
-            if end_pos == -1:
-                end_pos = match.find('_mda')
-            if end_pos != -1:
-                match = match[:end_pos + 4]  # +4 包含 _grp 或 _mda
-        matches.append(match)
-    return matches
-
-# 处理普通消息
-async def handle_message(update: Update, context: CallbackContext):
-    text = update.message.text
-    message_id = update.message.message_id
-    extracted = extract_messages(text)
-    if extracted:
+# 导出文件压缩方式：gzip / zip，留空不压缩；条数达到 EXPORT_COMPRESS_MIN_ROWS 才压缩
+EXPORT_COMPRESS = os.environ.get('EXPORT_COMPRESS', '').lower()
+EXPORT_COMPRESS_MIN_ROWS = int(os.environ.get('EXPORT_COMPRESS_MIN_ROWS', '50000'))
+
+# 文本文件导入：同时处理的文件数、文件大小上限（官方 Bot API 只能下载 20MB 以内的文件）
+DOCUMENT_CONCURRENCY = int(os.environ.get('DOCUMENT_CONCURRENCY', '2'))
+MAX_DOCUMENT_MB = int(os.environ.get('MAX_DOCUMENT_MB', '20'))
+DOCUMENT_BATCH_LINES = 5000  # 每批读取的行数，每批一次写入
+PROGRESS_INTERVAL = 3  # 进度消息最短编辑间隔（秒）
+# 自建 Bot API 服务器地址（local 模式），可下载更大的文件
+BOT_API_URL = os.environ.get('BOT_API_URL', '').rstrip('/')
+# 相册的每张图片是一条单独的消息，等待这么久后合并处理说明文字（秒）
+ALBUM_DELAY = 2
+
+# 同时处理的更新数：长时间的导出、文件导入不会挡住其他用户的消息和命令
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '32'))
+
+# 初始化 SQLite 数据库（WAL，读写都在线程中执行）
+DB_READERS = int(os.environ.get('DB_READERS', '4'))
+db = Database(readers=DB_READERS)
+writer = MessageWriter(db)
+
+# 提取文本中的代码并保存，回复提取结果；reply_empty 为 False 时没有代码不回复（带说明文字的媒体）
+async def save_text(update: Update, context: CallbackContext, text, message_id, reply_empty=True):
+    classified = classify_messages(text)
+    if classified:
         user_id = update.effective_user.id
-        from datetime import datetime
         now = datetime.now().isoformat(sep=' ', timespec='seconds')
-        saved_count = 0
-        for message in set(extracted):            # 检查bot出现次数
-            bot_count = 0
-            if '@FilesDrive_BLGA_bot' in message:
-                bot_count += 1
-            if '@FilesPan1Bot' in message:
-                bot_count += 1
-            if '@MediaBK5Bot' in message:
-                bot_count += 1
-            if '@filepan_bot:' in message:
-                bot_count += 1
-            # 如果发现多个bot，跳过此消息
-            if bot_count > 1:
-                continue
-                
-            # 单个bot的情况
-            if '@FilesDrive_BLGA_bot' in message:
-                message_type = 'filesdrive'
-            elif '@FilesPan1Bot' in message:
-                message_type = 'filespan1'
-            elif '@MediaBK5Bot' in message:
-                message_type = 'mediabk5'
-            elif '@filepan_bot:' in message:
-                message_type = 'filepan_bot'
-            # 匹配 showfilesbot
-            elif message.startswith('showfilesbot_'):
-                message_type = 'showfilesbot-code'
-            # 匹配老版本格式
-            elif message.startswith(('vi_', 'pk_')):
-                message_type = message[:2] + '_old'
-            # 匹配新版本格式
-            elif message.startswith(('d_', 'v_', 'p_')):
-                if 'FilesPan1Bot_' in message:
-                    message_type = 'filespan1bot_' + message[0]
-                else:
-                    message_type = message[0] + '_new'
-            # 匹配 mediabk5bot
-            elif message.endswith(('_grp', '_mda')):
-                message_type = 'mediabk5bot'
-            else:
-                continue  # 对于无法识别的类型，跳过不保存
-                
-            try:
-                c.execute('INSERT INTO messages (user_id, content, type, created_at) VALUES (?, ?, ?, ?)', 
-                         (user_id, message, message_type, now))
-                conn.commit()
-                saved_count += 1
-            except sqlite3.IntegrityError:
-                pass  # 忽略重复内容
+        # 同一条消息中重复出现的内容只保留一次
+        rows = [(user_id, message, message_type, now) for message, message_type in dict(classified).items()]
+        # 一次事务写入，重复内容由 INSERT OR IGNORE 忽略
+        saved_count = await writer.insert(rows)
+        duplicate_count = len(rows) - saved_count
         context.user_data['save_count'] = context.user_data.get('save_count', 0) + saved_count
-        await update.message.reply_text(f"提取到以下内容：\n{chr(10).join(extracted)}", reply_to_message_id=message_id)
-    else:
+        extracted = [message for message, _ in classified]
+        await update.message.reply_text(f"提取到以下内容：\n{chr(10).join(extracted)}\n\n新增 {saved_count} 条，重复 {duplicate_count} 条。", reply_to_message_id=message_id)
+    elif reply_empty:
         await update.message.reply_text("未找到可提取的内容。", reply_to_message_id=message_id)
 
+# 相册中各条消息的说明文字：media_group_id -> [文字]
+pending_albums = {}
+
+async def flush_album(update: Update, context: CallbackContext, media_group_id):
+    await asyncio.sleep(ALBUM_DELAY)
+    texts = pending_albums.pop(media_group_id)
+    await save_text(update, context, "\n".join(texts), update.message.message_id, reply_empty=False)
+
+# 处理普通消息和带说明文字的媒体
+async def handle_message(update: Update, context: CallbackContext):
+    message = update.message
+    text = message.text or message.caption
+    if message.media_group_id:
+        # 整个相册合并为一次写入和一条回复
+        if message.media_group_id not in pending_albums:
+            pending_albums[message.media_group_id] = []
+            context.application.create_task(flush_album(update, context, message.media_group_id))
+        pending_albums[message.media_group_id].append(text)
+        return
+    # 图片、视频的说明文字中没有代码时不回复，和只处理文字消息时一样
+    await save_text(update, context, text, message.message_id, reply_empty=message.text is not None)
+
+async def edit_status(status, text):
+    try:
+        await status.edit_text(text)
+    except TelegramError as e:
+        print(f"更新进度消息失败: {e}")
+
+# 逐行读取文本文件并分批写入，定期编辑进度消息
+async def ingest_file(path, user_id, status, file_name):
+    total_size = os.path.getsize(path) or 1
+    extracted_count = saved_count = 0
+    last_edit = time.monotonic()
+    with open(path, 'rb') as stream:
+        done = False
+        while not done:
+            # 读取和正则匹配在线程中进行，不阻塞其他用户
+            classified, done = await asyncio.to_thread(classify_lines, stream, DOCUMENT_BATCH_LINES)
+            if classified:
+                now = datetime.now().isoformat(sep=' ', timespec='seconds')
+                rows = [(user_id, message, message_type, now) for message, message_type in dict(classified).items()]
+                extracted_count += len(rows)
+                saved_count += await writer.insert(rows)
+            if not done and time.monotonic() - last_edit >= PROGRESS_INTERVAL:
+                last_edit = time.monotonic()
+                await edit_status(status, f"正在处理文件 {file_name}：{stream.tell() * 100 // total_size}%，"
+                                          f"已提取 {extracted_count} 条，新增 {saved_count} 条。")
+    return extracted_count, saved_count
+
+document_semaphore = None
+
+# 处理上传的文本文件
+async def handle_document(update: Update, context: CallbackContext):
+    document = update.message.document
+    file_name = document.file_name or "文件"
+    if document.file_size and document.file_size > MAX_DOCUMENT_MB * 1024 * 1024:
+        await update.message.reply_text(f"文件过大（{document.file_size / 1024 / 1024:.1f} MB），上限为 {MAX_DOCUMENT_MB} MB。",
+                                        reply_to_message_id=update.message.message_id)
+        return
+
+    status = await update.message.reply_text(f"正在处理文件 {file_name}…", reply_to_message_id=update.message.message_id)
+    # 下载和导入在后台任务中进行，处理函数立即返回，不占用更新处理的名额
+    context.application.create_task(process_document(update, context, status), update=update)
+
+# 下载并导入文件，完成或失败时编辑进度消息
+async def process_document(update: Update, context: CallbackContext, status):
+    global document_semaphore
+    document = update.message.document
+    file_name = document.file_name or "文件"
+    if document_semaphore is None:
+        document_semaphore = asyncio.Semaphore(DOCUMENT_CONCURRENCY)
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        async with document_semaphore:
+            file = await document.get_file()
+            await file.download_to_drive(path)
+            extracted_count, saved_count = await ingest_file(path, update.effective_user.id, status, file_name)
+    except Exception as e:
+        print(f"处理文件 {file_name} 失败: {e}")
+        await edit_status(status, f"处理文件 {file_name} 失败：{e}")
+        return
+    finally:
+        os.unlink(path)
+
+    context.user_data['save_count'] = context.user_data.get('save_count', 0) + saved_count
+    await edit_status(status, f"文件 {file_name} 处理完成：提取 {extracted_count} 条，"
+                              f"新增 {saved_count} 条，重复 {extracted_count - saved_count} 条。")
+
 # 保存消息到数据库
 async def save_messages(update: Update, context: CallbackContext):
     save_count = context.user_data.get('save_count', 0)
     await update.message.reply_text(f"成功保存 {save_count} 条消息。")
     context.user_data['save_count'] = 0
 
+# 发送导出文件，发送后删除临时文件
+async def reply_export_file(update: Update, export, caption):
+    try:
+        with open(export['path'], 'rb') as file:
+            await update.message.reply_document(document=file, filename=export['filename'], caption=caption)
+    finally:
+        os.unlink(export['path'])
+
 # 发送消息
 async def send_messages(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    from datetime import datetime
     now = datetime.now().isoformat(sep=' ', timespec='seconds')
-    # 获取上次发送时间
-    c.execute('SELECT last_send_time FROM user_status WHERE user_id = ?', (user_id,))
-    row = c.fetchone()
-    last_send_time = row[0] if row and row[0] else None
-    if last_send_time:
-        c.execute('SELECT content, type, created_at FROM messages WHERE user_id = ? AND created_at > ? ORDER BY created_at', (user_id, last_send_time))
-    else:
-        c.execute('SELECT content, type, created_at FROM messages WHERE user_id = ? ORDER BY created_at', (user_id,))
-    rows = c.fetchall()
+    # 获取上次发送到的位置
+    row = await db.fetchone('SELECT last_sent_id FROM user_status WHERE user_id = ?', (user_id,))
+    last_sent_id = row[0] if row and row[0] else 0
+    # 内容总长度不超过4000字符时直接发送，否则流式写入文件，文件读写在读线程中进行
+    export = await db.read(export_messages, user_id, 'new_messages', after_id=last_sent_id,
+                           inline_limit=4000, compress=EXPORT_COMPRESS,
+                           compress_min_rows=EXPORT_COMPRESS_MIN_ROWS)
 
-    if not rows:
+    if not export:
         await update.message.reply_text("没有可发送的内容。")
-        # 也要更新 last_send_time，避免重复发送
-        c.execute('INSERT OR REPLACE INTO user_status (user_id, last_send_time) VALUES (?, ?)', (user_id, now))
-        conn.commit()
         return
 
-    # 按类型分组
-    grouped_messages = {}
-    total_length = 0
-    for content, msg_type, created_at in rows:
-        if msg_type not in grouped_messages:
-            grouped_messages[msg_type] = []
-        grouped_messages[msg_type].append((content, created_at))
-        total_length += len(content) + 1  # +1 for newline
-
-    # 如果内容总长度超过4000字符，使用文件发送
-    if total_length > 4000:
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt', encoding='utf-8') as tmp:
-            tmp.write(f"导出时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            tmp.write(f"总消息数：{len(rows)}\n\n")
-            
-            # 写入分组消息
-            for msg_type, messages in grouped_messages.items():
-                tmp.write(f"\n=== {msg_type} (共 {len(messages)} 条) ===\n")
-                for content, created_at in messages:
-                    tmp.write(f"{created_at}: {content}\n")
-                tmp.write("\n")
-
-        # 发送文件
-        with open(tmp.name, 'rb') as file:
-            await update.message.reply_document(
-                document=file,
-                filename=f"new_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                caption="这是您的新消息"
-            )
-        
-        # 删除临时文件
-        os.unlink(tmp.name)
-    else:
-        # 内容不多时，直接发送消息
-        for msg_type, messages in grouped_messages.items():
+    if 'inline' in export:
+        for msg_type, messages in export['inline']:
             contents = [f"{created_at}: {content}" for content, created_at in messages]
             await update.message.reply_text(f"类型：{msg_type}\n{chr(10).join(contents)}")
+    else:
+        await reply_export_file(update, export, "这是您的新消息")
 
-    # 更新 last_send_time
-    c.execute('INSERT OR REPLACE INTO user_status (user_id, last_send_time) VALUES (?, ?)', (user_id, now))
-    conn.commit()
+    # 记录已发送到的最大 id，发送期间新保存的内容留到下次
+    await db.execute('INSERT OR REPLACE INTO user_status (user_id, last_send_time, last_sent_id) VALUES (?, ?, ?)', (user_id, now, export['max_id']))
 
 # 发送所有消息为文件
 async def send_all_messages(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    
-    # 获取该用户的所有消息
-    c.execute('SELECT content, type, created_at FROM messages WHERE user_id = ? ORDER BY created_at', (user_id,))
-    rows = c.fetchall()
+    export = await db.read(export_messages, user_id, 'messages',
+                           compress=EXPORT_COMPRESS, compress_min_rows=EXPORT_COMPRESS_MIN_ROWS)
 
-    if not rows:
+    if not export:
         await update.message.reply_text("没有保存的消息。")
         return
 
-    # 创建临时文件
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt', encoding='utf-8') as tmp:
-        tmp.write(f"导出时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        tmp.write(f"总消息数：{len(rows)}\n\n")
-        
-        # 按类型分组
-        grouped_messages = {}
-        for content, msg_type, created_at in rows:
-            if msg_type not in grouped_messages:
-                grouped_messages[msg_type] = []
-            grouped_messages[msg_type].append((content, created_at))
-
-        # 写入分组消息
-        for msg_type, messages in grouped_messages.items():
-            tmp.write(f"\n=== {msg_type} (共 {len(messages)} 条) ===\n")
-            for content, created_at in messages:
-                tmp.write(f"{created_at}: {content}\n")
-            tmp.write("\n")
-
-    # 发送文件
-    with open(tmp.name, 'rb') as file:
-        await update.message.reply_document(
-            document=file,
-            filename=f"messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-            caption="这是您保存的所有消息"
-        )
-    
-    # 删除临时文件
-    os.unlink(tmp.name)
+    await reply_export_file(update, export, "这是您保存的所有消息")
+
+USERS_PAGE_SIZE = 30
+USERS_ORDERS = {'top': "按条数", 'recent': "按最近活跃"}
+
+def render_user_stats(order, page, user_count, users):
+    pages = max(1, (user_count + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE)
+    response = f"用户统计信息（{USERS_ORDERS[order]}，共 {user_count} 个用户，第 {page}/{pages} 页）：\n\n"
+    for user_id, total, last_active, types in users:
+        type_counts = "，".join(f"{msg_type} {count}" for msg_type, count in types)
+        response += f"用户 ID: {user_id}\n消息数量: {total}（{type_counts}）\n最近保存: {last_active}\n\n"
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("« 上一页", callback_data=f"users:{order}:{page - 1}"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton("下一页 »", callback_data=f"users:{order}:{page + 1}"))
+    return response, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# 超过 Telegram 单条消息长度时以文件发送
+async def reply_long_text(message, response, prefix, caption, markup=None):
+    if len(response) > 4096:
+        await message.reply_document(document=io.BytesIO(response.encode('utf-8')),
+                                     filename=f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                                     caption=caption, reply_markup=markup)
+    else:
+        await message.reply_text(response, reply_markup=markup)
 
 @admin_only
 async def get_user_stats(update: Update, context: CallbackContext) -> None:
-    """获取所有用户的统计信息"""
-    conn = sqlite3.connect('data/messages.db')
-    cursor = conn.cursor()
-    
-    try:
-        # 获取用户统计数据
-        cursor.execute("""
-            SELECT user_id, COUNT(*) as message_count 
-            FROM messages 
-            GROUP BY user_id
-        """)
-        stats = cursor.fetchall()
-        
-        if not stats:
-            await update.message.reply_text("目前还没有任何用户数据。")
+    """获取所有用户的统计信息，用法: /users [top|recent] [页码]"""
+    order = 'top'
+    page = 1
+    for arg in context.args or []:
+        if arg in USERS_ORDERS:
+            order = arg
+        elif arg.isdigit() and int(arg) > 0:
+            page = int(arg)
+        else:
+            await update.message.reply_text("用法: /users [top|recent] [页码]")
             return
-            
-        response = "用户统计信息：\n\n"
-        for user_id, count in stats:
-            response += f"用户 ID: {user_id}\n消息数量: {count}\n\n"
-            
-        await update.message.reply_text(response)
-    
-    finally:
-        conn.close()
+
+    # 从 user_counters 读取，不再扫描整个 messages 表
+    user_count, users = await db.read(user_stats_page, order, (page - 1) * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+    if not user_count:
+        await update.message.reply_text("目前还没有任何用户数据。")
+        return
+    if not users:
+        await update.message.reply_text("页码超出范围。")
+        return
+    response, markup = render_user_stats(order, page, user_count, users)
+    await reply_long_text(update.message, response, "users", "用户统计信息", markup)
+
+# 用户统计翻页
+async def users_page(update: Update, context: CallbackContext) -> None:
+    callback = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await callback.answer("此命令仅限管理员使用。", show_alert=True)
+        return
+    await callback.answer()
+    _, order, page = callback.data.split(':')
+    page = int(page)
+    user_count, users = await db.read(user_stats_page, order, (page - 1) * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+    if not users:
+        return
+    response, markup = render_user_stats(order, page, user_count, users)
+    if len(response) > 4096 or not callback.message.text:
+        await reply_long_text(callback.message, response, "users", "用户统计信息", markup)
+    else:
+        await callback.edit_message_text(response, reply_markup=markup)
+
+@admin_only
+async def get_popular_codes(update: Update, context: CallbackContext) -> None:
+    """保存人数最多的代码，用法: /popular [类型] [数量]"""
+    msg_type = None
+    limit = 20
+    for arg in context.args or []:
+        if arg.isdigit():
+            limit = min(int(arg), 1000)
+        else:
+            msg_type = arg
+    codes = await db.read(popular_codes, limit, msg_type)
+    if not codes:
+        await update.message.reply_text("没有找到代码。")
+        return
+    title = f"热门代码（{msg_type}）" if msg_type else "热门代码"
+    response = f"{title}：\n\n" + "\n".join(
+        f"{user_count} 人 | {code_type} | {first_seen} | {content}" for content, code_type, user_count, first_seen in codes)
+    await reply_long_text(update.message, response, "popular", title)
+
+@admin_only
+async def get_code_stats(update: Update, context: CallbackContext) -> None:
+    """查询某个代码被多少用户保存，用法: /code <代码>"""
+    if not context.args:
+        await update.message.reply_text("用法: /code <代码>")
+        return
+    # 保留代码中的原始空白
+    content = update.message.text.split(maxsplit=1)[1].strip()
+    stats = await db.read(code_stats, content)
+    if not stats:
+        await update.message.reply_text("没有用户保存过这个代码。")
+        return
+    code_type, user_count, first_seen = stats
+    await update.message.reply_text(f"{content}\n类型: {code_type}\n保存人数: {user_count}\n首次出现: {first_seen}")
 
 @admin_only
 async def get_user_messages(update: Update, context: CallbackContext) -> None:
@@ -298,39 +344,107 @@ async def get_user_messages(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("无效的用户ID。请提供一个数字ID。")
         return
         
-    conn = sqlite3.connect('data/messages.db')
-    cursor = conn.cursor()
+    if date_filter:
+        messages = await db.fetchall("""
+            SELECT content, created_at
+            FROM messages
+            WHERE user_id = ? AND date(created_at) = date(?)
+            ORDER BY created_at DESC
+        """, (user_id, date_filter.strftime("%Y-%m-%d")))
+    else:
+        messages = await db.fetchall("""
+            SELECT content, created_at
+            FROM messages
+            WHERE user_id = ?
+            ORDER BY created_at DESC LIMIT 10
+        """, (user_id,))
     
-    try:
-        if date_filter:
-            cursor.execute("""
-                SELECT content, created_at
-                FROM messages
-                WHERE user_id = ? AND date(created_at) = date(?)
-                ORDER BY created_at DESC
-            """, (user_id, date_filter.strftime("%Y-%m-%d")))
-        else:
-            cursor.execute("""
-                SELECT content, created_at
-                FROM messages
-                WHERE user_id = ?
-                ORDER BY created_at DESC LIMIT 10
-            """, (user_id,))
-            
-        messages = cursor.fetchall()
+    if not messages:
+        await update.message.reply_text(f"未找到用户 {user_id} 的消息记录。")
+        return
+    response = f"用户 {user_id} 的消息历史：\n\n"
+    for msg_text, created_at in messages:
+        dt = datetime.fromisoformat(created_at)
+        response += f"{dt.strftime('%Y-%m-%d %H:%M:%S')}: {msg_text}\n\n"
         
-        if not messages:
-            await update.message.reply_text(f"未找到用户 {user_id} 的消息记录。")
-            return
-        response = f"用户 {user_id} 的消息历史：\n\n"
-        for msg_text, created_at in messages:
-            dt = datetime.fromisoformat(created_at)
-            response += f"{dt.strftime('%Y-%m-%d %H:%M:%S')}: {msg_text}\n\n"
-            
-        await update.message.reply_text(response)
-    
-    finally:
-        conn.close()
+    await update.message.reply_text(response)
+
+# 每个用户保留最近的搜索条件，翻页按钮只携带编号和 id 游标
+FIND_QUERIES_KEPT = 20
+
+def render_find_page(query, key, rows, has_older, has_newer):
+    header = f"搜索「{query['term']}」"
+    if 'user_id' in query:
+        header += f"（用户 {query['user_id']}）"
+    if not rows:
+        return f"{header}：没有找到匹配的内容。", None
+    lines = [f"{created_at} [{msg_type}] {content[:200]}" for _, content, msg_type, created_at in rows]
+    text = header + "：\n\n" + "\n".join(lines)
+    if len(text) > 4000:
+        text = text[:4000] + "…"
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("« 较新", callback_data=f"find:{key}:n:{rows[0][0]}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("较旧 »", callback_data=f"find:{key}:o:{rows[-1][0]}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# 搜索已保存的代码
+async def find_messages(update: Update, context: CallbackContext):
+    if not context.args:
+        await update.message.reply_text("用法: /find <关键词> [type:类型] [from:YYYY-MM-DD] [to:YYYY-MM-DD]\n管理员可用 user:<用户ID> 搜索其他用户的内容")
+        return
+    query, error = parse_find_args(context.args)
+    if error:
+        await update.message.reply_text(error)
+        return
+    user_id = update.effective_user.id
+    if query.get('user_id', user_id) != user_id and user_id not in ADMIN_IDS:
+        await update.message.reply_text("只有管理员可以搜索其他用户的内容。")
+        return
+
+    queries = context.user_data.setdefault('find_queries', {})
+    key = context.user_data['find_seq'] = context.user_data.get('find_seq', 0) + 1
+    queries[key] = query
+    while len(queries) > FIND_QUERIES_KEPT:
+        queries.pop(next(iter(queries)))
+
+    rows, has_older, has_newer = await db.read(search_messages, query, query.get('user_id', user_id), db.fts)
+    text, markup = render_find_page(query, key, rows, has_older, has_newer)
+    await update.message.reply_text(text, reply_markup=markup)
+
+# 搜索结果翻页
+async def find_page(update: Update, context: CallbackContext):
+    callback = update.callback_query
+    _, key, direction, cursor = callback.data.split(':')
+    query = context.user_data.get('find_queries', {}).get(int(key))
+    if query is None:
+        await callback.answer("搜索已过期，请重新 /find。", show_alert=True)
+        return
+    await callback.answer()
+    user_id = query.get('user_id', update.effective_user.id)
+    if direction == 'o':
+        rows, has_older, has_newer = await db.read(search_messages, query, user_id, db.fts, before_id=int(cursor))
+    else:
+        rows, has_older, has_newer = await db.read(search_messages, query, user_id, db.fts, after_id=int(cursor))
+    text, markup = render_find_page(query, key, rows, has_older, has_newer)
+    await callback.edit_message_text(text, reply_markup=markup)
+
+# 收到 SIGHUP 时重新读取代码类型表，配置有误则继续使用原来的
+def reload_code_patterns():
+    try:
+        registry = code_patterns.reload_patterns()
+    except Exception as e:
+        print(f"重新加载代码类型表失败，继续使用原配置: {e}")
+        return
+    print(f"已重新加载代码类型表：{len(registry.families)} 种类型")
+
+async def on_startup(application: Application):
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_code_patterns)
+
+async def on_shutdown(application: Application):
+    db.close()
 
 # 启动 Bot
 def main():
@@ -341,14 +455,24 @@ def main():
         print("错误：未设置 BOT_TOKEN 环境变量")
         return
 
-    application = ApplicationBuilder().token(bot_token).build()
+    builder = (ApplicationBuilder().token(bot_token).concurrent_updates(CONCURRENT_UPDATES)
+               .post_init(on_startup).post_shutdown(on_shutdown))
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot").local_mode(True)
+    application = builder.build()
 
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("txt") | filters.Document.MimeType("text/plain"), handle_document))
+    application.add_handler(MessageHandler((filters.TEXT | filters.CAPTION) & ~filters.COMMAND, handle_message))
     application.add_handler(CommandHandler("save", save_messages))
     application.add_handler(CommandHandler("send", send_messages))
     application.add_handler(CommandHandler("all", send_all_messages))
     application.add_handler(CommandHandler("send_all", send_all_messages))
+    application.add_handler(CommandHandler("find", find_messages))
+    application.add_handler(CallbackQueryHandler(find_page, pattern=r'^find:'))
     application.add_handler(CommandHandler("users", get_user_stats))
+    application.add_handler(CallbackQueryHandler(users_page, pattern=r'^users:'))
+    application.add_handler(CommandHandler("popular", get_popular_codes))
+    application.add_handler(CommandHandler("code", get_code_stats))
     application.add_handler(CommandHandler("user_messages", get_user_messages))
     application.add_handler(CommandHandler("user_message", get_user_messages))  # 添加不带s的别名命令
 
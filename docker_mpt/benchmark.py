@@ -0,0 +1,257 @@
+# 基准测试：python benchmark.py <子命令>
+#   python benchmark.py routing [--rules 10000] [--chats 500] [--messages 20000]
+#   python benchmark.py archive [--messages 5000] [--chats 20]
+#   python benchmark.py forward [--burst 1000] [--interval 0.05]
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from db.message_buffer import MessageBuffer
+from db.models import Base, Message
+from telethon.errors import FloodWaitError
+
+from modules.forward_scheduler import ForwardScheduler
+from modules.routing_index import RoutingIndex
+
+WORDS = "资源 分享 合集 更新 视频 图片 高清 无码 电影 剧集 动漫 音乐 小说 教程 软件 游戏 福利 求片 老司机 频道 群组 链接 下载 网盘 磁力".split()
+CHARS = "abcdefghijklmnopqrstuvwxyz0123456789资源分享合集更新视频图片高清电影剧集动漫音乐"
+
+
+def make_rules(rng, rule_count, chat_count):
+    """生成 rule_count 条文字规则，分布在 chat_count 个来源上，其中少量为 '*'"""
+    chats = [str(-1000000000000 - i) for i in range(chat_count)]
+    rules = {}
+    while len(rules) < rule_count:
+        sid = rng.choice(chats)
+        if rng.random() < 0.002:
+            keyword = '*'
+        elif rng.random() < 0.5:
+            keyword = rng.choice(WORDS) + ''.join(rng.choice(CHARS) for _ in range(rng.randint(1, 4)))
+        else:
+            keyword = ''.join(rng.choice(CHARS) for _ in range(rng.randint(2, 6)))
+        rules[(sid, keyword)] = str(-1009000000000 - rng.randint(0, 50))
+    return chats, rules
+
+
+def make_messages(rng, chats, rules, count):
+    keywords = [keyword for _, keyword in rules]
+    messages = []
+    for _ in range(count):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+        if rng.random() < 0.3:
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(keywords))
+        messages.append((rng.choice(chats), ' '.join(parts)))
+    return messages
+
+
+def legacy_route(account_config, text_watch_rules, source_id, text):
+    """旧实现：每条消息重建 enabled_chats 列表，再遍历全部文字规则"""
+    enabled_chats = [str(cid) for cid in account_config['monitoring'].get('enabled_chats', [])]
+    if enabled_chats and source_id not in enabled_chats:
+        return None
+    for (sid, keyword), target_id in text_watch_rules.items():
+        if sid == source_id and (keyword == '*' or keyword in text):
+            return keyword, target_id
+    return None
+
+
+def index_route(index, source_id, text):
+    if not index.is_chat_enabled(source_id):
+        return None
+    return index.match_text(source_id, text)
+
+
+def bench_routing(args):
+    rng = random.Random(1)
+    chats, rules = make_rules(rng, args.rules, args.chats)
+    account_config = {'monitoring': {'enabled_chats': [int(sid) for sid in chats]}}
+    messages = make_messages(rng, chats, rules, args.messages)
+
+    start = time.perf_counter()
+    index = RoutingIndex(account_config, rules)
+    build_time = time.perf_counter() - start
+
+    hits = 0
+    for source_id, text in messages:
+        expected = legacy_route(account_config, rules, source_id, text)
+        assert index_route(index, source_id, text) == expected, (source_id, text, expected)
+        hits += expected is not None
+    print(f"{args.rules} 条规则，{args.chats} 个来源；{len(messages)} 条消息结果一致，命中 {hits} 条；索引构建 {build_time * 1000:.0f} ms")
+
+    print(f"{'实现':<10}{'耗时(s)':>10}{'消息/秒':>12}")
+    for name, route in (("legacy", lambda s, t: legacy_route(account_config, rules, s, t)),
+                        ("index", lambda s, t: index_route(index, s, t))):
+        start = time.perf_counter()
+        for source_id, text in messages:
+            route(source_id, text)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{elapsed:>10.3f}{len(messages) / elapsed:>12.0f}")
+
+    # 全部规则集中在一个来源时，匹配耗时只取决于消息长度；用不命中的消息测最坏情况
+    single = {('-1', keyword): target_id for (_, keyword), target_id in rules.items() if keyword != '*'}
+    index = RoutingIndex({'monitoring': {}}, single)
+    print(f"\n单个来源 {len(single)} 条规则，不同长度消息的匹配耗时")
+    print(f"{'长度':>8}{'legacy(us)':>14}{'index(us)':>12}")
+    for length in (100, 1000, 4000):
+        texts = [''.join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ 今天天气不错") for _ in range(length)) for _ in range(50)]
+        timings = []
+        for route in (lambda t: legacy_route({'monitoring': {}}, single, '-1', t),
+                      lambda t: index_route(index, '-1', t)):
+            start = time.perf_counter()
+            for text in texts:
+                route(text)
+            timings.append((time.perf_counter() - start) / len(texts) * 1e6)
+        print(f"{length:>8}{timings[0]:>14.0f}{timings[1]:>12.0f}")
+
+
+def make_message_rows(count, chats):
+    return [dict(account_id=1, message_id=i // chats + 1, chat_id=-1000000000000 - i % chats, chat_title="Chat",
+                 sender_id=10000 + i % 97, sender_username=None, content=f"消息内容 {i} " * 5,
+                 timestamp=datetime.now(), is_bot=False, is_forwarded=False)
+            for i in range(count)]
+
+
+async def archive_per_message(session_factory, rows, forward):
+    """旧实现：每条消息在事件循环中单独提交"""
+    async def handle(row):
+        with session_factory() as session:
+            session.add(Message(**row))
+            session.commit()
+        await forward(row)
+    await asyncio.gather(*(handle(row) for row in rows))
+
+
+async def archive_write_behind(session_factory, rows, forward):
+    buffer = MessageBuffer(session_factory)
+    buffer.start()
+
+    async def handle(row):
+        await forward(row)
+        await buffer.add(row)
+    await asyncio.gather(*(handle(row) for row in rows))
+    await buffer.close()
+
+
+def bench_archive(args):
+    rows = make_message_rows(args.messages, args.chats)
+    print(f"{args.messages} 条消息，{args.chats} 个会话")
+    print(f"{'实现':<14}{'总耗时(s)':>10}{'消息/秒':>10}{'转发延迟p99(ms)':>18}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, archive in (("per-message", archive_per_message), ("write-behind", archive_write_behind)):
+            engine = create_engine(f"sqlite:///{os.path.join(directory, name + '.db')}")
+            Base.metadata.create_all(bind=engine)
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            delays = []
+
+            async def run():
+                start = time.perf_counter()
+
+                # 转发延迟：从所有消息同时到达到各自开始转发的时间
+                async def forward(row):
+                    delays.append(time.perf_counter() - start)
+                await archive(session_factory, rows, forward)
+                return time.perf_counter() - start
+
+            elapsed = asyncio.run(run())
+            with session_factory() as session:
+                saved = session.execute(select(func.count()).select_from(Message)).scalar()
+            assert saved == len(rows), (name, saved)
+            delays.sort()
+            p99 = delays[int(len(delays) * 0.99)] * 1000
+            print(f"{name:<14}{elapsed:>10.2f}{len(rows) / elapsed:>10.0f}{p99:>18.1f}")
+            engine.dispose()
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.id = message_id
+
+    async def get_input_chat(self):
+        return self.chat_id
+
+
+class FakeClient:
+    """模拟 forward_messages：每次调用耗时 latency 秒，转发到 flood_peer 的前 floods 次调用返回 FloodWait"""
+
+    def __init__(self, latency, floods, flood_seconds, flood_peer):
+        self.latency = latency
+        self.flood_peer = flood_peer
+        self.floods = floods
+        self.flood_seconds = flood_seconds
+        self.calls = []
+
+    async def get_input_entity(self, peer):
+        return peer
+
+    async def __call__(self, request, flood_sleep_threshold=None):
+        await asyncio.sleep(self.latency)
+        if request.to_peer == self.flood_peer and self.floods > 0:
+            self.floods -= 1
+            raise FloodWaitError(request=request, capture=self.flood_seconds)
+        self.calls.append((request.from_peer, request.to_peer, list(request.id), time.perf_counter()))
+
+
+def bench_forward(args):
+    """一个来源突发 burst 条消息到目标 A，同时另一个来源每隔 interval 秒一条消息到目标 B"""
+    client = FakeClient(latency=0.005, floods=args.floods, flood_seconds=1, flood_peer=-200)
+    scheduler = ForwardScheduler(client, "bench", min_interval=args.interval)
+    other_count = 20
+    sent_at = {}
+
+    async def run():
+        start = time.perf_counter()
+        handler_time = 0.0
+        for i in range(args.burst):
+            t = time.perf_counter()
+            await scheduler.forward(FakeMessage(-100, i + 1), "-200")
+            handler_time = max(handler_time, time.perf_counter() - t)
+        max_depth = scheduler.stats()['max_depth']
+        for i in range(other_count):
+            sent_at[i + 1] = time.perf_counter()
+            await scheduler.forward(FakeMessage(-101, i + 1), "-300")
+            await asyncio.sleep(args.interval)
+        while scheduler.stats()['queued'] or len(sum((c[2] for c in client.calls), [])) < args.burst + other_count:
+            await asyncio.sleep(0.01)
+        return time.perf_counter() - start, handler_time, max_depth
+
+    elapsed, handler_time, max_depth = asyncio.run(run())
+    burst_calls = [c for c in client.calls if c[1] == -200]
+    burst_ids = sum((c[2] for c in burst_calls), [])
+    assert burst_ids == list(range(1, args.burst + 1)), "突发消息的顺序或数量不对"
+    other_delays = sorted(at - sent_at[message_id] for _, target, ids, at in client.calls if target == -300 for message_id in ids)
+    stats = scheduler.stats()
+    print(f"目标 A：{args.burst} 条突发消息用 {len(burst_calls)} 次 forward_messages 转发完，最长队列 {max_depth}，总耗时 {elapsed:.2f}s")
+    print(f"入队耗时最长 {handler_time * 1000:.2f} ms；FloodWait {stats['flood_waits']} 次")
+    print(f"目标 B：{len(other_delays)} 条消息，转发延迟中位数 {other_delays[len(other_delays) // 2] * 1000:.0f} ms，最大 {other_delays[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="消息监控转发基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    routing_parser = subparsers.add_parser("routing", help="消息路由（群组过滤 + 关键词规则）")
+    routing_parser.add_argument("--rules", type=int, default=10000, help="文字规则数")
+    routing_parser.add_argument("--chats", type=int, default=500, help="来源群组数")
+    routing_parser.add_argument("--messages", type=int, default=20000, help="消息数")
+    archive_parser = subparsers.add_parser("archive", help="消息记录写入数据库")
+    archive_parser.add_argument("--messages", type=int, default=5000, help="消息数")
+    archive_parser.add_argument("--chats", type=int, default=20, help="会话数")
+    forward_parser = subparsers.add_parser("forward", help="转发调度：突发消息合并与目标间隔离")
+    forward_parser.add_argument("--burst", type=int, default=1000, help="目标 A 的突发消息数")
+    forward_parser.add_argument("--interval", type=float, default=0.05, help="同一目标的最小转发间隔（秒）")
+    forward_parser.add_argument("--floods", type=int, default=2, help="目标 A 的前几次调用返回 FloodWait")
+    args = parser.parse_args()
+
+    if args.command == "routing":
+        bench_routing(args)
+    elif args.command == "archive":
+        bench_archive(args)
+    elif args.command == "forward":
+        bench_forward(args)
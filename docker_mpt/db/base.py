@@ -20,6 +20,16 @@ DATABASE_URL = config['database']['url']
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 消息记录的写缓冲，所有账号共用；database.write_behind 可调整批量大小、间隔和队列长度
+from .message_buffer import MessageBuffer
+write_behind = config['database'].get('write_behind') or {}
+message_buffer = MessageBuffer(
+    SessionLocal,
+    batch_size=int(write_behind.get('batch_size', 500)),
+    flush_interval_ms=int(write_behind.get('flush_interval_ms', 1000)),
+    max_queue=int(write_behind.get('max_queue', 10000)),
+)
+
 def get_db():
     db = SessionLocal()
     try:
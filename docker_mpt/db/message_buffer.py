@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    异步写缓冲（write-behind），默认写入 Message 表
+    所有账号的消息记录先进入队列，后台任务每 batch_size 条或每 flush_interval_ms 毫秒批量插入一次，
+    插入在线程中执行，不阻塞事件循环；队列满时 add 会等待（背压），close 时写完剩余记录
+    after_insert(session, batch) 可在同一事务中做后续更新
+    """
+
+    def __init__(self, session_factory, batch_size=500, flush_interval_ms=1000, max_queue=10000,
+                 model=Message, after_insert=None):
+        self.session_factory = session_factory
+        self.model = model
+        self.after_insert = after_insert
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.written = 0
+        self.failed = 0
+        self._queue = None
+        self._full = None
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        """在事件循环中启动后台写入任务"""
+        # Queue / Event 在 Python 3.9 中会绑定创建时的事件循环，所以在这里创建
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"{self.model.__tablename__} write-behind started: batch_size={self.batch_size}, flush_interval={self.flush_interval}s, max_queue={self.max_queue}")
+
+    async def add(self, row):
+        """加入一条消息记录（Message 的列名 -> 值），队列满时等待后台写入腾出空间"""
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+
+    def add_nowait(self, row):
+        """不等待的 add，队列满或缓冲未启动时丢弃并返回 False"""
+        if self._queue is None or self._closing:
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            return False
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+        return True
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def close(self):
+        """停止接收并写完队列中剩余的记录"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._full.set()
+        await self._task
+        self._task = None
+        logger.info(f"{self.model.__tablename__} write-behind stopped: {self.written} rows written, {self.failed} rows failed.")
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            if not self._closing and self._queue.qsize() < self.batch_size:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            await asyncio.to_thread(self._insert, batch)
+            self.written += len(batch)
+            logger.debug(f"[DEBUG] Flushed {len(batch)} rows to {self.model.__tablename__}, queue size: {self._queue.qsize()}")
+        except Exception as e:
+            # 写入失败只丢弃这一批，后台任务继续运行
+            self.failed += len(batch)
+            logger.error(f"批量保存 {len(batch)} 条记录到 {self.model.__tablename__} 失败: {e}", exc_info=True)
+
+    def _insert(self, batch):
+        with self.session_factory() as session:
+            dialect = session.get_bind().dialect.name
+            # 同一账号、会话、消息 id 已存在时跳过，避免一条重复记录导致整批失败
+            if dialect == 'sqlite':
+                stmt = sqlite.insert(self.model).on_conflict_do_nothing()
+            elif dialect == 'postgresql':
+                stmt = postgresql.insert(self.model).on_conflict_do_nothing()
+            else:
+                stmt = insert(self.model)
+            session.execute(stmt, batch)
+            if self.after_insert:
+                self.after_insert(session, batch)
+            session.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, create_engine, Index
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, DateTime, ForeignKey, create_engine, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -73,4 +73,45 @@ class ForwardRule(Base):
     # Add unique constraint for source_chat_id and target_user_id
     __table_args__ = (
         Index('ix_forward_rules_account_source_target', 'account_id', 'source_chat_id', 'target_user_id', unique=True),
-    ) 
\ No newline at end of file
+    ) 
+
+class BatchForwardJob(Base):
+    """Batch forward job with resumable checkpoint"""
+    __tablename__ = 'batch_forward_jobs'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
+    source_chat_id = Column(Integer, nullable=False)
+    target_chat_id = Column(Integer, nullable=False)
+    media_type = Column(String)  # 过滤类型，同 /batch_forward 的 type
+    max_count = Column(Integer, nullable=False)  # 最多转发的消息数
+    skip_remaining = Column(Integer, default=0)  # 还需要跳过的符合类型的消息数
+    sent_count = Column(Integer, default=0)
+    last_id = Column(Integer, default=0)  # 已处理到的源消息 id，恢复时从它之后继续
+    status = Column(String, default='running')  # running / done / failed
+    error = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_batch_forward_jobs_account_status', 'account_id', 'status'),
+    )
+
+
+class MediaIndexEntry(Base):
+    """Per-chat message index: message id and media-type bitmask"""
+    __tablename__ = 'media_index'
+
+    chat_id = Column(BigInteger, primary_key=True)
+    message_id = Column(Integer, primary_key=True)
+    media_mask = Column(Integer, nullable=False, default=0)  # 各 type 过滤是否命中的位掩码
+    grouped_id = Column(BigInteger)  # 相册 id
+
+
+class MediaIndexState(Base):
+    """Media index progress per chat"""
+    __tablename__ = 'media_index_state'
+
+    chat_id = Column(BigInteger, primary_key=True)
+    max_id = Column(Integer, nullable=False, default=0)  # 该 id 及之前的历史消息都已建立索引
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -4,7 +4,7 @@ import logging
 from telethon import TelegramClient, events
 from db.base import init_db
 from db.models import Account
-from db.base import SessionLocal
+from db.base import SessionLocal, message_buffer
 import asyncio
 from telethon.errors import SessionPasswordNeededError
 from modules.offset_utils import handle_offset_for_id_command, is_media_type
@@ -13,7 +13,10 @@ from modules.handle_watch_text import handle_watch_text_command, handle_unwatch_
 from modules.handle_watch_media import handle_watch_media_command, handle_unwatch_media_command
 from modules.handle_help import handle_help_command, handle_msginfo_command
 from modules.handle_mes import handle_message
-from modules.handle_batch import handle_batch_forward_command
+from modules.handle_batch import handle_batch_forward_command, handle_batch_resume_command
+from modules.routing_index import invalidate_routing_index
+from modules.forward_scheduler import get_forward_scheduler, close_forward_schedulers
+from modules.media_index import live_buffer, record_live_message, remove_messages
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, # 可以暂时设置为 DEBUG 级别以获取更多信息
@@ -131,7 +134,11 @@ def setup_handlers(client, account_config, account_name, db_account, text_watch_
     # 使用 lambda 函数包装 async 方法，确保它们能在内部类中被正确引用
     @client.on(events.NewMessage)
     async def _handle_new_message(event):
-        await handle_message(event, client, account_config, account_name, db_account, text_watch_rules, media_watch_rules)
+        try:
+            await handle_message(event, client, account_config, account_name, db_account, text_watch_rules, media_watch_rules)
+        finally:
+            # 转发之后再把新消息交给媒体索引的写缓冲，已建立索引的会话之后的 offset 查询不必再向服务器补拉
+            record_live_message(event.message)
     
     @client.on(events.NewMessage(pattern='/watch_text'))
     async def _handle_watch_text_command(event):
@@ -145,6 +152,10 @@ def setup_handlers(client, account_config, account_name, db_account, text_watch_
     async def _handle_batch_forward_command(event):
         await handle_batch_forward_command(event, client, account_config, account_name, db_account, text_watch_rules, media_watch_rules)
     
+    @client.on(events.NewMessage(pattern='/batch_resume'))
+    async def _handle_batch_resume_command(event):
+        await handle_batch_resume_command(event, client, account_config, account_name, db_account)
+    
     @client.on(events.NewMessage(pattern='/help'))
     async def _handle_help_command(event):
         await handle_help_command(event, client, account_config, account_name)
@@ -172,6 +183,12 @@ def setup_handlers(client, account_config, account_name, db_account, text_watch_
     @client.on(events.NewMessage(pattern='/offset_for_id'))
     async def _handle_offset_for_id_command(event):
         await handle_offset_for_id_command(event, client, account_config, account_name)
+
+    @client.on(events.MessageDeleted)
+    async def _handle_message_deleted(event):
+        # 普通群的删除事件不带 chat_id，这类会话在下次查询时无法感知删除
+        if event.chat_id is not None:
+            await remove_messages(event.chat_id, event.deleted_ids)
     
     logger.info(f"Event handlers for account {account_name} are now active.")
 
@@ -197,6 +214,13 @@ async def handle_account_command(event, client, account_config, account_name, db
                 response += f"文字: 源:`{sid}` -> 目标:`{tid}` | 关键词: `{keyword}`\n"
             for sid, tid in media_watch_rules.items():
                 response += f"媒体: 源:`{sid}` -> 目标:`{tid}`\n"
+        stats = get_forward_scheduler(account_name, client).stats()
+        response += "\n*转发队列:*\n"
+        response += f"目标数: `{stats['targets']}` 排队: `{stats['queued']}` 最长队列: `{stats['max_depth']}`\n"
+        response += f"已转发: `{stats['forwarded']}` 批次: `{stats['batches']}` FloodWait: `{stats['flood_waits']}` 丢弃: `{stats['dropped']}` 失败: `{stats['failed']}`\n"
+        for target_id, depth in sorted(stats['depths'].items(), key=lambda item: -item[1])[:10]:
+            if depth:
+                response += f"目标 `{target_id}`: `{depth}` 条待转发\n"
         await event.respond(response, parse_mode='markdown')
             
     except Exception as e:
@@ -265,6 +289,7 @@ async def handle_config_command(event, client, account_config, account_name, tex
                 try:
                     chat_ids = [int(cid) for cid in value_args]
                     account_config['monitoring']['enabled_chats'] = chat_ids
+                    invalidate_routing_index(account_name)
                     persist_config_changes_to_file(account_name, account_config, text_watch_rules, media_watch_rules)
                     await event.respond(f"已设置监控的群组/频道ID: `{', '.join(map(str, chat_ids))}`", parse_mode='markdown')
                 except ValueError:
@@ -273,6 +298,7 @@ async def handle_config_command(event, client, account_config, account_name, tex
             elif option == 'bot_usernames':
                 # 允许设置多个机器人用户名
                 account_config['monitoring']['bot_usernames'] = value_args # 直接使用列表
+                invalidate_routing_index(account_name)
                 persist_config_changes_to_file(account_name, account_config, text_watch_rules, media_watch_rules)
                 await event.respond(f"已设置监控的机器人用户名: `{', '.join(value_args) or '无'}`", parse_mode='markdown')
 
@@ -288,6 +314,8 @@ async def handle_config_command(event, client, account_config, account_name, tex
 
 async def main():
     logger.info("Starting main bot loop...")
+    message_buffer.start()
+    live_buffer.start()
     clients = []
     for account_config in config['accounts']:
         if account_config.get('enabled', False):
@@ -342,6 +370,8 @@ async def main():
             logger.info(f"Account {account_config.get('name', 'Unnamed')} is disabled and will not be initialized.")
     if not clients:
         logger.critical("No accounts were successfully initialized. Exiting.")
+        await message_buffer.close()
+        await live_buffer.close()
         return
     logger.info(f"Successfully initialized {len(clients)} active accounts. Starting clients...")
     try:
@@ -351,10 +381,15 @@ async def main():
     except Exception as e:
         logger.critical(f"An unexpected error occurred in main loop: {e}", exc_info=True)
     finally:
+        # 断开前尽量发完转发队列中的消息
+        await close_forward_schedulers()
         logger.info("Disconnecting all clients...")
         for client in clients:
             if client.is_connected():
                 await client.disconnect()
+        # 断开后不会再有新消息，写完缓冲中剩余的记录
+        await message_buffer.close()
+        await live_buffer.close()
         logger.info("All clients disconnected. Exiting.")
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import ForwardMessagesRequest
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 1.0      # 同一目标两次转发之间的最小间隔（秒）
+MAX_INTERVAL = 60.0     # 连续触发 FloodWait 后间隔的上限
+MAX_BATCH = 100         # 一次 forward_messages 最多转发的消息数
+QUEUE_SIZE = 1000       # 每个目标最多排队的消息数，超过后丢弃新消息
+IDLE_TIMEOUT = 300      # 目标队列空闲这么久后回收
+MAX_FLOOD_RETRIES = 5   # 同一批消息遇到 FloodWait 的最多重试次数
+DRAIN_TIMEOUT = 30      # 停止时最多等待这么久发完队列中的消息
+
+# 每个账号一个调度器
+_schedulers = {}
+
+
+class AdaptivePacer:
+    """
+    按 FloodWait 自适应调整转发间隔
+    遇到 FloodWait 时等待服务器要求的时间并把间隔翻倍，之后每次成功逐步回落到 min_interval
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_at = 0.0
+        self.floods = 0
+
+    async def wait(self):
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        self.interval = max(self.min_interval, self.interval * 0.9)
+        self.next_at = time.monotonic() + self.interval
+
+    def on_error(self):
+        """其他错误：不调整间隔，但同样等待一个间隔再发下一批"""
+        self.next_at = max(self.next_at, time.monotonic() + self.interval)
+
+    def on_flood(self, seconds):
+        self.floods += 1
+        self.interval = min(self.max_interval, self.interval * 2)
+        self.next_at = time.monotonic() + max(seconds, self.interval)
+
+
+def to_peer_id(target_id):
+    """规则里的目标可能是数字字符串或用户名"""
+    if isinstance(target_id, str) and target_id.lstrip('-').isdigit():
+        return int(target_id)
+    return target_id
+
+
+async def forward_ids(client, from_peer, message_ids, to_peer, pacer):
+    """
+    用一次 forward_messages 转发同一来源的多条消息，遇到 FloodWait 按 pacer 等待后重试
+    flood_sleep_threshold=0 让 Telethon 直接抛出 FloodWaitError，由 pacer 统一调整间隔
+    返回遇到 FloodWait 的次数；其他错误直接抛出
+    """
+    floods = 0
+    while True:
+        await pacer.wait()
+        try:
+            await client(ForwardMessagesRequest(from_peer=from_peer, id=list(message_ids), to_peer=to_peer),
+                         flood_sleep_threshold=0)
+            pacer.on_success()
+            return floods
+        except FloodWaitError as e:
+            floods += 1
+            pacer.on_flood(e.seconds)
+            logger.warning(f"FloodWait {e.seconds}s 转发 {len(message_ids)} 条消息到 {to_peer}，间隔调整为 {pacer.interval:.1f}s（第 {floods} 次）")
+            if floods > MAX_FLOOD_RETRIES:
+                raise
+
+
+class TargetQueue:
+    def __init__(self, min_interval):
+        self.jobs = deque()   # (chat_id, input_chat, message_id)
+        self.wakeup = asyncio.Event()
+        self.pacer = AdaptivePacer(min_interval)
+        self.peer = None
+        self.task = None
+        self.sending = False
+
+
+class ForwardScheduler:
+    """
+    每个转发目标一个队列和一个后台任务，事件处理函数只负责入队，不再在处理函数中 sleep
+    同一目标按 AdaptivePacer 限速，等待期间积累的同一来源的后续消息合并为一次 forward_messages
+    队列空闲超过 IDLE_TIMEOUT 后回收，内存只与活跃目标数有关
+    """
+
+    def __init__(self, client, account_name, min_interval=MIN_INTERVAL):
+        self.client = client
+        self.account_name = account_name
+        self.min_interval = min_interval
+        self._targets = {}
+        self.forwarded = 0
+        self.batches = 0
+        self.flood_waits = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def forward(self, message, target_id):
+        """把消息加入目标队列，立即返回"""
+        # 先取来源的 InputPeer（通常在缓存中），之后到入队之间不再让出事件循环，避免目标队列恰好被回收
+        input_chat = await message.get_input_chat()
+        key = str(target_id)
+        target = self._targets.get(key)
+        if target is None:
+            target = self._targets[key] = TargetQueue(self.min_interval)
+            target.task = asyncio.get_running_loop().create_task(self._run(key, target_id, target))
+        if len(target.jobs) >= QUEUE_SIZE:
+            self.dropped += 1
+            logger.warning(f"转发队列已满，丢弃消息 {message.id}: {message.chat_id} -> {target_id}（队列 {len(target.jobs)} 条）")
+            return
+        target.jobs.append((message.chat_id, input_chat, message.id))
+        target.wakeup.set()
+
+    def stats(self):
+        depths = {key: len(target.jobs) for key, target in self._targets.items()}
+        return {
+            'targets': len(depths),
+            'queued': sum(depths.values()),
+            'max_depth': max(depths.values(), default=0),
+            'depths': depths,
+            'forwarded': self.forwarded,
+            'batches': self.batches,
+            'flood_waits': self.flood_waits,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    async def close(self, timeout=DRAIN_TIMEOUT):
+        """停止前尽量发完各目标队列中的消息，超时后丢弃剩余消息并记录条数；需在断开连接前调用"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (any(target.jobs or target.sending for target in self._targets.values())
+               and loop.time() < deadline):
+            await asyncio.sleep(0.1)
+        remaining = sum(len(target.jobs) for target in self._targets.values())
+        tasks = [target.task for target in self._targets.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._targets.clear()
+        if remaining:
+            self.dropped += remaining
+            logger.warning(f"账号 {self.account_name} 停止时仍有 {remaining} 条消息未转发，已丢弃")
+        logger.info(f"账号 {self.account_name} 转发调度已停止：共转发 {self.forwarded} 条，丢弃 {self.dropped} 条，失败 {self.failed} 条")
+
+    async def _run(self, key, target_id, target):
+        while True:
+            if not target.jobs:
+                target.wakeup.clear()
+                try:
+                    await asyncio.wait_for(target.wakeup.wait(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not target.jobs:
+                        del self._targets[key]
+                        return
+            # 先等到允许发送，等待期间到达的消息可以合并到这一批
+            await target.pacer.wait()
+            chat_id, input_chat, message_id = target.jobs.popleft()
+            message_ids = [message_id]
+            while (target.jobs and len(message_ids) < MAX_BATCH
+                   and target.jobs[0][0] == chat_id and target.jobs[0][2] > message_ids[-1]):
+                message_ids.append(target.jobs.popleft()[2])
+            target.sending = True
+            try:
+                await self._send(target_id, target, chat_id, input_chat, message_ids)
+            finally:
+                target.sending = False
+
+    async def _send(self, target_id, target, chat_id, input_chat, message_ids):
+        floods = target.pacer.floods
+        try:
+            if target.peer is None:
+                target.peer = await self.client.get_input_entity(to_peer_id(target_id))
+            await forward_ids(self.client, input_chat, message_ids, target.peer, target.pacer)
+            self.forwarded += len(message_ids)
+            self.batches += 1
+            logger.info(f"已转发 {len(message_ids)} 条消息: {chat_id} -> {target_id}（ids {message_ids[0]}..{message_ids[-1]}，剩余 {len(target.jobs)} 条）")
+        except ValueError as e:
+            self.failed += len(message_ids)
+            logger.error(f"无法找到目标实体 {target_id}，请确保机器人已与目标建立对话或在群组/频道内。错误: {e}")
+        except Exception as e:
+            self.failed += len(message_ids)
+            target.pacer.on_error()
+            logger.error(f"转发 {len(message_ids)} 条消息到 {target_id} 时出错: {e}")
+        finally:
+            self.flood_waits += target.pacer.floods - floods
+
+
+def get_forward_scheduler(account_name, client):
+    scheduler = _schedulers.get(account_name)
+    if scheduler is None:
+        scheduler = _schedulers[account_name] = ForwardScheduler(client, account_name)
+    return scheduler
+
+
+async def close_forward_schedulers(timeout=DRAIN_TIMEOUT):
+    """停止所有账号的转发调度"""
+    await asyncio.gather(*(scheduler.close(timeout) for scheduler in _schedulers.values()))
+    _schedulers.clear()
@@ -1,14 +1,24 @@
-import logging 
+import logging
 import asyncio
+from datetime import datetime
+from telethon.errors import FloodWaitError
 from telethon.tl.types import  MessageMediaWebPage
 from modules.check_admin_utils import check_admin
 from modules.offset_utils import is_media_type
+from modules.forward_scheduler import AdaptivePacer, MAX_BATCH, forward_ids
+from modules.media_index import album_last_id, count_media_messages, ensure_media_index, nth_media_message
+from db.base import SessionLocal
+from db.models import BatchForwardJob
 
 logging.basicConfig(
     level=logging.INFO, # 可以暂时设置为 DEBUG 级别以获取更多信息
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+
+# 本进程中正在执行的任务 id，防止同一任务被重复恢复
+running_jobs = set()
+
 async def handle_batch_forward_command(event, client, account_config, account_name, db_account, text_watch_rules, media_watch_rules):
     """命令格式: /batch_forward 源chatid 目标chatid 数量 [跳过数量] [type]"""
     logger.info(f"Received /batch_forward command from {event.sender_id}: {event.text}")
@@ -25,51 +35,245 @@ async def handle_batch_forward_command(event, client, account_config, account_na
         offset = int(args[4]) if len(args) > 4 and args[4].isdigit() else 0
         media_type = args[5].lower() if len(args) > 5 else None
 
-        await event.respond(f"开始批量转发...\n源: `{source_chat_id}`\n目标: `{target_chat_id}`\n数量: `{limit}`\n跳过: `{offset}`\n类型: `{media_type or 'photo+video'}`", parse_mode='markdown')
-        #await batch_forward_media(source_chat_id, target_chat_id, limit, offset, media_type, client)
-        #await event.respond("批量转发完成！")
-        sent_count, last_id = await batch_forward_media(source_chat_id, target_chat_id, limit, offset, media_type, client)
-        await event.respond(f"批量转发完成！共发送 {sent_count} 条，最后一条源消息ID是 {last_id}。\n下次可用 offset={offset+sent_count} 跳过。")
+        job_id = create_job(db_account.id, source_chat_id, target_chat_id, limit, offset, media_type)
+        await event.respond(f"开始批量转发（任务 {job_id}）...\n源: `{source_chat_id}`\n目标: `{target_chat_id}`\n数量: `{limit}`\n跳过: `{offset}`\n类型: `{media_type or 'photo+video'}`", parse_mode='markdown')
+        result = await run_job(event, client, job_id)
+        if result:
+            await event.respond(format_job_result(job_id, result))
     except ValueError:
         await event.respond("参数错误：chatid、数量和跳过数量必须是数字。")
     except Exception as e:
         logger.error(f"Error handling /batch_forward command: {e}", exc_info=True)
         await event.respond(f"批量转发出错: {e}")
 
-async def batch_forward_media(source_chat_id, target_chat_id, limit=50, offset=0, media_type=None, client=None):
+async def handle_batch_resume_command(event, client, account_config, account_name, db_account):
+    """命令格式: /batch_resume [任务id]，不带参数时列出未完成的任务"""
+    logger.info(f"Received /batch_resume command from {event.sender_id}: {event.text}")
+    if not event.is_private or not await check_admin(event, account_config):
+        return
+    try:
+        args = event.text.strip().split()
+        if len(args) < 2:
+            with SessionLocal() as session:
+                jobs = session.query(BatchForwardJob).filter(
+                    BatchForwardJob.account_id == db_account.id,
+                    BatchForwardJob.status != 'done'
+                ).order_by(BatchForwardJob.id).all()
+            jobs = [job for job in jobs if job.id not in running_jobs]
+            if not jobs:
+                await event.respond("没有未完成的批量转发任务。")
+                return
+            response = "未完成的批量转发任务：\n"
+            for job in jobs:
+                response += (f"任务 `{job.id}`: `{job.source_chat_id}` -> `{job.target_chat_id}` 类型: `{job.media_type or 'photo+video'}` "
+                             f"已发送 `{job.sent_count}/{job.max_count}` 进度 id `{job.last_id}` 状态 `{job.status}`\n")
+            response += "使用 /batch_resume <任务id> 继续。"
+            await event.respond(response, parse_mode='markdown')
+            return
+        job_id = int(args[1])
+        with SessionLocal() as session:
+            job = session.get(BatchForwardJob, job_id)
+            if not job or job.account_id != db_account.id:
+                await event.respond(f"未找到任务 {job_id}。")
+                return
+            if job.status == 'done':
+                await event.respond(f"任务 {job_id} 已完成。")
+                return
+        if job_id in running_jobs:
+            await event.respond(f"任务 {job_id} 正在执行中。")
+            return
+        await event.respond(f"继续批量转发任务 {job_id}，从源消息 id {job.last_id} 之后开始，已发送 {job.sent_count}/{job.max_count}。")
+        result = await run_job(event, client, job_id)
+        if result:
+            await event.respond(format_job_result(job_id, result))
+    except ValueError:
+        await event.respond("参数错误：任务id必须是数字。")
+    except Exception as e:
+        logger.error(f"Error handling /batch_resume command: {e}", exc_info=True)
+        await event.respond(f"恢复批量转发出错: {e}")
+
+def create_job(account_id, source_chat_id, target_chat_id, limit, offset, media_type):
+    with SessionLocal() as session:
+        job = BatchForwardJob(
+            account_id=account_id,
+            source_chat_id=source_chat_id,
+            target_chat_id=target_chat_id,
+            media_type=media_type,
+            max_count=limit,
+            skip_remaining=offset,
+            sent_count=0,
+            last_id=0,
+            status='running',
+        )
+        session.add(job)
+        session.commit()
+        return job.id
+
+def save_checkpoint(job_id, **fields):
+    """保存任务进度，fields 为要更新的列"""
+    with SessionLocal() as session:
+        job = session.get(BatchForwardJob, job_id)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = datetime.utcnow()
+        session.commit()
+
+def format_job_result(job_id, result):
+    sent_count, last_id, failed_ids, next_offset = result
+    if last_id is None:
+        text = f"批量转发完成！任务 {job_id} 共发送 {sent_count} 条，没有找到可转发的消息。"
+    else:
+        text = f"批量转发完成！任务 {job_id} 共发送 {sent_count} 条，最后处理的源消息ID是 {last_id}。"
+    if failed_ids:
+        shown = ', '.join(str(message_id) for message_id in failed_ids[:20])
+        text += f"\n{len(failed_ids)} 条消息无法转发，已跳过: {shown}{' ...' if len(failed_ids) > 20 else ''}"
+    if next_offset is not None:
+        text += f"\n下次可用 offset={next_offset} 跳过已处理的消息。"
+    return text
+
+async def run_job(event, client, job_id):
+    """执行（或继续执行）批量转发任务，返回 batch_forward_media 的结果；中断时回复并返回 None"""
+    running_jobs.add(job_id)
+    try:
+        save_checkpoint(job_id, status='running', error=None)
+        return await batch_forward_media(job_id, client)
+    except Exception as e:
+        logger.error(f"Batch forward job {job_id} failed: {e}", exc_info=True)
+        save_checkpoint(job_id, status='failed', error=str(e)[:500])
+        await event.respond(f"批量转发任务 {job_id} 中断: {e}\n进度已保存，可用 /batch_resume {job_id} 继续。")
+        return None
+    finally:
+        running_jobs.discard(job_id)
+
+async def batch_forward_media(job_id, client):
     """
-    批量转发历史消息，支持 type 参数
-    :param source_chat_id: 源群组/频道ID
-    :param target_chat_id: 目标群组/频道ID
-    :param limit: 获取的历史消息数量
-    :param offset: 跳过前 offset 条
-    :param media_type: 支持 all, all-txt, photo, video, image, document, audio, text
+    按任务记录批量转发历史消息，支持 type 参数，可从进度处继续
+    - 每次 forward_messages 最多转发 MAX_BATCH 条，间隔由 AdaptivePacer 按 FloodWait 自动调整
+    - 相册（同一 grouped_id）整体转发：其中任一条符合类型即转发整个相册，且不会被拆到两次调用中；
+      相册的每一条都计入数量，最后一个相册可能使总数略超过 limit
+    - 某批因其中的消息无法转发（已删除、受保护等）而失败时，改为逐个相册/消息转发，跳过失败的消息并继续
+    - 每次转发后把 last_id / sent_count 写入数据库，中断后 /batch_resume 从 last_id 之后继续
+    - 跳过数量按符合类型的消息计数（与 /offset_for_id 一致），由本地媒体索引直接定位跳过的终点，
+      不再逐条拉取被跳过的历史；终点落在相册中间时整个相册都跳过
+    :return: (本任务累计发送条数, 最后处理的源消息ID, 跳过的消息ID列表, 下次继续用的 offset)；
+             最后处理的源消息ID 在没有处理任何消息时为 None，offset 无法确定时为 None
     """
-    logger.info(f"Starting batch media forward from {source_chat_id} to {target_chat_id}, limit={limit}, offset={offset}, type={media_type}")
-    count = 0
-    last_message_id = None  # 新增
-    try:
-        async for message in client.iter_messages(source_chat_id, offset_id=0, reverse=True):
-            if not is_media_type(message, media_type):
-                continue
-            if offset > 0:
-                logger.debug(f"Skipping message {message.id} (offset remaining: {offset})")
-                offset -= 1
+    with SessionLocal() as session:
+        job = session.get(BatchForwardJob, job_id)
+        source_chat_id, target_chat_id, media_type = job.source_chat_id, job.target_chat_id, job.media_type
+        limit, skip, sent, start_id = job.max_count, job.skip_remaining, job.sent_count, job.last_id
+    logger.info(f"Starting batch media forward job {job_id} from {source_chat_id} to {target_chat_id}, limit={limit}, skip={skip}, sent={sent}, after id={start_id}, type={media_type}")
+    if sent >= limit:
+        save_checkpoint(job_id, status='done')
+        return sent, start_id or None, [], None
+
+    # start_id 及之前符合类型的消息数，从头开始时为 0，从中途继续时未知
+    matched_before = 0 if start_id == 0 else None
+    if skip > 0:
+        await ensure_media_index(client, source_chat_id)
+        boundary = await asyncio.to_thread(nth_media_message, source_chat_id, skip - 1, media_type, start_id)
+        if boundary is None:
+            logger.info(f"Job {job_id}: fewer than {skip} matching messages after id {start_id}, nothing to forward.")
+            save_checkpoint(job_id, status='done', skip_remaining=0)
+            return sent, None, [], None
+        start_id, grouped_id = boundary
+        if grouped_id:
+            start_id = await asyncio.to_thread(album_last_id, source_chat_id, grouped_id)
+        matched_before = await asyncio.to_thread(count_media_messages, source_chat_id, media_type, start_id)
+        save_checkpoint(job_id, skip_remaining=0, last_id=start_id)
+        logger.info(f"Job {job_id}: skipped to after message id {start_id} using the media index.")
+
+    from_peer = await client.get_input_entity(source_chat_id)
+    to_peer = await client.get_input_entity(target_chat_id)
+    pacer = AdaptivePacer()
+    chunk = []          # 待转发的单元：(消息 id 列表, 其中符合类型的条数)
+    last_id = None      # 最后处理（转发或跳过）的源消息 id
+    failed_ids = []     # 无法转发而跳过的消息 id
+    consumed = 0        # 已处理的符合类型的消息数
+    done = False
+
+    def pending():
+        return sum(len(ids) for ids, _ in chunk)
+
+    async def forward_unit(ids):
+        """单独转发一个相册或一条消息，相册失败时再逐条转发；返回成功转发的条数"""
+        try:
+            await forward_ids(client, from_peer, ids, to_peer, pacer)
+            return len(ids)
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            pacer.on_error()
+            if len(ids) > 1:
+                forwarded = 0
+                for message_id in ids:
+                    forwarded += await forward_unit([message_id])
+                return forwarded
+            logger.warning(f"Job {job_id}: skipping message {ids[0]} that cannot be forwarded: {e}")
+            failed_ids.append(ids[0])
+            return 0
+
+    async def flush():
+        nonlocal sent, last_id, consumed
+        if not chunk:
+            return
+        ids = [message_id for unit_ids, _ in chunk for message_id in unit_ids]
+        try:
+            await forward_ids(client, from_peer, ids, to_peer, pacer)
+        except FloodWaitError:
+            # FloodWait 重试次数用完，任务中断，之后从上一次的进度继续
+            raise
+        except Exception as e:
+            pacer.on_error()
+            logger.warning(f"Job {job_id}: forwarding {len(ids)} messages failed ({e}), retrying one album/message at a time.")
+            for unit_ids, matched in chunk:
+                sent += await forward_unit(unit_ids)
+                last_id = unit_ids[-1]
+                consumed += matched
+                save_checkpoint(job_id, sent_count=sent, last_id=last_id)
+        else:
+            sent += len(ids)
+            last_id = ids[-1]
+            consumed += sum(matched for _, matched in chunk)
+            save_checkpoint(job_id, sent_count=sent, last_id=last_id)
+        logger.info(f"Job {job_id}: processed {len(ids)} messages (ids {ids[0]}..{ids[-1]}). Total forwarded: {sent}/{limit}, skipped: {len(failed_ids)}")
+        chunk.clear()
+
+    async def take(unit):
+        """处理一条消息或一个完整的相册"""
+        nonlocal done
+        matched = sum(1 for message in unit if is_media_type(message, media_type))
+        if not matched:
+            return
+        if pending() + len(unit) > MAX_BATCH:
+            await flush()
+        chunk.append(([message.id for message in unit], matched))
+        if sent + pending() >= limit:
+            done = True
+
+    while True:
+        done = False
+        album = []      # 正在收集的相册
+        async for message in client.iter_messages(source_chat_id, offset_id=start_id, reverse=True):
+            if album and message.grouped_id != album[0].grouped_id:
+                await take(album)
+                album = []
+                if done:
+                    break
+            if message.grouped_id:
+                album.append(message)
                 continue
-            try:
-                logger.info(f"Forwarding message {message.id} (type: {media_type or 'photo+video'}) from {source_chat_id} to {target_chat_id}")
-                await message.forward_to(target_chat_id)
-                count += 1
-                last_message_id = message.id  # 记录最后一条成功转发的消息ID
-                logger.info(f"Successfully forwarded message {message.id}. Total forwarded: {count}/{limit}")
-                await asyncio.sleep(2)
-            except Exception as e:
-                preview = (message.text or '').replace('\n', ' ')[:60]
-                logger.error(f"转发消息失败 | id={message.id} | 预览='{preview}' | 错误类型: {type(e).__name__} | 详情: {e}", exc_info=True)
-            if count >= limit:
-                logger.info(f"Reached forwarding limit ({limit}). Stopping batch forward.")
+            await take([message])
+            if done:
                 break
-    except Exception as e:
-        logger.error(f"Error during batch media forwarding: {e}", exc_info=True)
-        raise # 重新抛出异常，让调用者处理
-    return count, last_message_id  # 返回最后一条成功转发的消息ID
+        if album and not done:
+            await take(album)
+        await flush()
+        # 有消息被跳过时可能还没达到数量，从最后处理的消息之后继续
+        if not done or sent >= limit:
+            break
+        start_id = last_id
+    save_checkpoint(job_id, status='done')
+    logger.info(f"Batch forward job {job_id} finished: {sent} messages forwarded, {len(failed_ids)} skipped.")
+    next_offset = matched_before + consumed if matched_before is not None else None
+    return sent, last_id, failed_ids, next_offset
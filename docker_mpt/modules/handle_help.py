@@ -19,7 +19,8 @@ async def handle_help_command(event, client, account_config, account_name):
         "/help - 显示本帮助信息\n"
         "/watch_text <源chatid> <目标chatid> <关键词> - 文字监控转发（*为全部）\n"
         "/watch_media <源chatid> <目标chatid> [type] - 媒体监控转发，type 可选：all, photo, video, image, document, audio, text，all 表示所有文件，默认仅常见媒体\n"
-        "/batch_forward <源chatid> <目标chatid> <数量> [跳过数量] - 批量转发历史图片和视频\n"
+        "/batch_forward <源chatid> <目标chatid> <数量> [跳过数量] [type] - 批量转发历史图片和视频，每次最多转发 100 条，相册整体转发\n"
+        "/batch_resume [任务id] - 列出或继续中断的批量转发任务\n"
         "/status - 查看当前账号状态和监控规则\n"
         "/config - 查看和设置配置项（例如：/config show, /config set auto_download true）\n"
     )
@@ -1,17 +1,11 @@
 
-from collections import defaultdict
-import time
-import logging 
-from modules.check_admin_utils import check_admin
-from modules.handle_med import handle_media
 import logging
-from db.base import init_db
-from db.models import Message
-from db.base import SessionLocal
-import asyncio
 from datetime import datetime
-from collections import defaultdict
-import time
+from modules.check_admin_utils import check_admin
+from modules.handle_med import handle_media
+from modules.routing_index import get_routing_index
+from modules.forward_scheduler import get_forward_scheduler
+from db.base import message_buffer
 
 logging.basicConfig(
     level=logging.INFO, # 可以暂时设置为 DEBUG 级别以获取更多信息
@@ -19,10 +13,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ========== 频率限制：每 chat_id 每秒最多转发一次 ==========
-# 记录上次转发时间，key=(source_id, target_id)
-last_forward_time = defaultdict(lambda: 0)
-
 async def handle_message(event, client, account_config, account_name, db_account, text_watch_rules, media_watch_rules):
     """处理新消息，支持群组、频道和私聊"""
     logger.debug(f"[DEBUG] handle_message triggered for chat_id: {event.chat_id}, message_id: {event.message.id}")
@@ -34,22 +24,23 @@ async def handle_message(event, client, account_config, account_name, db_account
 
     logger.debug(f"[DEBUG] Message type: private={is_private}, group={is_group}, channel={is_channel}")
 
-    # 只处理配置中允许的群组/频道/私聊
-    enabled_chats = [str(cid) for cid in account_config['monitoring'].get('enabled_chats', [])] # 确保都是字符串
-    logger.debug(f"[DEBUG] Configured enabled_chats: {enabled_chats}")
+    # 只处理配置中允许的群组/频道/私聊，规则和配置预编译为路由索引，修改时才重建
+    routing = get_routing_index(account_name, account_config, text_watch_rules)
+    # 转发按目标排队，处理函数中不等待限速
+    scheduler = get_forward_scheduler(account_name, client)
 
     # 获取消息来源的 chat_id (统一为字符串)
     source_id = str(event.chat_id)
 
     if is_group or is_channel:
-        if enabled_chats and source_id not in enabled_chats:
+        if not routing.is_chat_enabled(source_id):
             logger.debug(f"[DEBUG] Skipping disabled group/channel chat_id: {source_id}")
             return
         else:
             logger.debug(f"[DEBUG] Processing group/channel message from chat_id: {source_id}")
     elif is_private:
         monitor_private_bots = account_config['monitoring'].get('monitor_private_bots', False)
-        bot_usernames = account_config['monitoring'].get('bot_usernames', [])
+        bot_usernames = routing.bot_usernames
         logger.debug(f"[DEBUG] Private chat monitoring config: monitor_private_bots={monitor_private_bots}, bot_usernames={bot_usernames}")
 
         if monitor_private_bots:
@@ -73,9 +64,10 @@ async def handle_message(event, client, account_config, account_name, db_account
         logger.debug(f"[DEBUG] Skipping unknown message type from chat_id: {source_id}")
         return
 
+    message_row = None
     try:
-        # 记录消息
-        message = Message(
+        # 记录消息：交给写缓冲批量保存，处理完转发后才入队（见 finally），队列满时的等待不会推迟转发
+        message_row = dict(
             account_id=db_account.id,
             message_id=event.message.id,
             chat_id=event.chat_id,
@@ -88,14 +80,10 @@ async def handle_message(event, client, account_config, account_name, db_account
             is_forwarded=event.message.forward is not None
         )
 
-        # 保存消息
-        with SessionLocal() as session:
-            session.add(message)
-            session.commit()
-        logger.debug(f"[DEBUG] Message {event.message.id} from {event.chat_id} saved to DB.")
-
-        logger.debug(f"[DEBUG] Current text watch rules: {text_watch_rules}")
-        logger.debug(f"[DEBUG] Current media watch rules: {media_watch_rules}")
+        # 规则很多时格式化整张表的开销不小，只在 DEBUG 级别时输出
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[DEBUG] Current text watch rules: {text_watch_rules}")
+            logger.debug(f"[DEBUG] Current media watch rules: {media_watch_rules}")
 
         # 处理媒体文件和转发逻辑分离，先判断转发
         if event.message.media: # 再次检查是否有媒体，因为之前可能只是下载
@@ -157,16 +145,9 @@ async def handle_message(event, client, account_config, account_name, db_account
                     logger.warning(f"未转发媒体: id={event.message.id}, mime={mime}, is_sticker={is_sticker}, is_gif={is_gif}, is_video={is_video}, attributes={[attr.__class__.__name__ for attr in doc.attributes] if doc and hasattr(doc, 'attributes') else None}")
                 # --- END ---
                 if should_forward:
-                    # ====== 频率限制：如不足1秒则延迟发送 ======
-                    now = time.time()
-                    key = (source_id, str(target_id_media))
-                    wait_time = 1.0 - (now - last_forward_time[key])
-                    if wait_time > 0:
-                        logger.info(f"频率限制：{key} 距上次转发不足1秒，延迟 {wait_time:.2f} 秒后发送。")
-                        await asyncio.sleep(wait_time)
-                    last_forward_time[key] = time.time()
+                    # 交给该目标的转发队列，由调度器限速并合并连续消息
                     logger.info(f"命中媒体规则: {source_id} -> {target_id_media} 类型: {media_type or 'media'} 转发媒体消息 {event.message.id}.")
-                    await safe_forward_message(event.message, target_id_media, client)
+                    await scheduler.forward(event.message, target_id_media)
                 else:
                     logger.debug(f"[DEBUG] Media rule hit but type not match: {media_type}, mime: {mime}")
         # 处理媒体文件（下载），不影响转发
@@ -175,22 +156,13 @@ async def handle_message(event, client, account_config, account_name, db_account
             await handle_media(event.message, account_config)
         # 文字监控
         if event.message.text:
-            text_processed = False
-            for (sid, keyword), target_id in text_watch_rules.items():
-                if sid == source_id and (keyword == '*' or keyword in event.message.text):
-                    # ====== 频率限制：如不足1秒则延迟发送 ======
-                    now = time.time()
-                    key = (source_id, str(target_id))
-                    wait_time = 1.0 - (now - last_forward_time[key])
-                    if wait_time > 0:
-                        logger.info(f"频率限制：{key} 距上次转发不足1秒，延迟 {wait_time:.2f} 秒后发送。")
-                        await asyncio.sleep(wait_time)
-                    last_forward_time[key] = time.time()
-                    logger.info(f"命中文字规则: ({sid}, '{keyword}') -> {target_id}. 转发消息: '{event.message.text[:50]}...'")
-                    await safe_forward_message(event.message, target_id, client)
-                    text_processed = True
-                    break # 命中一个规则后停止，避免重复转发
-            if not text_processed:
+            # 只取最先添加的命中规则，避免重复转发
+            hit = routing.match_text(source_id, event.message.text)
+            if hit:
+                keyword, target_id = hit
+                logger.info(f"命中文字规则: ({source_id}, '{keyword}') -> {target_id}. 转发消息: '{event.message.text[:50]}...'")
+                await scheduler.forward(event.message, target_id)
+            else:
                 logger.debug(f"[DEBUG] No text rule hit for chat_id={source_id}, text='{event.message.text[:50]}...'")
     except Exception as e:
         logger.error(f"处理消息时发生未预期错误: {str(e)}", exc_info=True) # 打印完整堆栈
@@ -198,14 +170,7 @@ async def handle_message(event, client, account_config, account_name, db_account
         # 或者可以只在私聊中回复错误
         if is_private and await check_admin(event, account_config): # 仅管理员私聊时回复错误
             await event.respond(f"处理消息时发生错误: {str(e)}")
-
-async def safe_forward_message(message, target_id, client):
-    """安全转发消息，自动兼容 int/用户名两种写法，并捕获实体找不到等异常"""
-    try:
-        if isinstance(target_id, str) and target_id.lstrip('-').isdigit():
-            target_id = int(target_id)
-        await message.forward_to(target_id)
-    except ValueError as e:
-        logger.error(f"无法找到目标实体 {target_id}，请确保机器人已与目标建立对话或在群组/频道内。错误: {e}")
-    except Exception as e:
-        logger.error(f"转发消息到 {target_id} 时出错: {e}")
\ No newline at end of file
+    finally:
+        if message_row is not None:
+            await message_buffer.add(message_row)
+            logger.debug(f"[DEBUG] Message {event.message.id} from {event.chat_id} queued for DB.")
@@ -1,6 +1,7 @@
 import logging
 import yaml
 from modules.check_admin_utils import check_admin
+from modules.routing_index import invalidate_routing_index
 
 
 logging.basicConfig(
@@ -24,6 +25,7 @@ async def handle_watch_text_command(event, client, account_config, account_name,
         target_id = str(args[2].strip())
         keyword = args[3]
         text_watch_rules[(source_id, keyword)] = target_id
+        invalidate_routing_index(account_name)
         persist_rules(account_name, text_watch_rules, media_watch_rules)
         await event.respond(f"已添加文字监控: 源: `{source_id}` -> 目标: `{target_id}`，关键词: `{keyword}`", parse_mode='markdown')
     except Exception as e:
@@ -74,6 +76,7 @@ async def handle_unwatch_text_command(event, client, account_config, account_nam
         key = (source_id, keyword)
         if key in text_watch_rules:
             del text_watch_rules[key]
+            invalidate_routing_index(account_name)
             persist_rules(account_name, text_watch_rules, media_watch_rules)
             await event.respond(f"已删除文字监控: 源: `{source_id}` 关键词: `{keyword}`", parse_mode='markdown')
         else:
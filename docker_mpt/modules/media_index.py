@@ -0,0 +1,267 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.base import SessionLocal, write_behind
+from db.message_buffer import MessageBuffer
+from db.models import MediaIndexEntry, MediaIndexState
+from modules.offset_utils import is_media_type
+
+logger = logging.getLogger(__name__)
+
+# 每种 type 过滤对应一位，与 is_media_type 的判断一致
+MEDIA_TYPE_BITS = {
+    'all-txt': 1,
+    'all': 2,
+    'media': 4,      # 默认（不指定 type）：图片 + 视频
+    'image': 8,      # photo 与 image 相同
+    'video': 16,
+    'audio': 32,
+    'document': 64,
+    'text': 128,
+}
+BACKFILL_BATCH = 1000  # 回填时每写入这么多条保存一次进度
+
+# 本进程中已同步过的会话，实时消息只追加到这些会话的索引
+_synced = set()
+# 同一会话同时只做一次同步
+_sync_locks = {}
+# 已删除但可能还在写缓冲中的消息 (chat_id, message_id)，写入后立即删掉
+_deleted = set()
+MAX_DELETED = 10000
+
+
+def media_type_bit(media_type):
+    """type 参数对应的位，未知的 type 返回 None"""
+    if media_type in (None, '', 'media'):
+        media_type = 'media'
+    elif media_type == 'photo':
+        media_type = 'image'
+    return MEDIA_TYPE_BITS.get(media_type)
+
+
+def media_mask(message):
+    mask = 0
+    for media_type, bit in MEDIA_TYPE_BITS.items():
+        if is_media_type(message, media_type):
+            mask |= bit
+    return mask
+
+
+def _row(chat_id, message):
+    return {'chat_id': chat_id, 'message_id': message.id, 'media_mask': media_mask(message),
+            'grouped_id': getattr(message, 'grouped_id', None)}
+
+
+def _save_rows(chat_id, rows, max_id=None):
+    """写入索引行（已存在的跳过），max_id 不为 None 时同时推进进度"""
+    with SessionLocal() as session:
+        if rows:
+            dialect = session.get_bind().dialect.name
+            if dialect == 'sqlite':
+                stmt = sqlite.insert(MediaIndexEntry).on_conflict_do_nothing()
+            elif dialect == 'postgresql':
+                stmt = postgresql.insert(MediaIndexEntry).on_conflict_do_nothing()
+            else:
+                stmt = insert(MediaIndexEntry)
+            session.execute(stmt, rows)
+        if max_id is not None:
+            state = session.get(MediaIndexState, chat_id)
+            if state is None:
+                state = MediaIndexState(chat_id=chat_id, max_id=0)
+                session.add(state)
+            if max_id > state.max_id:
+                state.max_id = max_id
+                state.updated_at = datetime.utcnow()
+        session.commit()
+
+
+def _load_max_id(chat_id):
+    with SessionLocal() as session:
+        state = session.get(MediaIndexState, chat_id)
+        return state.max_id if state else None
+
+
+async def ensure_media_index(client, chat_id):
+    """
+    确保 chat_id 的索引是最新的：首次使用时从头回填全部历史，之后只拉取上次进度之后的消息
+    回填按批保存进度，中断后下次从断点继续；返回本次新增的条数
+    """
+    lock = _sync_locks.setdefault(chat_id, asyncio.Lock())
+    async with lock:
+        max_id = await asyncio.to_thread(_load_max_id, chat_id)
+        start_id = max_id or 0
+        if max_id is None:
+            logger.info(f"Building media index for chat {chat_id} from scratch...")
+        added = 0
+        rows = []
+        async for message in client.iter_messages(chat_id, offset_id=start_id, reverse=True):
+            rows.append(_row(chat_id, message))
+            if len(rows) >= BACKFILL_BATCH:
+                await asyncio.to_thread(_save_rows, chat_id, rows, rows[-1]['message_id'])
+                added += len(rows)
+                rows = []
+                logger.info(f"Media index for chat {chat_id}: {added} messages indexed so far.")
+        last_id = rows[-1]['message_id'] if rows else start_id
+        # 没有新消息时也要写入进度，标记该会话已建立索引
+        await asyncio.to_thread(_save_rows, chat_id, rows, last_id)
+        added += len(rows)
+        _synced.add(chat_id)
+        if added:
+            logger.info(f"Media index for chat {chat_id} updated: {added} new messages, up to id {last_id}.")
+        return added
+
+
+def _after_live_insert(session, rows):
+    """
+    实时索引行写入后在同一事务中推进进度：频道/超级群的消息 id 连续，紧接着进度的消息才推进，
+    之后的查询不需要再向服务器补拉；不连续（中间有漏收或已删除的消息、普通群）时只写入这些行，下次查询时从原进度补拉
+    """
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault(row['chat_id'], []).append(row['message_id'])
+    for chat_id, message_ids in by_chat.items():
+        state = session.get(MediaIndexState, chat_id)
+        if state is None:
+            continue
+        max_id = state.max_id
+        for message_id in sorted(message_ids):
+            if message_id == max_id + 1:
+                max_id = message_id
+            elif message_id > max_id:
+                break
+        if max_id > state.max_id:
+            state.max_id = max_id
+            state.updated_at = datetime.utcnow()
+    # 写入前已被删除的消息
+    deleted = [(row['chat_id'], row['message_id']) for row in rows if (row['chat_id'], row['message_id']) in _deleted]
+    for chat_id, message_id in deleted:
+        session.query(MediaIndexEntry).filter(
+            MediaIndexEntry.chat_id == chat_id,
+            MediaIndexEntry.message_id == message_id
+        ).delete(synchronize_session=False)
+        _deleted.discard((chat_id, message_id))
+
+
+# 实时消息的索引写缓冲，与消息记录共用 database.write_behind 配置
+live_buffer = MessageBuffer(
+    SessionLocal,
+    batch_size=int(write_behind.get('batch_size', 500)),
+    flush_interval_ms=int(write_behind.get('flush_interval_ms', 1000)),
+    max_queue=int(write_behind.get('max_queue', 10000)),
+    model=MediaIndexEntry,
+    after_insert=_after_live_insert,
+)
+
+
+def record_live_message(message):
+    """
+    实时消息：只追加到本进程已同步过的会话，交给写缓冲批量写入，不等待数据库
+    缓冲已满时丢弃该行，进度不会越过它，下次查询时从服务器补拉
+    """
+    chat_id = message.chat_id
+    if chat_id not in _synced:
+        return
+    if not live_buffer.add_nowait(_row(chat_id, message)):
+        logger.debug(f"[DEBUG] Media index buffer full, live message {message.id} of chat {chat_id} left for catch-up.")
+
+
+async def remove_messages(chat_id, message_ids):
+    """消息被删除后从索引中移除，保证 offset 计数与服务器一致（本进程未同步过的会话也要删除）"""
+    if not message_ids:
+        return
+    if chat_id in _synced:
+        if len(_deleted) > MAX_DELETED:
+            _deleted.clear()
+        _deleted.update((chat_id, message_id) for message_id in message_ids)
+
+    def delete():
+        with SessionLocal() as session:
+            session.query(MediaIndexEntry).filter(
+                MediaIndexEntry.chat_id == chat_id,
+                MediaIndexEntry.message_id.in_(list(message_ids))
+            ).delete(synchronize_session=False)
+            session.commit()
+    await asyncio.to_thread(delete)
+
+
+def _matches(bit):
+    return MediaIndexEntry.media_mask.op('&')(bit) != 0
+
+
+def offset_for_id_indexed(chat_id, message_id, media_type=None):
+    """
+    按索引计算消息 id 的 offset：该 id 之前符合类型的消息数
+    :return: (found, offset)
+    """
+    bit = media_type_bit(media_type)
+    if bit is None:
+        return False, 0
+    with SessionLocal() as session:
+        entry = session.get(MediaIndexEntry, (chat_id, message_id))
+        if entry is None or not entry.media_mask & bit:
+            return False, 0
+        offset = session.execute(
+            select(func.count()).select_from(MediaIndexEntry).where(
+                MediaIndexEntry.chat_id == chat_id,
+                MediaIndexEntry.message_id < message_id,
+                _matches(bit))
+        ).scalar()
+        return True, offset
+
+
+def count_media_messages(chat_id, media_type=None, max_id=0):
+    """max_id 及之前符合类型的消息数，即从头跳过到 max_id 为止所需的跳过数量"""
+    bit = media_type_bit(media_type)
+    if bit is None:
+        return 0
+    with SessionLocal() as session:
+        return session.execute(
+            select(func.count()).select_from(MediaIndexEntry).where(
+                MediaIndexEntry.chat_id == chat_id,
+                MediaIndexEntry.message_id <= max_id,
+                _matches(bit))
+        ).scalar()
+
+
+def nth_media_message(chat_id, n, media_type=None, after_id=0):
+    """
+    after_id 之后第 n 条（从 0 开始）符合类型的消息，返回 (message_id, grouped_id)，不足 n+1 条时返回 None
+    """
+    bit = media_type_bit(media_type)
+    if bit is None:
+        return None
+    with SessionLocal() as session:
+        row = session.execute(
+            select(MediaIndexEntry.message_id, MediaIndexEntry.grouped_id).where(
+                MediaIndexEntry.chat_id == chat_id,
+                MediaIndexEntry.message_id > after_id,
+                _matches(bit))
+            .order_by(MediaIndexEntry.message_id).offset(n).limit(1)
+        ).first()
+        return tuple(row) if row else None
+
+
+def album_last_id(chat_id, grouped_id):
+    with SessionLocal() as session:
+        return session.execute(
+            select(func.max(MediaIndexEntry.message_id)).where(
+                MediaIndexEntry.chat_id == chat_id,
+                MediaIndexEntry.grouped_id == grouped_id)
+        ).scalar()
+
+
+def index_summary(chat_id):
+    """返回 (已索引的消息数, 进度 max_id, {type: 条数})"""
+    with SessionLocal() as session:
+        total = session.execute(select(func.count()).select_from(MediaIndexEntry).where(MediaIndexEntry.chat_id == chat_id)).scalar()
+        state = session.get(MediaIndexState, chat_id)
+        counts = {}
+        for media_type, bit in MEDIA_TYPE_BITS.items():
+            counts[media_type] = session.execute(
+                select(func.count()).select_from(MediaIndexEntry).where(MediaIndexEntry.chat_id == chat_id, _matches(bit))
+            ).scalar()
+        return total, state.max_id if state else None, counts
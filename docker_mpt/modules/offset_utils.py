@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telethon.tl.types import MessageMediaWebPage
 from .check_admin_utils import check_admin
@@ -73,18 +74,14 @@ def is_media_type(message, media_type=None):
 async def offset_for_id(client, chat_id, target_message_id, media_type=None):
     """
     计算某消息id在历史消息中的offset，type同/batch_forward
+    查询本地媒体索引（见 media_index），只有首次使用或有新消息时才向服务器拉取
     :param client: Telethon client
     :param chat_id: 群组/频道id
     :param target_message_id: 目标消息id
     :param media_type: 过滤类型
     :return: (found, offset)
     """
-    offset = 0
-    found = False
-    async for message in client.iter_messages(chat_id, reverse=True):
-        if is_media_type(message, media_type):
-            if message.id == target_message_id:
-                found = True
-                break
-            offset += 1
-    return found, offset
+    # media_index 依赖本模块的 is_media_type，在函数内导入避免循环导入
+    from .media_index import ensure_media_index, offset_for_id_indexed
+    await ensure_media_index(client, chat_id)
+    return await asyncio.to_thread(offset_for_id_indexed, chat_id, target_message_id, media_type)
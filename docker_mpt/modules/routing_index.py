@@ -0,0 +1,113 @@
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 每个账号一份路由索引，规则或配置修改后失效，下一条消息到来时重建
+_indexes = {}
+
+
+class KeywordMatcher:
+    """
+    同一来源的文字规则，用 Aho-Corasick 自动机匹配所有关键词
+    匹配耗时只与消息长度有关，与关键词数量无关；
+    命中多个关键词时返回最先添加的规则，与逐条检查规则、命中即停止的结果一致
+    """
+
+    def __init__(self, rules):
+        # rules: [(keyword, target_id)]，按规则添加顺序
+        self.targets = [target_id for _, target_id in rules]
+        # '*'（以及空关键词）匹配任意文字
+        self.wildcard = min((order for order, (keyword, _) in enumerate(rules) if keyword in ('*', '')), default=None)
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]  # 到达该状态时命中的最早规则（包含 fail 链上的后缀）
+        for order, (keyword, _) in enumerate(rules):
+            if keyword in ('*', ''):
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(None)
+                state = next_state
+            if self.best[state] is None or order < self.best[state]:
+                self.best[state] = order
+        # 按层序计算 fail 指针，并把后缀状态的命中合并进来
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                inherited = self.best[self.fail[next_state]]
+                if inherited is not None and (self.best[next_state] is None or inherited < self.best[next_state]):
+                    self.best[next_state] = inherited
+                queue.append(next_state)
+
+    def match(self, text):
+        """返回 (规则序号, target_id)，没有命中返回 None"""
+        best = self.wildcard
+        if best != 0 and len(self.goto) > 1:
+            goto, fail, outputs = self.goto, self.fail, self.best
+            state = 0
+            for char in text:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                order = outputs[state]
+                if order is not None and (best is None or order < best):
+                    best = order
+                    if best == 0:
+                        break
+        if best is None:
+            return None
+        return best, self.targets[best]
+
+
+class RoutingIndex:
+    """handle_message 热路径使用的预编译路由：监控的群组集合、机器人用户名集合、每个来源的关键词自动机"""
+
+    def __init__(self, account_config, text_watch_rules):
+        monitoring = account_config.get('monitoring', {})
+        self.enabled_chats = frozenset(str(cid) for cid in monitoring.get('enabled_chats', []))
+        self.bot_usernames = frozenset(monitoring.get('bot_usernames', []))
+        rules_by_source = {}
+        for (sid, keyword), target_id in text_watch_rules.items():
+            rules_by_source.setdefault(sid, []).append((keyword, target_id))
+        self.keywords = {sid: KeywordMatcher(rules) for sid, rules in rules_by_source.items()}
+        self.rule_keywords = {sid: [keyword for keyword, _ in rules] for sid, rules in rules_by_source.items()}
+
+    def is_chat_enabled(self, source_id):
+        """未配置 enabled_chats 时监控所有群组/频道"""
+        return not self.enabled_chats or source_id in self.enabled_chats
+
+    def match_text(self, source_id, text):
+        """返回 (keyword, target_id)，没有命中返回 None"""
+        matcher = self.keywords.get(source_id)
+        if matcher is None or not text:
+            return None
+        hit = matcher.match(text)
+        if hit is None:
+            return None
+        order, target_id = hit
+        return self.rule_keywords[source_id][order], target_id
+
+
+def get_routing_index(account_name, account_config, text_watch_rules):
+    index = _indexes.get(account_name)
+    if index is None:
+        index = _indexes[account_name] = RoutingIndex(account_config, text_watch_rules)
+        logger.info(f"Routing index rebuilt for account {account_name}: {len(index.enabled_chats)} enabled chats, {len(text_watch_rules)} text rules.")
+    return index
+
+
+def invalidate_routing_index(account_name):
+    """文字规则或监控配置修改后调用"""
+    _indexes.pop(account_name, None)